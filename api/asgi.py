@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:15:47 2026
+
+@author: andreadesogus
+"""
+
+import asyncio
+import contextlib
+import logging
+import time
+
+from starlette.applications import Starlette
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from api import http_cache
+from api.formats import (
+    UnsupportedFormatError, negotiate_batch_format, negotiate_format, serialize, serialize_batch_result
+)
+from core import metrics, singleflight
+from core.aggregation import AggregationError, parse_aggregation
+from core.series_store import PERIOD_RE, get_series_store
+from core.shared_cache import get_shared_store
+from core.async_downloader import get_async_transport
+from core.downloader import DownloadError
+from services.async_service import (
+    AsyncBatchDataRetriever, AsyncDataflowRetriever, AsyncFiltersRetriever, AsyncDataRetriever
+)
+from services.batch_service import error_status, parse_batch
+from services.warmup import get_scheduler, start_warmup
+
+logging.basicConfig(level=logging.INFO)
+
+
+class TimingMiddleware:
+    """
+    Middleware ASGI che aggiunge l'header Server-Timing con le durate delle fasi della richiesta
+    e registra la durata complessiva in istat_request_duration_seconds.
+    """
+
+    def __init__(self, app, paths) -> None:
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings, token = metrics.start_request()
+        status = 500
+
+        async def send_with_timing(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.header().encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            endpoint = scope["path"] if scope["path"] in self.paths else "other"
+            metrics.REQUEST_SECONDS.observe(timings.elapsed(), endpoint=endpoint, method=scope["method"], status=status)
+            metrics.end_request(token)
+
+
+class HttpCacheMiddleware:
+    """
+    Middleware ASGI con ETag, 304 sulle richieste condizionali, Cache-Control e compressione,
+    come l'app Flask. Le risposte inviate in più parti (streaming) passano invariate.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start_message = None
+        streaming = False
+
+        async def send_cached(message) -> None:
+            nonlocal start_message, streaming
+            if message["type"] == "http.response.start":
+                start_message = message
+            elif message["type"] != "http.response.body" or streaming:
+                await send(message)
+            elif message.get("more_body", False):
+                # Risposta in streaming: si inoltra così com'è
+                streaming = True
+                await send(start_message)
+                await send(message)
+            else:
+                await self._finish(scope, start_message, message.get("body", b""), send)
+
+        await self.app(scope, receive, send_cached)
+
+    async def _finish(self, scope, start_message, body: bytes, send) -> None:
+        response_headers = MutableHeaders(raw=list(start_message.get("headers", [])))
+        status, body, headers = await asyncio.to_thread(
+            http_cache.apply, scope["method"], scope["path"], start_message["status"], body,
+            response_headers.get("content-type"), Headers(scope=scope)
+        )
+        for name, value in headers.items():
+            if name == "Vary":
+                response_headers.add_vary_header(value)
+            else:
+                response_headers[name] = value
+        response_headers["content-length"] = str(len(body))
+        await send(dict(start_message, status=status, headers=response_headers.raw))
+        await send({"type": "http.response.body", "body": body})
+
+
+async def get_dataflows(request: Request):
+    return PlainTextResponse("Benvenuto nell'app ASGI!")
+
+
+async def get_index_data(request: Request):
+    try:
+        string = request.query_params.get("string")
+        limit = request.query_params.get("limit")
+        if limit is not None:
+            if not limit.isdigit() or int(limit) <= 0:
+                return JSONResponse({"error": "Il parametro limit deve essere un intero positivo"}, status_code=400)
+            limit = int(limit)
+        res = await AsyncDataflowRetriever().parse_dataflows(string or None, limit=limit)
+        return JSONResponse(res)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def get_filter_dict(request: Request):
+    try:
+        start_time = time.time()
+        logging.info("API /api/filters called")
+        dataflow_id = request.query_params.get("dataflow_id")
+        ref_id = request.query_params.get("ref_id")
+
+        if not dataflow_id or not ref_id:
+            return JSONResponse({"error": "I parametri dataflow_id e ref_id sono obbligatori"}, status_code=400)
+
+        filters_dict = await AsyncFiltersRetriever(dataflow_id, ref_id).get_filters_dictionary()
+
+        logging.info("Received response in %s seconds", time.time() - start_time)
+        return JSONResponse(filters_dict)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def get_data(request: Request):
+    try:
+        data = await request.json()
+
+        dataflow_id = data.get("dataflow_id")
+        ref_id = data.get("ref_id")
+
+        filters_dict = data.get("filters", {})
+
+        if not dataflow_id or not ref_id:
+            return JSONResponse({"error": "I parametri dataflow_id e ref_id sono obbligatori"}, status_code=400)
+
+        if not isinstance(filters_dict, dict):
+            return JSONResponse({"error": "Invalid input, expected a dictionary"}, status_code=400)
+
+        start_period = data.get("startPeriod") or request.query_params.get("startPeriod")
+        end_period = data.get("endPeriod") or request.query_params.get("endPeriod")
+        for period in (start_period, end_period):
+            if period is not None and not PERIOD_RE.match(str(period)):
+                return JSONResponse({"error": f"Periodo non valido: {period}"}, status_code=400)
+        aggregation = parse_aggregation(data, request.query_params)
+
+        output_format = negotiate_format(
+            data.get("format") or request.query_params.get("format"),
+            request.headers.get("Accept")
+        )
+        df = await AsyncDataRetriever(dataflow_id, ref_id, filters_dict).get_data(start_period, end_period, aggregation)
+        body, mimetype = serialize(df, output_format)
+        return Response(body, media_type=mimetype)
+
+    except UnsupportedFormatError as e:
+        return JSONResponse({"error": str(e)}, status_code=406)
+    except AggregationError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except DownloadError as e:
+        # 404 se il web service non ha dati per la richiesta, 502 per gli altri errori del web service
+        return JSONResponse({"error": str(e)}, status_code=error_status(e))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def _batch_stream(results, output_format):
+    async for result in results:
+        line = await asyncio.to_thread(serialize_batch_result, result, output_format)
+        yield line + b"\n"
+
+
+async def get_data_batch(request: Request):
+    try:
+        data = await request.json()
+        options = data if isinstance(data, dict) else {}
+        output_format = negotiate_batch_format(options.get("format") or request.query_params.get("format"))
+        try:
+            queries = parse_batch(data)
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+
+        batch = AsyncBatchDataRetriever(queries)
+        if options.get("stream", True):
+            return StreamingResponse(_batch_stream(batch.iter_results(), output_format),
+                                     media_type="application/x-ndjson")
+        results = await batch.results()
+        body = await asyncio.to_thread(
+            lambda: b",".join(serialize_batch_result(result, output_format) for result in results)
+        )
+        return Response(b'{"results":[' + body + b"]}", media_type="application/json")
+
+    except UnsupportedFormatError as e:
+        return JSONResponse({"error": str(e)}, status_code=406)
+
+
+async def get_stats(request: Request):
+    store = get_shared_store()
+    shared_stats = await asyncio.to_thread(store.stats) if store is not None else None
+    series_store = get_series_store()
+    series_stats = await asyncio.to_thread(series_store.stats) if series_store is not None else None
+    scheduler = get_scheduler()
+    return JSONResponse({
+        "singleflight": singleflight.stats(),
+        "shared_cache": shared_stats,
+        "series_store": series_stats,
+        "warmup": scheduler.status() if scheduler is not None else None,
+    })
+
+
+async def get_metrics(request: Request):
+    # Lo scrape può interrogare i database SQLite delle cache: viene eseguito in un thread
+    body = await asyncio.to_thread(metrics.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    scheduler = start_warmup()
+    yield
+    if scheduler is not None:
+        scheduler.stop()
+    await get_async_transport().aclose()
+
+
+routes = [
+    Route("/", get_dataflows),
+    Route("/api/dataflow", get_index_data, methods=["GET"]),
+    Route("/api/filters", get_filter_dict, methods=["GET"]),
+    Route("/api/data", get_data, methods=["POST"]),
+    Route("/api/data/batch", get_data_batch, methods=["POST"]),
+    Route("/api/stats", get_stats, methods=["GET"]),
+    Route("/metrics", get_metrics, methods=["GET"]),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(TimingMiddleware, paths=[route.path for route in routes]),
+        Middleware(HttpCacheMiddleware),
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+    ],
+    lifespan=lifespan,
+)
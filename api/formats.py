@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:41:09 2026
+
+@author: andreadesogus
+"""
+
+from __future__ import annotations
+
+import io
+import json
+from typing import TYPE_CHECKING, Callable, Dict, Optional, Tuple
+
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from core import metrics
+from core.lazy import LazyModule
+
+if TYPE_CHECKING:
+    from services.batch_service import BatchResult
+
+pd = LazyModule("pandas")
+
+# Media type associati ai formati di output di /api/data
+MIMETYPES = {
+    "json": "application/json",
+    "columns": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Media type accettati nell'header Accept; a parità di qualità vince il primo (`*/*` indica il JSON)
+ACCEPT_FORMATS = {
+    "application/json": "json",
+    "application/x-ndjson": "ndjson",
+    "text/csv": "csv",
+    "application/vnd.apache.arrow.stream": "arrow",
+    "application/vnd.apache.parquet": "parquet",
+    "application/x-parquet": "parquet",
+}
+
+
+# Formati dei dati nei risultati di /api/data/batch, incorporati in un oggetto JSON per query
+BATCH_FORMATS = ("json", "columns")
+
+
+class UnsupportedFormatError(ValueError):
+    """Formato di output non riconosciuto o non disponibile in questo ambiente."""
+
+
+def negotiate_format(format_param: Optional[str], accept_header: Optional[str]) -> str:
+    """
+    Determina il formato di output: il parametro `format` ha la precedenza sull'header Accept.
+    In assenza di entrambi viene usato il JSON a record. L'header Accept viene valutato con i pesi `q`;
+    se nessun formato supportato è accettato (q>0) viene sollevato UnsupportedFormatError.
+    """
+    if format_param:
+        fmt = format_param.lower()
+        if fmt not in MIMETYPES:
+            raise UnsupportedFormatError(
+                f"Formato '{format_param}' non supportato. Formati disponibili: {', '.join(MIMETYPES)}"
+            )
+        return fmt
+    if not accept_header or not accept_header.strip():
+        return "json"
+    mimetype = parse_accept_header(accept_header, MIMEAccept).best_match(ACCEPT_FORMATS)
+    if mimetype is None:
+        raise UnsupportedFormatError(
+            f"Nessun formato disponibile per Accept: {accept_header}. Media type supportati: {', '.join(ACCEPT_FORMATS)}"
+        )
+    return ACCEPT_FORMATS[mimetype]
+
+
+def to_json_records(df: pd.DataFrame) -> bytes:
+    """Lista di record JSON (formato storico di /api/data); i NaN diventano null."""
+    return df.to_json(orient="records").encode("utf-8")
+
+
+def to_ndjson(df: pd.DataFrame) -> bytes:
+    """Un record JSON per riga, come le risposte in streaming di /api/data."""
+    lines = df.to_json(orient="records", lines=True)
+    if not lines.strip():
+        return b""
+    return (lines if lines.endswith("\n") else lines + "\n").encode("utf-8")
+
+
+def to_json_columns(df: pd.DataFrame) -> bytes:
+    """JSON colonnare compatto: un oggetto con una lista di valori per colonna."""
+    parts = (json.dumps(str(col)) + ":" + df[col].to_json(orient="values") for col in df.columns)
+    return ("{" + ",".join(parts) + "}").encode("utf-8")
+
+
+def to_csv(df: pd.DataFrame) -> bytes:
+    return df.to_csv(index=False).encode("utf-8")
+
+
+def _arrow_table(df: pd.DataFrame):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise UnsupportedFormatError("I formati Arrow e Parquet richiedono il pacchetto pyarrow.")
+    # Le colonne Categorical diventano array dictionary-encoded
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def to_arrow(df: pd.DataFrame) -> bytes:
+    """Arrow IPC stream format."""
+    table = _arrow_table(df)
+    import pyarrow as pa
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def to_parquet(df: pd.DataFrame) -> bytes:
+    table = _arrow_table(df)
+    import pyarrow.parquet as pq
+
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression="zstd")
+    return buffer.getvalue()
+
+
+SERIALIZERS: Dict[str, Callable[[pd.DataFrame], bytes]] = {
+    "json": to_json_records,
+    "columns": to_json_columns,
+    "ndjson": to_ndjson,
+    "csv": to_csv,
+    "arrow": to_arrow,
+    "parquet": to_parquet,
+}
+
+
+def serialize(df: pd.DataFrame, fmt: str) -> Tuple[bytes, str]:
+    """Serializza il DataFrame nel formato indicato e ritorna (corpo, media type)."""
+    with metrics.stage("serialize"):
+        return SERIALIZERS[fmt](df), MIMETYPES[fmt]
+
+
+def negotiate_batch_format(format_param: Optional[str]) -> str:
+    """Formato dei dati di /api/data/batch: JSON a record (default) o colonnare."""
+    fmt = (format_param or "json").lower()
+    if fmt not in BATCH_FORMATS:
+        raise UnsupportedFormatError(
+            f"Formato '{format_param}' non supportato per il batch. Formati disponibili: {', '.join(BATCH_FORMATS)}"
+        )
+    return fmt
+
+
+def serialize_batch_result(result: BatchResult, fmt: str) -> bytes:
+    """
+    Oggetto JSON con l'esito di una query del batch: posizione, stato, eventuale `id` indicato dal client
+    e i dati (nel formato `fmt`, come in /api/data) oppure il messaggio d'errore.
+    """
+    head = {"index": result.index, "status": result.status}
+    if result.id is not None:
+        head["id"] = result.id
+    if result.error is not None:
+        head["error"] = result.error
+        return json.dumps(head).encode("utf-8")
+    head["rows"] = len(result.data)
+    with metrics.stage("serialize"):
+        return json.dumps(head)[:-1].encode("utf-8") + b',"data":' + SERIALIZERS[fmt](result.data) + b"}"
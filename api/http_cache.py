@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 09:12:40 2026
+
+@author: andreadesogus
+"""
+
+import gzip
+import hashlib
+import os
+from typing import Dict, Optional, Tuple
+
+from core import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Validità lato client (Cache-Control max-age) delle risposte GET, in secondi
+MAX_AGE_DATAFLOW = int(os.environ.get("ISTAT_HTTP_MAX_AGE_DATAFLOW", 3600))
+MAX_AGE_FILTERS = int(os.environ.get("ISTAT_HTTP_MAX_AGE_FILTERS", 3600))
+# Dimensione minima del corpo (in byte) oltre la quale la risposta viene compressa
+COMPRESS_MIN_BYTES = int(os.environ.get("ISTAT_COMPRESS_MIN_BYTES", 1024))
+GZIP_LEVEL = int(os.environ.get("ISTAT_GZIP_LEVEL", 5))
+BROTLI_QUALITY = int(os.environ.get("ISTAT_BROTLI_QUALITY", 4))
+
+# Cache-Control per endpoint. I metadati possono essere riusati dal client per max-age e poi rivalidati
+# con l'ETag; i dati (POST) non vengono memorizzati dai browser, ma l'ETag permette di riconoscere
+# risultati invariati.
+CACHE_CONTROL = {
+    "/api/dataflow": f"public, max-age={MAX_AGE_DATAFLOW}",
+    "/api/filters": f"public, max-age={MAX_AGE_FILTERS}",
+    "/api/data": "no-cache",
+    "/api/data/batch": "no-cache",
+}
+
+# Formati già compressi: comprimerli di nuovo costa CPU senza ridurre la dimensione
+_INCOMPRESSIBLE = ("application/vnd.apache.parquet",)
+
+
+def etag_for(body: bytes) -> str:
+    """
+    ETag debole ricavato dal contenuto non compresso: resta lo stesso per tutte le codifiche
+    (gzip, br, identity) della stessa risposta.
+    """
+    return 'W/"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Confronto debole tra l'header If-None-Match (anche con più valori o "*") e l'ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Codifica da usare secondo Accept-Encoding: "br" (se disponibile il pacchetto brotli), "gzip" o None."""
+    accepted = {}
+    for item in (accept_encoding or "").lower().split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name] = quality
+    for encoding in (("br", "gzip") if brotli is not None else ("gzip",)):
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    with metrics.stage("compress"):
+        if encoding == "br":
+            return brotli.compress(body, quality=BROTLI_QUALITY)
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def apply(method: str, path: str, status: int, body: bytes, content_type: Optional[str],
+          request_headers: Dict[str, str]) -> Tuple[int, bytes, Dict[str, str]]:
+    """
+    Applica validatori, Cache-Control e compressione a una risposta non in streaming.
+
+    Ritorna (stato, corpo, header da aggiungere). Le risposte 200 ricevono un ETag; per GET e HEAD
+    un If-None-Match corrispondente produce un 304 senza corpo. I corpi più grandi di
+    ISTAT_COMPRESS_MIN_BYTES vengono compressi con brotli o gzip se il client li accetta.
+    """
+    compressible = not (content_type or "").startswith(_INCOMPRESSIBLE)
+    headers: Dict[str, str] = {}
+    if compressible:
+        headers["Vary"] = "Accept-Encoding"
+    if status == 200:
+        etag = etag_for(body)
+        headers["ETag"] = etag
+        if path in CACHE_CONTROL:
+            headers["Cache-Control"] = CACHE_CONTROL[path]
+        if method in ("GET", "HEAD") and etag_matches(request_headers.get("If-None-Match"), etag):
+            return 304, b"", headers
+    if compressible:
+        encoding = choose_encoding(request_headers.get("Accept-Encoding"))
+        if encoding is not None and len(body) >= COMPRESS_MIN_BYTES:
+            body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+    return status, body, headers
@@ -8,18 +8,99 @@ Created on Sat Mar  1 13:09:44 2025
 
 import os
 import time
+import itertools
 import logging
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 
+from api import http_cache
+from api.formats import (
+    UnsupportedFormatError, negotiate_batch_format, negotiate_format, serialize, serialize_batch_result
+)
+from core import metrics, singleflight
+from core.aggregation import AggregationError, parse_aggregation
+from core.downloader import DownloadError
+from core.profiler import get_profiler
+from core.series_store import PERIOD_RE, get_series_store
+from core.shared_cache import get_shared_store
+from services.batch_service import BatchDataRetriever, error_status, parse_batch
 from services.dataflow_service import DataflowRetriever, FiltersRetriever, DataRetriever
+from services.warmup import get_scheduler, start_warmup
 
 app = Flask(__name__)
 CORS(app)
 
 logging.basicConfig(level=logging.INFO)
 
+profiler = get_profiler()
+
+
+@app.before_request
+def ensure_warmup():
+    """
+    Avvia il warm-up del worker alla prima richiesta, se non è già partito dall'hook di gunicorn
+    (gunicorn.conf.py): importare il modulo non avvia thread in background.
+    """
+    if get_scheduler() is None:
+        start_warmup()
+
+
+@app.before_request
+def start_timings():
+    g.timings, g.timings_token = metrics.start_request()
+    if profiler is not None:
+        profiler.begin()
+
+
+@app.after_request
+def add_server_timing(response):
+    """
+    Riporta le durate delle fasi nell'header Server-Timing e registra la durata della richiesta.
+    Per le risposte in streaming le durate si fermano all'invio degli header.
+    """
+    timings = g.get("timings")
+    if timings is not None:
+        response.headers["Server-Timing"] = timings.header()
+        metrics.REQUEST_SECONDS.observe(
+            timings.elapsed(), endpoint=_endpoint_label(), method=request.method, status=response.status_code
+        )
+    return response
+
+
+@app.teardown_request
+def end_timings(exc):
+    token = g.pop("timings_token", None)
+    if token is not None:
+        metrics.end_request(token)
+    if profiler is not None:
+        profiler.end(f"{request.method} {_endpoint_label()}")
+
+
+# Flask esegue gli after_request in ordine inverso: la compressione rientra nelle durate di Server-Timing
+@app.after_request
+def add_http_caching(response):
+    """ETag, 304 sulle richieste condizionali, Cache-Control e compressione delle risposte non in streaming."""
+    if response.is_streamed or response.direct_passthrough:
+        return response
+    status, body, headers = http_cache.apply(
+        request.method, request.path, response.status_code, response.get_data(), response.mimetype, request.headers
+    )
+    response.status_code = status
+    response.set_data(body)
+    for name, value in headers.items():
+        if name == "Vary":
+            response.vary.add(value)
+        else:
+            response.headers[name] = value
+    return response
+
+
+def _endpoint_label():
+    # La regola della route e non il percorso, per non creare una serie per ogni URL non valido
+    return request.url_rule.rule if request.url_rule is not None else "other"
+
+
 @app.route("/")
 def get_dataflows():
     return "Benvenuto nell'app Flask!"
@@ -28,11 +109,16 @@ def get_dataflows():
 def get_index_data():
     try: 
         string = request.args.get("string")
+        limit = request.args.get("limit")
+        if limit is not None:
+            if not limit.isdigit() or int(limit) <= 0:
+                return jsonify({"error": "Il parametro limit deve essere un intero positivo"}), 400
+            limit = int(limit)
         dfr = DataflowRetriever()        
         if not string:
-            res = dfr.parse_dataflows()
+            res = dfr.parse_dataflows(limit=limit)
         else:
-            res = dfr.parse_dataflows(string)
+            res = dfr.parse_dataflows(string, limit=limit)
         return jsonify(res)
 
     except ValueError as e:
@@ -58,6 +144,73 @@ def get_filter_dict():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/api/filters/match", methods=["POST"])
+def match_filters():
+    try:
+        data = request.get_json()
+        
+        dataflow_id = data.get("dataflow_id")
+        ref_id = data.get("ref_id")
+        filters = data.get("filters", {})
+        
+        if not dataflow_id or not ref_id:
+            return jsonify({"error": "I parametri dataflow_id e ref_id sono obbligatori"}), 400
+        
+        filters_list = filters if isinstance(filters, list) else [filters]
+        if not all(isinstance(f, dict) for f in filters_list):
+            return jsonify({"error": "Invalid input, expected a dictionary or a list of dictionaries"}), 400
+
+        keys_limit = data.get("keys")
+        if keys_limit is not None and (isinstance(keys_limit, bool) or not isinstance(keys_limit, int) or keys_limit <= 0):
+            return jsonify({"error": "Il parametro keys deve essere un intero positivo"}), 400
+        
+        fr = FiltersRetriever(dataflow_id, ref_id)
+        results = fr.match_filters(
+            filters_list,
+            keys_limit=keys_limit,
+            facets=bool(data.get("facets"))
+        )
+        return jsonify({"total": len(fr.series_keys), "results": results})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 500
+
+
+def _stream_mode(stream_param, output_format):
+    """
+    Determina la modalità di streaming per /api/data: "ndjson" (una riga JSON per osservazione),
+    "json" (array JSON inviato a blocchi) oppure None per la risposta classica.
+    """
+    if stream_param in ("ndjson", "json"):
+        return stream_param
+    if output_format == "ndjson" or (stream_param is True and output_format == "json"):
+        return "ndjson"
+    return None
+
+
+def _with_first(first_chunk, chunks):
+    return itertools.chain([first_chunk] if first_chunk is not None else [], chunks)
+
+
+def _ndjson_stream(first_chunk, chunks):
+    """Serializza i blocchi del DataFrame come NDJSON man mano che vengono prodotti."""
+    for chunk in _with_first(first_chunk, chunks):
+        lines = chunk.to_json(orient="records", lines=True)
+        if lines.strip():
+            yield lines if lines.endswith("\n") else lines + "\n"
+
+
+def _json_array_stream(first_chunk, chunks):
+    """Serializza i blocchi del DataFrame come un unico array JSON inviato a pezzi."""
+    yield "["
+    separator = ""
+    for chunk in _with_first(first_chunk, chunks):
+        records = chunk.to_json(orient="records")[1:-1]
+        if records:
+            yield separator + records
+            separator = ","
+    yield "]"
+
+
 @app.route("/api/data", methods=["POST"])
 def get_data():
     try:
@@ -74,12 +227,94 @@ def get_data():
         if not isinstance(filters_dict, dict):
             return jsonify({"error": "Invalid input, expected a dictionary"}), 400
         
+        start_period = data.get("startPeriod") or request.args.get("startPeriod")
+        end_period = data.get("endPeriod") or request.args.get("endPeriod")
+        for period in (start_period, end_period):
+            if period is not None and not PERIOD_RE.match(str(period)):
+                return jsonify({"error": f"Periodo non valido: {period}"}), 400
+        aggregation = parse_aggregation(data, request.args)
+
+        output_format = negotiate_format(
+            data.get("format") or request.args.get("format"),
+            request.headers.get("Accept")
+        )
         data_ret = DataRetriever(dataflow_id, ref_id, filters_dict)
-        df = data_ret.get_data()
-        return df.to_dict(orient="records")  
+
+        # I dati aggregati richiedono l'intero dataset: lo streaming non si applica
+        stream_mode = _stream_mode(data.get("stream"), output_format) if aggregation is None else None
+        if stream_mode:
+            chunks = data_ret.iter_data(start_period=start_period, end_period=end_period)
+            # Il primo blocco viene letto subito: gli errori di download emergono prima dell'invio.
+            # Una finestra senza osservazioni non produce blocchi e dà una risposta vuota
+            first_chunk = next(chunks, None)
+            if stream_mode == "ndjson":
+                return Response(_ndjson_stream(first_chunk, chunks), mimetype="application/x-ndjson")
+            return Response(_json_array_stream(first_chunk, chunks), mimetype="application/json")
+
+        df = data_ret.get_data(start_period, end_period, aggregation)
+        body, mimetype = serialize(df, output_format)
+        return Response(body, mimetype=mimetype)
     
+    except UnsupportedFormatError as e:
+        return jsonify({"error": str(e)}), 406
+    except AggregationError as e:
+        return jsonify({"error": str(e)}), 400
+    except DownloadError as e:
+        # 404 se il web service non ha dati per la richiesta, 502 per gli altri errori del web service
+        return jsonify({"error": str(e)}), error_status(e)
     except ValueError as e:
         return jsonify({"error": str(e)}), 500
+
+
+def _batch_stream(results, output_format):
+    """Una riga JSON per query, inviata appena la query termina."""
+    for result in results:
+        yield serialize_batch_result(result, output_format) + b"\n"
+
+
+@app.route("/api/data/batch", methods=["POST"])
+def get_data_batch():
+    """
+    Esegue più query di /api/data in parallelo. Di default ritorna NDJSON con una riga per query
+    in ordine di completamento; con "stream": false un unico oggetto {"results": [...]} in ordine.
+    """
+    try:
+        data = request.get_json()
+        options = data if isinstance(data, dict) else {}
+        output_format = negotiate_batch_format(options.get("format") or request.args.get("format"))
+        try:
+            queries = parse_batch(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        batch = BatchDataRetriever(queries)
+        if options.get("stream", True):
+            return Response(_batch_stream(batch.iter_results(), output_format), mimetype="application/x-ndjson")
+        body = b",".join(serialize_batch_result(result, output_format) for result in batch.results())
+        return Response(b'{"results":[' + body + b"]}", mimetype="application/json")
+
+    except UnsupportedFormatError as e:
+        return jsonify({"error": str(e)}), 406
+
+
+@app.route("/api/stats", methods=["GET"])
+def get_stats():
+    """Contatori dell'accorpamento delle richieste, delle cache condivise e del warm-up nel worker corrente."""
+    store = get_shared_store()
+    series_store = get_series_store()
+    scheduler = get_scheduler()
+    return jsonify({
+        "singleflight": singleflight.stats(),
+        "shared_cache": store.stats() if store is not None else None,
+        "series_store": series_store.stats() if series_store is not None else None,
+        "warmup": scheduler.status() if scheduler is not None else None,
+    })
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Metriche del worker corrente nel formato testuale di Prometheus."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
         
       
 
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:20:41 2026
+
+@author: andreadesogus
+"""
+
+import itertools
+import random
+from typing import Iterator, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+MESSAGE_NS = "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message"
+STRUCTURE_NS = "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure"
+COMMON_NS = "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/common"
+GENERIC_NS = "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/data/generic"
+
+_STRUCTURE_OPEN = (
+    f'<?xml version="1.0" encoding="UTF-8"?>'
+    f'<message:Structure xmlns:message="{MESSAGE_NS}" xmlns:structure="{STRUCTURE_NS}" '
+    f'xmlns:common="{COMMON_NS}"><message:Header><message:ID>BENCH</message:ID></message:Header>'
+    f'<message:Structures>'
+)
+_STRUCTURE_CLOSE = "</message:Structures></message:Structure>"
+
+_WORDS = [
+    "popolazione", "residente", "occupati", "disoccupazione", "tasso", "prezzi", "consumo", "imprese",
+    "agricoltura", "commercio", "estero", "industria", "servizi", "turismo", "istruzione", "sanità",
+    "reddito", "famiglie", "comuni", "regioni", "città", "attività", "produzione", "trasporti",
+]
+
+
+class SyntheticDataflow:
+    """
+    Dataflow sintetico e deterministico (a parità di `seed`) per benchmark e server di prova.
+
+    Le dimensioni sono FREQ (sempre "A" o "M") seguita da `n_dims - 1` dimensioni con `n_codes`
+    codici ciascuna. Le serie sono le prime `n_series` combinazioni dei codici in ordine casuale,
+    ognuna con `n_periods` osservazioni a partire da `start_year`.
+    """
+
+    def __init__(self, n_series: int = 2_000, n_periods: int = 120, n_dims: int = 6, n_codes: int = 40,
+                 freq: str = "M", start_year: int = 2000, seed: int = 42) -> None:
+        self.n_series = n_series
+        self.n_periods = n_periods
+        self.freq = freq
+        self.start_year = start_year
+        self.seed = seed
+        self.dimensions: List[Tuple[str, str, List[str]]] = [("FREQ", "CL_FREQ", [freq])]
+        for i in range(1, n_dims):
+            codes = [f"C{i}{j:03d}" for j in range(n_codes)]
+            self.dimensions.append((f"DIM{i}", f"CL_DIM{i}", codes))
+        self._series = self._generate_series()
+
+    def _generate_series(self) -> List[Tuple[str, ...]]:
+        rng = random.Random(self.seed)
+        codes = [list(c) for _, _, c in self.dimensions]
+        total = 1
+        for c in codes:
+            total *= len(c)
+        if self.n_series >= total:
+            return list(itertools.product(*codes))
+        series = set()
+        while len(series) < self.n_series:
+            series.add(tuple(rng.choice(c) for c in codes))
+        return sorted(series)
+
+    @property
+    def dimension_ids(self) -> List[str]:
+        return [d for d, _, _ in self.dimensions]
+
+    def periods(self, start_period: Optional[str] = None, end_period: Optional[str] = None) -> List[str]:
+        """Periodi delle osservazioni, eventualmente limitati alla finestra indicata."""
+        if self.freq == "A":
+            periods = [str(self.start_year + i) for i in range(self.n_periods)]
+        else:
+            periods = [f"{self.start_year + i // 12}-{i % 12 + 1:02d}" for i in range(self.n_periods)]
+        return [
+            p for p in periods
+            if (not start_period or p >= start_period) and (not end_period or p[:len(end_period)] <= end_period)
+        ]
+
+    def series(self, key: str = "") -> Iterator[Tuple[str, ...]]:
+        """Serie che soddisfano la chiave SDMX (campi vuoti = wildcard, valori alternativi con '+')."""
+        fields = key.split(".") if key else []
+        fields += [""] * (len(self.dimensions) - len(fields))
+        allowed = [set(f.split("+")) if f else None for f in fields[:len(self.dimensions)]]
+        for combo in self._series:
+            if all(a is None or value in a for a, value in zip(allowed, combo)):
+                yield combo
+
+    def value(self, series_idx: int, period_idx: int) -> str:
+        return f"{(series_idx * 7919 + period_idx * 104729) % 100000 / 100:.2f}"
+
+
+def dataflow_catalogue(n_dataflows: int = 500, seed: int = 42) -> str:
+    """Catalogo di `n_dataflows` dataflow DF_<i> con DSD DSD_<i> e nomi in italiano e inglese."""
+    rng = random.Random(seed)
+    out = [_STRUCTURE_OPEN, "<structure:Dataflows>"]
+    for i in range(n_dataflows):
+        words = rng.sample(_WORDS, 3)
+        name_it = escape(" ".join(words).capitalize() + f" {i}")
+        name_en = escape(f"Dataflow {i} " + " ".join(words))
+        out.append(
+            f'<structure:Dataflow id="DF_{i}" agencyID="IT1" version="1.0">'
+            f'<common:Name xml:lang="it">{name_it}</common:Name><common:Name xml:lang="en">{name_en}</common:Name>'
+            f'<structure:Structure><Ref id="DSD_{i}" version="1.0" agencyID="IT1"/></structure:Structure>'
+            f'</structure:Dataflow>'
+        )
+    out.append("</structure:Dataflows>")
+    out.append(_STRUCTURE_CLOSE)
+    return "".join(out)
+
+
+def _codelist_xml(codelist_id: str, codes: List[str]) -> str:
+    items = "".join(
+        f'<structure:Code id="{code}"><common:Name xml:lang="it">Codice {code}</common:Name>'
+        f'<common:Name xml:lang="en">Code {code}</common:Name></structure:Code>'
+        for code in codes
+    )
+    return f'<structure:Codelist id="{codelist_id}" agencyID="IT1" version="1.0">{items}</structure:Codelist>'
+
+
+def codelist_message(dataflow: SyntheticDataflow, codelist_id: Optional[str] = None) -> str:
+    """Messaggio con una codelist (o con tutte, se `codelist_id` è None)."""
+    codelists = "".join(
+        _codelist_xml(cl, codes) for _, cl, codes in dataflow.dimensions if codelist_id in (None, cl)
+    )
+    return f"{_STRUCTURE_OPEN}<structure:Codelists>{codelists}</structure:Codelists>{_STRUCTURE_CLOSE}"
+
+
+def datastructure(dataflow: SyntheticDataflow, dsd_id: str = "DSD_0", references: bool = False) -> str:
+    """DSD del dataflow; con `references` include le codelist, come `references=children`."""
+    out = [_STRUCTURE_OPEN]
+    if references:
+        out.append("<structure:Codelists>")
+        out.extend(_codelist_xml(cl, codes) for _, cl, codes in dataflow.dimensions)
+        out.append("</structure:Codelists>")
+    out.append(
+        f'<structure:DataStructures><structure:DataStructure id="{dsd_id}" agencyID="IT1" version="1.0">'
+        f'<structure:DataStructureComponents><structure:DimensionList id="DimensionDescriptor">'
+    )
+    for position, (dim_id, codelist_id, _) in enumerate(dataflow.dimensions, 1):
+        out.append(
+            f'<structure:Dimension id="{dim_id}" urn="urn:sdmx:{dsd_id}.{dim_id}" position="{position}">'
+            f'<structure:ConceptIdentity><Ref id="{dim_id}"/></structure:ConceptIdentity>'
+            f'<structure:LocalRepresentation><structure:Enumeration><Ref id="{codelist_id}"/>'
+            f'</structure:Enumeration></structure:LocalRepresentation></structure:Dimension>'
+        )
+    out.append(
+        f'<structure:TimeDimension id="TIME_PERIOD" position="{len(dataflow.dimensions) + 1}"/>'
+        f'</structure:DimensionList></structure:DataStructureComponents></structure:DataStructure>'
+        f'</structure:DataStructures>'
+    )
+    out.append(_STRUCTURE_CLOSE)
+    return "".join(out)
+
+
+def generic_data(dataflow: SyntheticDataflow, key: str = "", series_keys_only: bool = False,
+                 start_period: Optional[str] = None, end_period: Optional[str] = None,
+                 dsd_id: str = "DSD_0") -> str:
+    """Messaggio SDMX-ML Generic Data (o solo le chiavi delle serie, come `detail=serieskeysonly`)."""
+    periods = [] if series_keys_only else list(enumerate(dataflow.periods(start_period, end_period)))
+    out = [
+        f'<?xml version="1.0" encoding="UTF-8"?>'
+        f'<message:GenericData xmlns:message="{MESSAGE_NS}" xmlns:generic="{GENERIC_NS}" xmlns:common="{COMMON_NS}">'
+        f'<message:Header><message:ID>BENCH</message:ID><message:Structure structureID="{dsd_id}" '
+        f'dimensionAtObservation="TIME_PERIOD"><common:Structure><Ref id="{dsd_id}"/></common:Structure>'
+        f'</message:Structure></message:Header><message:DataSet>'
+    ]
+    dimension_ids = dataflow.dimension_ids
+    for series_idx, combo in enumerate(dataflow.series(key)):
+        values = "".join(f'<generic:Value id="{d}" value="{v}"/>' for d, v in zip(dimension_ids, combo))
+        out.append(f"<generic:Series><generic:SeriesKey>{values}</generic:SeriesKey>")
+        for period_idx, period in periods:
+            out.append(
+                f'<generic:Obs><generic:ObsDimension id="TIME_PERIOD" value="{period}"/>'
+                f'<generic:ObsValue value="{dataflow.value(series_idx, period_idx)}"/></generic:Obs>'
+            )
+        out.append("</generic:Series>")
+    out.append("</message:DataSet></message:GenericData>")
+    return "".join(out)
+
+
+def sdmx_csv(dataflow: SyntheticDataflow, key: str = "", series_keys_only: bool = False,
+             start_period: Optional[str] = None, end_period: Optional[str] = None,
+             dataflow_id: str = "DF_0") -> str:
+    """Messaggio SDMX-CSV 1.0 con le stesse osservazioni di `generic_data`."""
+    periods = list(enumerate(dataflow.periods(start_period, end_period)))
+    lines = ["DATAFLOW," + ",".join(dataflow.dimension_ids) + ",TIME_PERIOD,OBS_VALUE,OBS_STATUS"]
+    prefix = f"IT1:{dataflow_id}(1.0),"
+    for series_idx, combo in enumerate(dataflow.series(key)):
+        series_key = prefix + ",".join(combo)
+        if series_keys_only:
+            lines.append(f"{series_key},,,")
+            continue
+        for period_idx, period in periods:
+            lines.append(f"{series_key},{period},{dataflow.value(series_idx, period_idx)},")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:34:52 2026
+
+@author: andreadesogus
+"""
+
+import argparse
+import gzip
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.fixtures import (
+    SyntheticDataflow,
+    codelist_message,
+    dataflow_catalogue,
+    datastructure,
+    generic_data,
+    sdmx_csv
+)
+
+CSV_MEDIA_TYPE = "application/vnd.sdmx.data+csv;version=1.0.0"
+XML_MEDIA_TYPE = "application/xml"
+# Risposte già generate mantenute in memoria, per non misurare la generazione delle fixture
+RESPONSE_CACHE_SIZE = 64
+
+
+class MockSdmxServer:
+    """
+    Server HTTP locale che imita il web service SDMX REST di ISTAT con dati sintetici.
+
+    Espone `/rest/dataflow/IT1/`, `/rest/datastructure/IT1/<DSD>/` (anche con `references=children`),
+    `/rest/codelist/IT1/<codelist>` e `/rest/data/<dataflow>[/<chiave>]` con `detail=serieskeysonly`,
+    `startPeriod`/`endPeriod` e SDMX-CSV se richiesto con l'header Accept. Tutti i dataflow del
+    catalogo condividono la struttura di `dataflow`. Le risposte hanno ETag (con 304 sulle
+    richieste condizionali) e sono compresse con gzip se il client lo accetta.
+
+    Con `latency` ogni risposta viene ritardata dei secondi indicati, per simulare la rete.
+    """
+
+    def __init__(self, dataflow: Optional[SyntheticDataflow] = None, n_dataflows: int = 500,
+                 host: str = "127.0.0.1", port: int = 0, latency: float = 0.0) -> None:
+        self.dataflow = dataflow or SyntheticDataflow()
+        self.n_dataflows = n_dataflows
+        self.latency = latency
+        self.hits: Counter = Counter()
+        self._responses: "OrderedDict[Tuple[str, str, bool], Tuple[int, bytes, bytes, str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """URL base da usare come SDMX_REST_URL."""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/rest"
+
+    def serve_forever(self) -> None:
+        self._httpd.serve_forever()
+
+    def start(self) -> "MockSdmxServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mock-sdmx", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "MockSdmxServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def response(self, path: str, query: str, csv: bool) -> Tuple[int, bytes, bytes, str, str]:
+        """
+        Ritorna (stato, corpo, corpo gzip, Content-Type, ETag) per la richiesta,
+        generandola e comprimendola al primo utilizzo.
+        """
+        cache_key = (path, query, csv)
+        with self._lock:
+            if cache_key in self._responses:
+                self._responses.move_to_end(cache_key)
+                return self._responses[cache_key]
+        status, body, content_type = self._render(path, parse_qs(query), csv)
+        data = body.encode("utf-8")
+        etag = '"' + hashlib.md5(data).hexdigest() + '"'
+        result = (status, data, gzip.compress(data, compresslevel=1), content_type, etag)
+        with self._lock:
+            self._responses[cache_key] = result
+            while len(self._responses) > RESPONSE_CACHE_SIZE:
+                self._responses.popitem(last=False)
+        return result
+
+    def _render(self, path: str, query: Dict[str, list], csv: bool) -> Tuple[int, str, str]:
+        parts = [p for p in path.split("/") if p]
+        if len(parts) < 2 or parts[0] != "rest":
+            return 404, "", XML_MEDIA_TYPE
+        resource, args = parts[1], parts[2:]
+        param = lambda name: query.get(name, [None])[0]
+
+        if resource == "dataflow":
+            return 200, dataflow_catalogue(self.n_dataflows), XML_MEDIA_TYPE
+        if resource == "datastructure" and len(args) >= 2:
+            references = param("references") == "children"
+            return 200, datastructure(self.dataflow, args[1], references=references), XML_MEDIA_TYPE
+        if resource == "codelist" and len(args) >= 2:
+            if args[1] not in {cl for _, cl, _ in self.dataflow.dimensions}:
+                return 404, "", XML_MEDIA_TYPE
+            return 200, codelist_message(self.dataflow, args[1]), XML_MEDIA_TYPE
+        if resource == "data" and args:
+            dataflow_id = args[0]
+            key = args[1] if len(args) > 1 else ""
+            if param("updatedAfter") or not any(True for _ in self.dataflow.series(key)):
+                # I dati sintetici non cambiano: nessuna osservazione nuova o rivista
+                return 404, "", XML_MEDIA_TYPE
+            keys_only = param("detail") == "serieskeysonly"
+            window = {"start_period": param("startPeriod"), "end_period": param("endPeriod")}
+            if csv:
+                return 200, sdmx_csv(self.dataflow, key, keys_only, dataflow_id=dataflow_id, **window), CSV_MEDIA_TYPE
+            dsd_id = "DSD_" + dataflow_id.split("_", 1)[-1]
+            return 200, generic_data(self.dataflow, key, keys_only, dsd_id=dsd_id, **window), XML_MEDIA_TYPE
+        return 404, "", XML_MEDIA_TYPE
+
+    def _handler_class(self) -> Callable[..., BaseHTTPRequestHandler]:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                url = urlparse(self.path)
+                with server._lock:
+                    server.hits[url.path] += 1
+                if server.latency:
+                    threading.Event().wait(server.latency)
+                csv = "csv" in self.headers.get("Accept", "")
+                status, body, gzipped, content_type, etag = server.response(url.path, url.query, csv)
+                if status == 200 and self.headers.get("If-None-Match") == etag:
+                    status, body = 304, b""
+                self.send_response(status)
+                if status != 404:
+                    self.send_header("ETag", etag)
+                if status == 200:
+                    self.send_header("Content-Type", content_type)
+                    if "gzip" in self.headers.get("Accept-Encoding", ""):
+                        body = gzipped
+                        self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Server SDMX di prova con dati sintetici")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--series", type=int, default=2_000)
+    parser.add_argument("--periods", type=int, default=120)
+    parser.add_argument("--dataflows", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    mock = MockSdmxServer(SyntheticDataflow(args.series, args.periods), args.dataflows,
+                          port=args.port, latency=args.latency)
+    print(f"Mock SDMX server on {mock.url}")
+    try:
+        mock.serve_forever()
+    except KeyboardInterrupt:
+        mock.stop()
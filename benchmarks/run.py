@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:52:09 2026
+
+@author: andreadesogus
+"""
+
+import argparse
+import contextlib
+import gc
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks.fixtures import (
+    SyntheticDataflow,
+    codelist_message,
+    dataflow_catalogue,
+    datastructure,
+    generic_data,
+    sdmx_csv
+)
+from benchmarks.mock_server import MockSdmxServer
+
+# Dimensioni delle fixture per ciascun profilo
+SIZES = {
+    "quick": {"dataflows": 200, "keys": 5_000, "codes": 40, "data_series": 200, "periods": 60, "patterns": 200, "repeat": 3},
+    "default": {"dataflows": 2_000, "keys": 50_000, "codes": 200, "data_series": 2_000, "periods": 120, "patterns": 2_000, "repeat": 5},
+}
+GROUPS = ("parsers", "matcher", "endpoints")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# Peggioramento relativo oltre il quale un benchmark è segnalato come regressione
+DEFAULT_THRESHOLD = 0.20
+
+
+def measure(func: Callable[[], Any], repeat: int, items: Optional[int] = None, unit: Optional[str] = None,
+            warmup: bool = True) -> Dict[str, Any]:
+    """
+    Esegue `func` `repeat` volte e ne misura la durata (mediana e minimo), poi una volta ancora
+    con tracemalloc per il picco di memoria allocata. Con `items` calcola il throughput sulla mediana.
+    Con `warmup=False` non viene fatta un'esecuzione preliminare (per misurare le chiamate a freddo).
+    """
+    if warmup:
+        func()
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    median = statistics.median(times)
+    result = {"median_s": median, "min_s": min(times), "peak_mb": peak / 1024 / 1024}
+    if items:
+        result["throughput"] = items / median
+        result["unit"] = unit
+    return result
+
+
+def bench_parsers(size: Dict[str, int], repeat: int) -> Dict[str, Dict[str, Any]]:
+    from core.parsers import DataflowParser, DataSchemeExtractor, MetadataHelper, SdmxCsvParser, SeriesParser, ValuesParser
+    from core.search import CatalogueIndex
+
+    keys_dataflow = SyntheticDataflow(n_series=size["keys"], n_periods=1, n_codes=size["codes"])
+    data_dataflow = SyntheticDataflow(n_series=size["data_series"], n_periods=size["periods"], n_codes=size["codes"])
+    n_obs = size["data_series"] * size["periods"]
+    n_codes = sum(len(codes) for _, _, codes in keys_dataflow.dimensions)
+
+    catalogue_xml = dataflow_catalogue(size["dataflows"])
+    keys_xml = generic_data(keys_dataflow, series_keys_only=True)
+    keys_csv = sdmx_csv(keys_dataflow, series_keys_only=True)
+    dsd_xml = datastructure(keys_dataflow, references=True)
+    codelists_xml = codelist_message(keys_dataflow)
+    data_xml = generic_data(data_dataflow)
+    data_csv = sdmx_csv(data_dataflow)
+
+    catalogue = DataflowParser(catalogue_xml).dataflow_records()
+
+    # Metadati misurati con i metodi nativi usati dagli endpoint (senza DataFrame)
+    def dsd() -> None:
+        extractor = DataSchemeExtractor(dsd_xml)
+        extractor.dimensions()
+        extractor.codelists()
+
+    return {
+        "parsers.DataflowParser": measure(lambda: DataflowParser(catalogue_xml).dataflow_records(), repeat,
+                                          size["dataflows"], "dataflow/s"),
+        "parsers.CatalogueIndex": measure(lambda: CatalogueIndex(catalogue), repeat,
+                                          size["dataflows"], "dataflow/s"),
+        "parsers.SeriesParser": measure(lambda: SeriesParser(keys_xml).parse_series_keys(), repeat,
+                                        size["keys"], "serie/s"),
+        "parsers.SdmxCsvParser.series": measure(lambda: SdmxCsvParser(keys_csv).parse_series_keys(), repeat,
+                                                size["keys"], "serie/s"),
+        "parsers.DataSchemeExtractor": measure(dsd, repeat, n_codes, "codici/s"),
+        "parsers.MetadataHelper": measure(lambda: MetadataHelper(codelists_xml).codelists(), repeat,
+                                          n_codes, "codici/s"),
+        "parsers.ValuesParser": measure(lambda: ValuesParser(data_xml).parse(), repeat, n_obs, "oss/s"),
+        "parsers.ValuesParser.stream": measure(lambda: sum(len(c) for c in ValuesParser(data_xml).iter_chunks(5000)),
+                                               repeat, n_obs, "oss/s"),
+        "parsers.SdmxCsvParser.data": measure(lambda: SdmxCsvParser(data_csv).parse(), repeat, n_obs, "oss/s"),
+    }
+
+
+def bench_matcher(size: Dict[str, int], repeat: int) -> Dict[str, Dict[str, Any]]:
+    from core.parsers import SdmxCsvParser
+    from core.utils import PatternMatcher, SeriesKeyIndex
+
+    dataflow = SyntheticDataflow(n_series=size["keys"], n_periods=1, n_codes=size["codes"])
+    _, _, series_keys = SdmxCsvParser(sdmx_csv(dataflow, series_keys_only=True)).parse_series_keys()
+    rng = random.Random(7)
+
+    # Pattern con una o due dimensioni filtrate, talvolta con più valori in OR
+    patterns = []
+    for _ in range(size["patterns"]):
+        slots = [""] * len(dataflow.dimensions)
+        for position in rng.sample(range(1, len(slots)), rng.choice((1, 2))):
+            codes = dataflow.dimensions[position][2]
+            slots[position] = "+".join(rng.sample(codes, rng.choice((1, 1, 3))))
+        patterns.append(".".join(slots))
+
+    matcher = PatternMatcher(series_keys)
+    return {
+        "matcher.index_build": measure(lambda: SeriesKeyIndex(series_keys), repeat, size["keys"], "serie/s"),
+        "matcher.match": measure(lambda: [matcher.match(p) for p in patterns], repeat, len(patterns), "pattern/s"),
+        "matcher.count": measure(lambda: matcher.match_many(patterns), repeat, len(patterns), "pattern/s"),
+        "matcher.facets": measure(lambda: [matcher.index.facets(p) for p in patterns[:50]], repeat, 50, "pattern/s"),
+    }
+
+
+def bench_endpoints(size: Dict[str, int], repeat: int, mock: MockSdmxServer) -> Dict[str, Dict[str, Any]]:
+    # I moduli dell'app leggono la configurazione all'import: vanno importati dopo aver impostato l'ambiente
+    from api.main import app
+
+    client = app.test_client()
+    dataflow = mock.dataflow
+    last_codes = "+".join(dataflow.dimensions[-1][2])
+    first_code = dataflow.dimensions[1][2][0]
+    data_obs = sum(1 for _ in dataflow.series(f".{first_code}")) * size["periods"]
+    fresh_ids = itertools.count(1)
+
+    def get(path: str) -> None:
+        response = client.get(path)
+        assert response.status_code == 200, (path, response.status_code, response.get_data()[:200])
+
+    def post_data(dataflow_id: str, **params: Any) -> None:
+        body = {"dataflow_id": dataflow_id, "ref_id": "DSD_" + dataflow_id.split("_")[1],
+                "filters": {"1": first_code, str(len(dataflow.dimensions) - 1): last_codes}, **params}
+        response = client.post("/api/data", json=body)
+        assert response.status_code == 200, (response.status_code, response.get_data()[:200])
+
+    def fresh_dataflow() -> str:
+        """Dataflow mai richiesto prima: struttura e chiavi delle serie vanno scaricate e analizzate."""
+        return f"DF_{next(fresh_ids)}"
+
+    def filters_cold() -> None:
+        dataflow_id = fresh_dataflow()
+        get(f"/api/filters?dataflow_id={dataflow_id}&ref_id=DSD_{dataflow_id.split('_')[1]}")
+
+    return {
+        "endpoints.dataflow": measure(lambda: get("/api/dataflow?string=tasso%20occupati&limit=20"), repeat),
+        "endpoints.filters.cold": measure(filters_cold, repeat, warmup=False),
+        "endpoints.filters": measure(lambda: get("/api/filters?dataflow_id=DF_0&ref_id=DSD_0"), repeat),
+        "endpoints.data.cold": measure(lambda: post_data(fresh_dataflow()), repeat, data_obs, "oss/s", warmup=False),
+        "endpoints.data": measure(lambda: post_data("DF_0"), repeat, data_obs, "oss/s"),
+        # Medie annue delle serie mensili per valore della prima dimensione filtrata
+        "endpoints.data.aggregated": measure(
+            lambda: post_data("DF_0", group_by=["FREQ", "DIM1"], agg="mean", frequency="A"), repeat, data_obs, "oss/s"
+        ),
+    }
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Benchmark peggiorati oltre `threshold` rispetto alla baseline (tempo mediano o picco di memoria)."""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get("results", {}).get(name)
+        if reference is None:
+            continue
+        for metric in ("median_s", "peak_mb"):
+            if reference[metric] and result[metric] > reference[metric] * (1 + threshold):
+                regressions.append(f"{name} {metric}: {reference[metric]:.4g} -> {result[metric]:.4g}")
+    return regressions
+
+
+def report(results: Dict[str, Dict[str, Any]], baseline: Optional[Dict[str, Any]]) -> None:
+    reference = (baseline or {}).get("results", {})
+    print(f"\n{'benchmark':<32}{'mediana ms':>12}{'min ms':>10}{'picco MB':>10}{'throughput':>18}{'vs baseline':>13}")
+    for name, result in results.items():
+        throughput = f"{result['throughput']:,.0f} {result['unit']}" if "throughput" in result else ""
+        delta = ""
+        if name in reference and reference[name]["median_s"]:
+            delta = f"{(result['median_s'] / reference[name]['median_s'] - 1) * 100:+.1f}%"
+        print(f"{name:<32}{result['median_s'] * 1000:>12.2f}{result['min_s'] * 1000:>10.2f}"
+              f"{result['peak_mb']:>10.1f}{throughput:>18}{delta:>13}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark di parser, PatternMatcher ed endpoint su dati sintetici")
+    parser.add_argument("--size", choices=sorted(SIZES), default="default")
+    parser.add_argument("--only", nargs="+", choices=GROUPS, default=list(GROUPS))
+    parser.add_argument("--repeat", type=int, help="Ripetizioni per benchmark (default: dal profilo)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="File JSON della baseline")
+    parser.add_argument("--save-baseline", action="store_true", help="Salva i risultati come nuova baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Peggioramento relativo segnalato come regressione (default: 0.20)")
+    parser.add_argument("--json", help="Salva i risultati anche nel file JSON indicato")
+    args = parser.parse_args(argv)
+
+    size = SIZES[args.size]
+    repeat = args.repeat or size["repeat"]
+    endpoint_dataflow = SyntheticDataflow(n_series=size["data_series"] * 10, n_periods=size["periods"], n_codes=10)
+    mock = MockSdmxServer(endpoint_dataflow, n_dataflows=size["dataflows"]).start()
+    os.environ.update({
+        "SDMX_REST_URL": mock.url,
+        "ISTAT_CACHE_DIR": tempfile.mkdtemp(prefix="istat-bench-"),
+        "ISTAT_WARMUP_DISABLED": "1",
+    })
+
+    results: Dict[str, Dict[str, Any]] = {}
+    try:
+        if "parsers" in args.only:
+            results.update(bench_parsers(size, repeat))
+        if "matcher" in args.only:
+            results.update(bench_matcher(size, repeat))
+        if "endpoints" in args.only:
+            # Il log dell'app renderebbe illeggibile il report
+            logging.disable(logging.INFO)
+            try:
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    results.update(bench_endpoints(size, repeat, mock))
+            finally:
+                logging.disable(logging.NOTSET)
+    finally:
+        mock.stop()
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("size") != args.size:
+            print(f"Baseline {args.baseline} generata con il profilo {baseline.get('size')}: confronto ignorato")
+            baseline = None
+
+    report(results, baseline)
+    output = {
+        "size": args.size,
+        "repeat": repeat,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(output, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(output, f, indent=2)
+        print(f"\nBaseline salvata in {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold) if baseline else []
+    if regressions:
+        print(f"\nRegressioni oltre il {args.threshold:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 14:48:23 2026
+
+@author: andreadesogus
+"""
+
+from __future__ import annotations
+
+import calendar
+import datetime
+import re
+from typing import Any, Dict, Iterable, Mapping, NamedTuple, Optional, Tuple
+
+from core.lazy import LazyModule
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+
+# Funzioni di aggregazione disponibili (nomi dei metodi di pandas GroupBy)
+AGGREGATIONS = ("sum", "mean", "median", "min", "max", "first", "last", "count")
+DEFAULT_AGGREGATION = "mean"
+# Frequenze di destinazione, dalla più fine alla più grossolana; i periodi giornalieri e settimanali valgono 0
+FREQUENCY_RANK = {"M": 1, "Q": 2, "S": 3, "A": 4}
+
+_PERIOD_PATTERNS = [
+    (re.compile(r"^(\d{4})$"), "A"),
+    (re.compile(r"^(\d{4})-S([12])$"), "S"),
+    (re.compile(r"^(\d{4})-Q([1-4])$"), "Q"),
+    (re.compile(r"^(\d{4})-M?(\d{2})$"), "M"),
+    (re.compile(r"^(\d{4})-W(\d{2})$"), "W"),
+    (re.compile(r"^(\d{4})-(\d{2})-(\d{2})"), "D"),
+]
+
+
+class AggregationError(ValueError):
+    """Parametri di aggregazione non validi (es. dimensione o funzione inesistente)."""
+
+
+class Aggregation(NamedTuple):
+    """
+    Aggregazione richiesta su /api/data: raggruppa per le dimensioni `group_by` (tutte se None) e per
+    periodo, eventualmente convertito alla frequenza `frequency`, applicando `agg` a ObsValue.
+    """
+    group_by: Optional[Tuple[str, ...]] = None
+    agg: str = DEFAULT_AGGREGATION
+    frequency: Optional[str] = None
+
+    def validate(self, dimensions: Iterable[str]) -> None:
+        """Verifica che le dimensioni di `group_by` esistano nel dataflow."""
+        unknown = [d for d in self.group_by or () if d not in set(dimensions)]
+        if unknown:
+            raise AggregationError(f"Dimensioni di group_by non presenti nel dataflow: {', '.join(unknown)}")
+
+
+def parse_aggregation(body: Mapping[str, Any], args: Optional[Mapping[str, Any]] = None) -> Optional[Aggregation]:
+    """
+    Legge `group_by`, `agg` e `frequency` dal corpo della richiesta o, in assenza, dalla query string.
+    `group_by` può essere una lista o una stringa di dimensioni separate da virgola.
+    Ritorna None se nessuno dei parametri è indicato.
+    """
+    args = args or {}
+
+    def param(name: str) -> Any:
+        value = body.get(name)
+        return value if value is not None else args.get(name)
+
+    group_by, agg, frequency = param("group_by"), param("agg"), param("frequency")
+    if group_by is None and agg is None and frequency is None:
+        return None
+    if isinstance(group_by, str):
+        group_by = [d.strip() for d in group_by.split(",") if d.strip()]
+    if group_by is not None and not (isinstance(group_by, list) and all(isinstance(d, str) for d in group_by)):
+        raise AggregationError("Il parametro group_by deve essere una lista di dimensioni")
+    agg = str(agg or DEFAULT_AGGREGATION).lower()
+    if agg not in AGGREGATIONS:
+        raise AggregationError(f"Aggregazione '{agg}' non supportata. Disponibili: {', '.join(AGGREGATIONS)}")
+    if frequency is not None:
+        frequency = str(frequency).upper()
+        if frequency not in FREQUENCY_RANK:
+            raise AggregationError(f"Frequenza '{frequency}' non supportata. Disponibili: {', '.join(FREQUENCY_RANK)}")
+    return Aggregation(tuple(dict.fromkeys(group_by)) if group_by is not None else None, agg, frequency)
+
+
+def _parse_period(period: str) -> Tuple[int, int, int]:
+    """(anno, mese, rango della frequenza) di un periodo SDMX; per i semestri e i trimestri il primo mese."""
+    for pattern, frequency in _PERIOD_PATTERNS:
+        match = pattern.match(period)
+        if match is None:
+            continue
+        year = int(match.group(1))
+        if frequency == "A":
+            return year, 1, FREQUENCY_RANK["A"]
+        if frequency == "S":
+            return year, (int(match.group(2)) - 1) * 6 + 1, FREQUENCY_RANK["S"]
+        if frequency == "Q":
+            return year, (int(match.group(2)) - 1) * 3 + 1, FREQUENCY_RANK["Q"]
+        if frequency == "M":
+            return year, int(match.group(2)), FREQUENCY_RANK["M"]
+        if frequency == "W":
+            # La settimana ISO viene attribuita al mese del suo giovedì
+            thursday = datetime.date.fromisocalendar(year, int(match.group(2)), 4)
+            return thursday.year, thursday.month, 0
+        return year, int(match.group(2)), 0
+    raise AggregationError(f"Periodo '{period}' non riconosciuto")
+
+
+def period_bounds(period: str) -> Tuple[datetime.date, datetime.date]:
+    """
+    Primo e ultimo giorno di un periodo SDMX (es. "2015-Q2" -> 2015-04-01, 2015-06-30), per confrontare
+    periodi di frequenze diverse. Solleva AggregationError se il periodo non è valido.
+    """
+    try:
+        year, month, _ = _parse_period(period)
+        for pattern, frequency in _PERIOD_PATTERNS:
+            match = pattern.match(period)
+            if match is None:
+                continue
+            if frequency == "W":
+                monday = datetime.date.fromisocalendar(year, int(match.group(2)), 1)
+                return monday, monday + datetime.timedelta(days=6)
+            if frequency == "D":
+                day = datetime.date(year, month, int(match.group(3)))
+                return day, day
+            last_month = month + {"A": 11, "S": 5, "Q": 2, "M": 0}[frequency]
+            return datetime.date(year, month, 1), datetime.date(year, last_month, calendar.monthrange(year, last_month)[1])
+    except ValueError:
+        pass
+    raise AggregationError(f"Periodo '{period}' non riconosciuto")
+
+
+def convert_period(period: str, frequency: str) -> str:
+    """
+    Periodo SDMX della frequenza `frequency` che contiene `period` (es. "2015-03" -> "2015-Q1").
+    Solleva AggregationError se il periodo ha una frequenza più grossolana di quella richiesta.
+    """
+    year, month, rank = _parse_period(period)
+    if rank > FREQUENCY_RANK[frequency]:
+        raise AggregationError(f"Il periodo '{period}' non può essere convertito alla frequenza {frequency}")
+    if frequency == "A":
+        return f"{year}"
+    if frequency == "S":
+        return f"{year}-S{(month - 1) // 6 + 1}"
+    if frequency == "Q":
+        return f"{year}-Q{(month - 1) // 3 + 1}"
+    return f"{year}-{month:02d}"
+
+
+def _convert_periods(periods: pd.Series, frequency: str) -> pd.Categorical:
+    """Converte la colonna dei periodi convertendo una sola volta ciascun valore distinto."""
+    periods = periods.astype("category")
+    categories = periods.cat.categories
+    converted = np.array([convert_period(str(p), frequency) for p in categories] + [None], dtype=object)
+    # Il codice -1 (periodo mancante) punta all'ultimo elemento, None
+    return pd.Categorical(converted[periods.cat.codes.to_numpy()])
+
+
+def aggregate(df: pd.DataFrame, aggregation: Aggregation, time_column: str = "TIME_PERIOD",
+              value_column: str = "ObsValue", frequency_column: str = "FREQ") -> pd.DataFrame:
+    """
+    Applica l'aggregazione al DataFrame delle osservazioni, in modo vettoriale con pandas GroupBy.
+
+    Il risultato ha una riga per combinazione di dimensioni di `group_by` e periodo, ordinata per
+    dimensioni e periodo, con il valore aggregato in `value_column` (per "count" il numero di
+    osservazioni non nulle). Con "sum" un gruppo senza valori resta nullo.
+    Con `frequency` la colonna `frequency_column` riporta la frequenza di destinazione; serie con
+    frequenze diverse non vengono ricampionate insieme (AggregationError).
+    """
+    dimensions = [c for c in df.columns if c not in (time_column, value_column)]
+    group_by = list(aggregation.group_by) if aggregation.group_by is not None else dimensions
+    if len(df.columns):
+        # Un DataFrame senza colonne (nessuna osservazione) non ha dimensioni da verificare
+        aggregation.validate(dimensions)
+    if df.empty:
+        return df.reindex(columns=group_by + [time_column, value_column])
+    if aggregation.frequency and frequency_column in df.columns:
+        frequencies = sorted(str(f) for f in df[frequency_column].dropna().unique())
+        if len(frequencies) > 1:
+            raise AggregationError(
+                f"Le serie hanno frequenze diverse ({', '.join(frequencies)}) e non possono essere ricampionate "
+                f"insieme: filtra su {frequency_column}"
+            )
+
+    data: Dict[str, Any] = {col: df[col] for col in group_by}
+    data[time_column] = (
+        _convert_periods(df[time_column], aggregation.frequency) if aggregation.frequency
+        else df[time_column].astype("category")
+    )
+    data[value_column] = pd.to_numeric(df[value_column], errors="coerce")
+    frame = pd.DataFrame(data)
+    if aggregation.agg in ("first", "last"):
+        # Primo e ultimo valore in ordine cronologico all'interno di ciascun gruppo
+        frame = frame.iloc[np.argsort(df[time_column].astype(str).to_numpy(), kind="stable")]
+
+    grouped = frame.groupby(group_by + [time_column], observed=True, sort=True)[value_column]
+    if aggregation.agg == "sum":
+        result = grouped.sum(min_count=1)
+    else:
+        result = getattr(grouped, aggregation.agg)()
+    result = result.reset_index()
+    if aggregation.frequency and frequency_column in result.columns:
+        result[frequency_column] = aggregation.frequency
+    return result
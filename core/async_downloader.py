@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:02:33 2026
+
+@author: andreadesogus
+"""
+
+import asyncio
+import os
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+from core import metrics
+from core.cache import DiskCache, get_cache
+from core.downloader import DownloadError
+from core.singleflight import AsyncSingleFlight, get_group
+
+
+class AsyncHttpTransport:
+    """
+    Variante asincrona di HttpTransport basata su httpx.AsyncClient: pool di connessioni keep-alive,
+    negoziazione gzip/deflate, timeout configurabili e retry con backoff esponenziale su 429/5xx.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(
+        self,
+        connect_timeout: float = float(os.environ.get("SDMX_CONNECT_TIMEOUT", 10)),
+        read_timeout: float = float(os.environ.get("SDMX_READ_TIMEOUT", 100)),
+        retries: int = int(os.environ.get("SDMX_RETRIES", 3)),
+        backoff_factor: float = float(os.environ.get("SDMX_BACKOFF", 0.5)),
+        max_connections: int = int(os.environ.get("SDMX_ASYNC_MAX_CONNECTIONS", 100)),
+        max_keepalive: int = int(os.environ.get("SDMX_POOL_SIZE", 20)),
+    ) -> None:
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive),
+            headers={"Accept-Encoding": "gzip, deflate"},
+            transport=httpx.AsyncHTTPTransport(retries=retries),
+        )
+
+    async def get(self, url: str, params: Optional[Dict[str, str]] = None,
+                  headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+        """Esegue una GET, ripetendola con backoff sulle risposte 429/5xx."""
+        for attempt in range(self.retries + 1):
+            response = await self.client.get(url, params=params, headers=headers)
+            if response.status_code not in self.RETRY_STATUSES or attempt == self.retries:
+                return response
+            await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+        return response
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+_async_transport: Optional[AsyncHttpTransport] = None
+
+
+def get_async_transport() -> AsyncHttpTransport:
+    """Ritorna il trasporto asincrono del processo, creandolo al primo utilizzo."""
+    global _async_transport
+    if _async_transport is None:
+        _async_transport = AsyncHttpTransport()
+    return _async_transport
+
+
+def set_async_transport(transport: Optional[AsyncHttpTransport]) -> None:
+    """Sostituisce il trasporto asincrono di default (es. con uno che punta a un server SDMX di test)."""
+    global _async_transport
+    _async_transport = transport
+
+
+# Download in corso nell'event loop: richieste identiche concorrenti condividono un'unica GET
+_async_downloads = get_group("async_downloads", AsyncSingleFlight)
+
+
+class AsyncDownloader:
+    """
+    Variante asincrona di Downloader, con la stessa gestione della cache su disco per le
+    risorse strutturali. Le operazioni sul disco vengono eseguite fuori dall'event loop.
+    Come in Downloader, i download concorrenti della stessa risorsa vengono accorpati.
+    """
+
+    def __init__(self, url: str, params: Optional[Dict[str, str]] = None,
+                 transport: Optional[AsyncHttpTransport] = None,
+                 resource_type: Optional[str] = None,
+                 cache: Optional[DiskCache] = None,
+                 headers: Optional[Dict[str, str]] = None):
+        self.url = url
+        self.params = params
+        self.headers = headers or {}
+        self.content_type: Optional[str] = None
+        self.transport = transport or get_async_transport()
+        self.resource_type = resource_type
+        self.cache = cache or (get_cache() if resource_type else None)
+
+    async def download(self) -> str:
+        key = DiskCache.make_key(self.url, self.params, self.headers)
+        if self.cache is not None:
+            entry = await asyncio.to_thread(self.cache.get, key)
+            if entry is not None and self.cache.is_fresh(entry[1]):
+                _async_downloads.record_hit()
+                metrics.count_cache("disk", "hit")
+                self.content_type = entry[1].get("content_type")
+                return entry[0]
+
+        text, self.content_type = await _async_downloads.do(key, lambda: self._download(key))
+        return text
+
+    async def _download(self, key: str) -> Tuple[str, Optional[str]]:
+        """Esegue il download (o la rivalidazione della copia in cache) e ritorna (corpo, Content-Type)."""
+        if self.cache is None:
+            response = await self._get(self.headers)
+            return response.text, self.content_type
+
+        entry = await asyncio.to_thread(self.cache.get, key)
+        if entry is not None and self.cache.is_fresh(entry[1]):
+            return entry[0], entry[1].get("content_type")
+
+        headers = dict(self.headers)
+        if entry is not None:
+            meta = entry[1]
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            with metrics.stage("download"):
+                response = await self.transport.get(self.url, params=self.params, headers=headers or None)
+        except httpx.HTTPError as e:
+            if entry is not None:
+                print(f"Request error in {self.url}: {e}. Serving stale cached copy")
+                metrics.count_cache("disk", "stale")
+                return entry[0], entry[1].get("content_type")
+            raise
+
+        if response.status_code == 304 and entry is not None:
+            print(f"Cached copy revalidated for {self.url}")
+            metrics.count_cache("disk", "revalidated")
+            await asyncio.to_thread(self.cache.touch, key)
+            return entry[0], entry[1].get("content_type")
+        if response.status_code == 200:
+            print(f"Download completed successfully from {self.url}")
+            metrics.count_cache("disk", "miss")
+            metrics.count_bytes(self.resource_type, response.num_bytes_downloaded)
+            self.content_type = response.headers.get("Content-Type")
+            await asyncio.to_thread(
+                self.cache.set, key, self.resource_type, response.text,
+                response.headers.get("ETag"), response.headers.get("Last-Modified"), self.content_type
+            )
+            return response.text, self.content_type
+        raise DownloadError(self.url, response.status_code)
+
+    async def download_bytes(self) -> bytes:
+        """Scarica il corpo della risposta come bytes (non usa la cache)."""
+        async def fetch() -> Tuple[bytes, Optional[str]]:
+            response = await self._get(self.headers)
+            return response.content, self.content_type
+
+        key = "bytes:" + DiskCache.make_key(self.url, self.params, self.headers)
+        content, self.content_type = await _async_downloads.do(key, fetch)
+        return content
+
+    async def _get(self, headers: Dict[str, str]) -> httpx.Response:
+        with metrics.stage("download"):
+            response = await self.transport.get(self.url, params=self.params, headers=headers or None)
+        if response.status_code != 200:
+            raise DownloadError(self.url, response.status_code)
+        print(f"Download completed successfully from {self.url}")
+        metrics.count_bytes(self.resource_type, response.num_bytes_downloaded)
+        self.content_type = response.headers.get("Content-Type")
+        return response
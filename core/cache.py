@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 10:02:17 2026
+
+@author: andreadesogus
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+# TTL di default (in secondi) per tipo di risorsa SDMX: le strutture cambiano poche volte l'anno.
+DEFAULT_TTLS = {
+    "dataflow": 24 * 3600,
+    "datastructure": 7 * 24 * 3600,
+    "codelist": 7 * 24 * 3600,
+    "serieskeys": 24 * 3600,
+}
+
+
+class DiskCache:
+    """
+    Cache persistente su disco per i messaggi SDMX grezzi.
+
+    Ogni voce è composta da un file `.body` (il testo del messaggio) e da un file `.meta`
+    (JSON con URL, tipo di risorsa, istante di salvataggio, ETag, Last-Modified e Content-Type).
+    La scadenza è gestita per tipo di risorsa; la dimensione totale è limitata con
+    eviction LRU basata sull'ultimo accesso (mtime del file `.meta`).
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 200 * 1024 * 1024,
+                 ttls: Optional[Dict[str, int]] = None) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+
+    @staticmethod
+    def make_key(url: str, params: Optional[Dict[str, str]] = None,
+                 headers: Optional[Dict[str, str]] = None) -> str:
+        """Costruisce la chiave di cache a partire da URL, parametri ed eventuali header di negoziazione."""
+        if params:
+            url = url + "?" + "&".join(f"{k}={params[k]}" for k in sorted(params))
+        if headers:
+            url = url + "#" + "&".join(f"{k}={headers[k]}" for k in sorted(headers))
+        return url
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        base = os.path.join(self.directory, digest)
+        return base + ".body", base + ".meta"
+
+    def get(self, key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Ritorna (testo, metadati) se la voce esiste, altrimenti None. Aggiorna l'ultimo accesso."""
+        body_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(body_path, "r", encoding="utf-8") as f:
+                text = f.read()
+            os.utime(meta_path, None)
+        except (OSError, ValueError):
+            return None
+        return text, meta
+
+    def is_fresh(self, meta: Dict[str, Any]) -> bool:
+        """Verifica se una voce è ancora valida secondo il TTL del suo tipo di risorsa."""
+        ttl = self.ttls.get(meta.get("resource_type"), 0)
+        return time.time() - meta.get("stored_at", 0) < ttl
+
+    def set(self, key: str, resource_type: str, text: str,
+            etag: Optional[str] = None, last_modified: Optional[str] = None,
+            content_type: Optional[str] = None) -> None:
+        """Salva una voce con scrittura atomica e applica l'eviction se necessario."""
+        body_path, meta_path = self._paths(key)
+        data = text.encode("utf-8")
+        meta = {
+            "key": key,
+            "resource_type": resource_type,
+            "stored_at": time.time(),
+            "etag": etag,
+            "last_modified": last_modified,
+            "content_type": content_type,
+            "size": len(data),
+        }
+        self._atomic_write(body_path, data)
+        self._atomic_write(meta_path, json.dumps(meta).encode("utf-8"))
+        self._evict()
+
+    def touch(self, key: str) -> None:
+        """Rinnova una voce rivalidata dal server (risposta 304) senza riscriverne il contenuto."""
+        _, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return
+        meta["stored_at"] = time.time()
+        self._atomic_write(meta_path, json.dumps(meta).encode("utf-8"))
+
+    def _atomic_write(self, path: str, data: bytes) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _evict(self) -> None:
+        """Rimuove le voci usate meno di recente finché la cache non rientra in max_bytes."""
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.directory):
+                if not name.endswith(".meta"):
+                    continue
+                meta_path = os.path.join(self.directory, name)
+                body_path = meta_path[:-len(".meta")] + ".body"
+                try:
+                    size = os.path.getsize(body_path) + os.path.getsize(meta_path)
+                    atime = os.path.getmtime(meta_path)
+                except OSError:
+                    continue
+                entries.append((atime, size, body_path, meta_path))
+                total += size
+            if total <= self.max_bytes:
+                return
+            for _, size, body_path, meta_path in sorted(entries):
+                for path in (meta_path, body_path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+
+_cache: Optional[DiskCache] = None
+_cache_lock = threading.Lock()
+
+
+def default_cache_dir() -> str:
+    """
+    Directory delle cache: ISTAT_CACHE_DIR se impostata, altrimenti una directory dell'utente corrente
+    nella directory temporanea (es. /tmp/istatdataapi-cache-1000).
+    """
+    suffix = f"-{os.getuid()}" if hasattr(os, "getuid") else ""
+    return os.environ.get("ISTAT_CACHE_DIR", os.path.join(tempfile.gettempdir(), f"istatdataapi-cache{suffix}"))
+
+
+def ensure_private(path: str, directory: bool = True) -> None:
+    """
+    Crea la directory `path` con permessi 0o700 se non esiste (con directory=False verifica solo il file,
+    se presente). Solleva PermissionError se appartiene a un altro utente o è scrivibile dal gruppo o da
+    altri: il contenuto potrebbe essere stato preparato da un altro utente dell'host.
+    """
+    if directory:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+    elif not os.path.exists(path):
+        return
+    if not hasattr(os, "getuid"):
+        return
+    st = os.stat(path)
+    if st.st_uid != os.getuid():
+        raise PermissionError(f"{path} appartiene a un altro utente (uid {st.st_uid})")
+    if st.st_mode & 0o022:
+        raise PermissionError(f"{path} è scrivibile dal gruppo o da altri utenti")
+
+
+def _ttls_from_env() -> Dict[str, int]:
+    ttls = {}
+    for resource_type in DEFAULT_TTLS:
+        value = os.environ.get(f"ISTAT_CACHE_TTL_{resource_type.upper()}")
+        if value is not None:
+            ttls[resource_type] = int(value)
+    return ttls
+
+
+def get_cache() -> Optional[DiskCache]:
+    """
+    Ritorna la cache su disco condivisa, creandola al primo utilizzo.
+    Ritorna None se la cache è disabilitata tramite ISTAT_CACHE_DISABLED.
+    """
+    global _cache
+    if os.environ.get("ISTAT_CACHE_DISABLED"):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DiskCache(
+                    default_cache_dir(),
+                    max_bytes=int(os.environ.get("ISTAT_CACHE_MAX_MB", 200)) * 1024 * 1024,
+                    ttls=_ttls_from_env(),
+                )
+    return _cache
+
+
+def set_cache(cache: Optional[DiskCache]) -> None:
+    """Sostituisce la cache di default (es. con una in una directory temporanea)."""
+    global _cache
+    with _cache_lock:
+        _cache = cache
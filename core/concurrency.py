@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 12:05:51 2026
+
+@author: andreadesogus
+"""
+
+import contextvars
+import os
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+MAX_WORKERS = int(os.environ.get("ISTAT_MAX_WORKERS", 8))
+
+
+def bounded_map(func: Callable[[T], R], items: Iterable[T], max_workers: Optional[int] = None) -> List[R]:
+    """
+    Applica `func` agli elementi in parallelo su un pool limitato e ritorna i risultati
+    nello stesso ordine degli elementi in ingresso. La prima eccezione viene rilanciata.
+
+    Il pool usa `threading`: con il worker gevent di gunicorn il modulo è monkey-patched,
+    quindi i task diventano greenlet e le attese di rete non bloccano il worker.
+    Ogni task gira in una copia del contesto del chiamante (contextvars), come con asyncio.to_thread,
+    così le durate misurate nei thread vengono attribuite alla richiesta in corso.
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return [func(item) for item in items]
+    workers = min(max_workers or MAX_WORKERS, len(items))
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda item: context.copy().run(func, item), items))
+
+
+def bounded_as_completed(func: Callable[[T], R], items: Iterable[T],
+                         max_workers: Optional[int] = None) -> Iterator[Tuple[int, Future]]:
+    """
+    Come `bounded_map`, ma ritorna le coppie (posizione dell'elemento, future) man mano che i task
+    terminano; l'esito di ciascun task si legge con `future.result()`, senza interrompere gli altri.
+    Se l'iteratore viene chiuso prima della fine (es. client disconnesso), i task non ancora avviati
+    vengono annullati.
+    """
+    items = list(items)
+    if not items:
+        return
+    workers = min(max_workers or MAX_WORKERS, len(items))
+    context = contextvars.copy_context()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {executor.submit(context.copy().run, func, item): i for i, item in enumerate(items)}
+        for future in as_completed(futures):
+            yield futures[future], future
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -6,19 +6,148 @@ Created on Sat Mar  1 12:32:39 2025
 @author: andreadesogus
 """
 
-import requests
+from contextlib import contextmanager
+from typing import IO, Any, Dict, Iterator, Optional, Tuple
+
+from core import metrics
+from core.cache import DiskCache, get_cache
+from core.singleflight import get_group
+from core.transport import HttpTransport, get_transport
+
+
+class DownloadError(Exception):
+    """Risposta del web service con uno stato diverso da 200 (es. 404 se la richiesta non produce dati)."""
+
+    def __init__(self, url: str, status_code: int) -> None:
+        super().__init__(f"Request error in {url}: {status_code}")
+        self.url = url
+        self.status_code = status_code
+
+
+def _received_bytes(response: Any) -> int:
+    """Byte letti dalla rete per la risposta (prima della decompressione, se disponibile)."""
+    try:
+        return int(response.raw.tell())
+    except (AttributeError, TypeError, ValueError):
+        return len(response.content or b"")
+
+
+# Download in corso nel processo: richieste identiche concorrenti condividono un'unica GET
+_downloads = get_group("downloads")
 
 class Downloader:
     """
     Classe per scaricare dati da un URL.
+
+    Se viene indicato un `resource_type` (es. "dataflow", "datastructure", "codelist"),
+    la risposta viene conservata nella cache su disco: le voci valide vengono servite
+    senza rete, quelle scadute vengono rivalidate con ETag/Last-Modified.
+
+    Download concorrenti della stessa risorsa (URL, parametri e header) vengono
+    accorpati: la GET viene eseguita una sola volta e il corpo condiviso tra i chiamanti.
     """
-    def __init__(self, url: str):
+    def __init__(self, url: str, params: Optional[Dict[str, str]] = None,
+                 transport: Optional[HttpTransport] = None,
+                 resource_type: Optional[str] = None,
+                 cache: Optional[DiskCache] = None,
+                 headers: Optional[Dict[str, str]] = None,
+                 revalidate: bool = False):
         self.url = url
+        self.params = params
+        self.headers = headers or {}
+        self.content_type: Optional[str] = None
+        self.transport = transport or get_transport()
+        self.resource_type = resource_type
+        self.cache = cache or (get_cache() if resource_type else None)
+        # Se True, anche una voce valida viene rivalidata col server (usato dal refresh in background)
+        self.revalidate = revalidate
     
     def download(self) -> str:
-        response = requests.get(self.url)
+        key = DiskCache.make_key(self.url, self.params, self.headers)
+        if self.cache is not None and not self.revalidate:
+            entry = self.cache.get(key)
+            if entry is not None and self.cache.is_fresh(entry[1]):
+                _downloads.record_hit()
+                metrics.count_cache("disk", "hit")
+                self.content_type = entry[1].get("content_type")
+                return entry[0]
+
+        text, self.content_type = _downloads.do(key, lambda: self._download(key))
+        return text
+
+    def _download(self, key: str) -> Tuple[str, Optional[str]]:
+        """Esegue il download (o la rivalidazione della copia in cache) e ritorna (corpo, Content-Type)."""
+        if self.cache is None:
+            text = self._fetch()
+            return text, self.content_type
+
+        entry = self.cache.get(key)
+        if entry is not None and self.cache.is_fresh(entry[1]) and not self.revalidate:
+            return entry[0], entry[1].get("content_type")
+
+        headers = dict(self.headers)
+        if entry is not None:
+            meta = entry[1]
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            with metrics.stage("download"):
+                response = self.transport.get(self.url, params=self.params, headers=headers or None)
+        except Exception as e:
+            if entry is not None:
+                print(f"Request error in {self.url}: {e}. Serving stale cached copy")
+                metrics.count_cache("disk", "stale")
+                return entry[0], entry[1].get("content_type")
+            raise
+
+        if response.status_code == 304 and entry is not None:
+            print(f"Cached copy revalidated for {self.url}")
+            metrics.count_cache("disk", "revalidated")
+            self.cache.touch(key)
+            return entry[0], entry[1].get("content_type")
+        if response.status_code == 200:
+            print(f"Download completed successfully from {self.url}")
+            metrics.count_cache("disk", "miss")
+            metrics.count_bytes(self.resource_type, _received_bytes(response))
+            self.content_type = response.headers.get("Content-Type")
+            self.cache.set(key, self.resource_type, response.text,
+                           etag=response.headers.get("ETag"),
+                           last_modified=response.headers.get("Last-Modified"),
+                           content_type=self.content_type)
+            return response.text, self.content_type
+        raise DownloadError(self.url, response.status_code)
+
+    @contextmanager
+    def stream(self) -> Iterator[IO[bytes]]:
+        """
+        Apre la risposta in streaming e ritorna uno stream binario già decompresso,
+        da consumare in modo incrementale (es. con ValuesParser). Non usa la cache.
+        """
+        # In streaming "download" misura l'attesa degli header; la lettura del corpo avviene durante il parsing
+        with metrics.stage("download"):
+            response = self.transport.get(self.url, params=self.params, headers=self.headers or None, stream=True)
+        try:
+            if response.status_code != 200:
+                raise DownloadError(self.url, response.status_code)
+            print(f"Streaming download started from {self.url}")
+            self.content_type = response.headers.get("Content-Type")
+            response.raw.decode_content = True
+            # Evita che urllib3 chiuda lo stream a fine lettura: i wrapper io (es. TextIOWrapper) lo richiedono aperto
+            response.raw.auto_close = False
+            yield response.raw
+        finally:
+            metrics.count_bytes(self.resource_type, _received_bytes(response))
+            response.close()
+
+    def _fetch(self) -> str:
+        with metrics.stage("download"):
+            response = self.transport.get(self.url, params=self.params, headers=self.headers or None)
         if response.status_code == 200:
             print(f"Download completed successfully from {self.url}")
+            metrics.count_bytes(self.resource_type, _received_bytes(response))
+            self.content_type = response.headers.get("Content-Type")
             return response.text
         else:
-            raise Exception(f"Request error in {self.url}: {response.status_code}")
+            raise DownloadError(self.url, response.status_code)
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:05:27 2026
+
+@author: andreadesogus
+"""
+
+import importlib
+import types
+from typing import Any
+
+
+class LazyModule(types.ModuleType):
+    """
+    Segnaposto di un modulo che viene importato solo al primo accesso a un suo attributo.
+
+    Permette di scrivere `pd = LazyModule("pandas")` a livello di modulo e usare `pd.DataFrame`
+    come di consueto, senza pagare l'import all'avvio del worker: gli endpoint dei metadati
+    non usano pandas e numpy, che vengono caricati solo dalla prima estrazione di dati.
+    I moduli che lo usano nelle annotazioni devono importare `from __future__ import annotations`,
+    altrimenti le annotazioni verrebbero valutate (e il modulo importato) alla definizione.
+    """
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(importlib.import_module(self.__name__), name)
+
+    def __repr__(self) -> str:
+        return f"<lazy module '{self.__name__}'>"
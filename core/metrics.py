@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 00:21:33 2026
+
+@author: andreadesogus
+"""
+
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# Limiti superiori (in secondi) dei bucket degli istogrammi di durata
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Campioni prodotti da un collector: (nome, tipo, descrizione, [(etichette, valore)])
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Contatore monotono con etichette, nel formato Prometheus."""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(dict(zip(self.labels, key)))} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Istogramma cumulativo con bucket fissi ed etichette, nel formato Prometheus."""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DURATION_BUCKETS) -> None:
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # etichette -> [conteggi per bucket (non cumulativi, +Inf in coda), somma, conteggio]
+        self._values: Dict[Tuple[str, ...], List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = {key: (list(state[0]), state[1], state[2]) for key, state in self._values.items()}
+        for key, (counts, total, count) in sorted(values.items()):
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                bucket_labels = dict(labels, le=_format_value(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Registry:
+    """
+    Metriche del processo, esportate nel formato testuale di Prometheus.
+
+    Oltre a contatori e istogrammi registrati, i collector (funzioni senza argomenti che ritornano
+    una lista di `Sample`) espongono al momento dello scrape valori già mantenuti altrove,
+    come i contatori della cache condivisa o dell'accorpamento delle richieste.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Any] = {}
+        self._collectors: List[Callable[[], List[Sample]]] = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, name: str, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = factory()
+            return self._metrics[name]
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._get_or_create(name, lambda: Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DURATION_BUCKETS) -> Histogram:
+        return self._get_or_create(name, lambda: Histogram(name, help_text, labels, buckets))
+
+    def register_collector(self, collector: Callable[[], List[Sample]]) -> None:
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+                continue
+            for name, metric_type, help_text, values in samples:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in values:
+                    if value is not None:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "istat_stage_duration_seconds", "Durata delle fasi di elaborazione (download, parse, build, store, serialize, ...)",
+    ("stage",)
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "istat_request_duration_seconds", "Durata delle richieste HTTP servite", ("endpoint", "method", "status")
+)
+DOWNLOAD_BYTES = REGISTRY.counter(
+    "istat_download_bytes_total", "Byte ricevuti dal web service SDMX (compressi, se la risposta è gzip)", ("resource",)
+)
+ROWS = REGISTRY.counter("istat_rows_total", "Righe prodotte da ciascuna fase", ("stage",))
+CACHE_REQUESTS = REGISTRY.counter(
+    "istat_cache_requests_total", "Esiti delle letture dalle cache (hit, miss, revalidated, stale)", ("cache", "result")
+)
+
+
+class RequestTimings:
+    """
+    Durate per fase della richiesta in corso, riportate nell'header Server-Timing.
+    Le fasi eseguite in parallelo (es. sotto-richieste) vengono sommate.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self._stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage_name: str, seconds: float) -> None:
+        with self._lock:
+            self._stages[stage_name] = self._stages.get(stage_name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def header(self) -> str:
+        with self._lock:
+            stages = dict(self._stages)
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar("istat_request_timings", default=None)
+
+
+def start_request() -> Tuple[RequestTimings, contextvars.Token]:
+    """Inizia la raccolta delle durate per la richiesta corrente; il token va passato a `end_request`."""
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def end_request(token: contextvars.Token) -> None:
+    _current.reset(token)
+
+
+def record_stage(stage_name: str, seconds: float) -> None:
+    """Registra una durata già misurata nell'istogramma e nella richiesta in corso."""
+    STAGE_SECONDS.observe(seconds, stage=stage_name)
+    timings = _current.get()
+    if timings is not None:
+        timings.add(stage_name, seconds)
+
+
+@contextmanager
+def stage(stage_name: str) -> Iterator[None]:
+    """Misura la durata del blocco come fase `stage_name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage_name, time.perf_counter() - start)
+
+
+def timed_iter(iterable: Iterable[T], stage_name: str) -> Iterator[T]:
+    """
+    Itera misurando solo il tempo speso a produrre gli elementi (es. il parsing dei blocchi), escluso
+    quello del consumatore; la durata complessiva viene registrata a fine iterazione.
+    Per i DataFrame conta anche le righe prodotte.
+    """
+    iterator = iter(iterable)
+    total = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                total += time.perf_counter() - start
+            if hasattr(item, "columns"):
+                ROWS.inc(len(item), stage=stage_name)
+            yield item
+    finally:
+        record_stage(stage_name, total)
+
+
+def count_rows(stage_name: str, n_rows: int) -> None:
+    ROWS.inc(n_rows, stage=stage_name)
+
+
+def count_bytes(resource: Optional[str], n_bytes: int) -> None:
+    DOWNLOAD_BYTES.inc(n_bytes, resource=resource or "data")
+
+
+def count_cache(cache: str, result: str) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result=result)
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -6,8 +6,82 @@ Created on Sat Mar  1 12:34:03 2025
 @author: andreadesogus
 """
 
+from __future__ import annotations
+
+import csv
+import io
+import math
+import threading
 import xml.etree.ElementTree as ET
-import pandas as pd
+from array import array
+from typing import IO, Dict, Iterator, List, NamedTuple, Optional
+
+from core.lazy import LazyModule
+
+# Caricati al primo utilizzo: i metadati vengono analizzati in record nativi, senza pandas
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+
+
+class Dimension(NamedTuple):
+    """Dimensione della DSD, come riga di `DataSchemeExtractor.parse_dimensions`."""
+    id: Optional[str]
+    urn: Optional[str]
+    position: Optional[str]
+    concept_id: str
+    codelist_id: str
+
+
+class Code(NamedTuple):
+    """Codice di una codelist con i nomi in italiano e in inglese."""
+    id: Optional[str]
+    name_it: Optional[str]
+    name_en: Optional[str]
+
+
+# Colonne dei DataFrame equivalenti ai record nativi
+DIMENSION_COLUMNS = ["Dimension ID", "URN", "Position", "Concept ID", "Codelist ID"]
+CODE_COLUMNS = ["ID", "Nome_IT", "Nome_EN"]
+
+
+class SeriesKeys:
+    """
+    Chiavi delle serie in forma colonnare, senza pandas: per ogni dimensione i valori distinti
+    (in ordine di prima occorrenza) e il codice intero del valore di ciascuna serie (-1 se assente).
+    `to_frame` produce il DataFrame con colonne Categorical di `SeriesParser.parse_series`.
+    """
+
+    __slots__ = ("columns", "categories", "codes", "n_series")
+
+    def __init__(self, categories: Dict[str, List[str]], codes: Dict[str, array], n_series: int) -> None:
+        self.columns = list(categories)
+        self.categories = categories
+        self.codes = codes
+        self.n_series = n_series
+
+    def __len__(self) -> int:
+        return self.n_series
+
+    def values(self, column: str) -> List[str]:
+        """Valori distinti presenti nella dimensione."""
+        return self.categories[column]
+
+    def to_frame(self) -> pd.DataFrame:
+        """DataFrame con una riga per serie e una colonna Categorical per dimensione."""
+        columns = {}
+        for dim_id, categories in self.categories.items():
+            codes = np.frombuffer(self.codes[dim_id], dtype=np.int64)
+            columns[dim_id] = pd.Categorical.from_codes(codes, categories=categories)
+        return pd.DataFrame(columns)
+
+
+def _dimensions_frame(dimensions: List[Dimension]) -> pd.DataFrame:
+    return pd.DataFrame(dimensions, columns=DIMENSION_COLUMNS)
+
+
+def _codes_frame(codes: List[Code]) -> pd.DataFrame:
+    return pd.DataFrame(codes, columns=CODE_COLUMNS)
+
 
 class DataflowParser:
     """
@@ -21,6 +95,10 @@ class DataflowParser:
         }
     
     def parse_dataflows(self) -> pd.DataFrame:
+        return pd.DataFrame(self.dataflow_records())
+
+    def dataflow_records(self) -> List[Dict[str, Optional[str]]]:
+        """Dataflow del catalogo come lista di dizionari, nello stesso formato restituito da /api/dataflow."""
         dataflows = []
         for dataflow in self.root.findall(".//structure:Dataflow", self.namespaces):
             dataflow_id = dataflow.get("id")
@@ -37,9 +115,10 @@ class DataflowParser:
                 "Nome EN": name_en,
                 "Ref ID": ref_id
             })
-        return pd.DataFrame(dataflows)
+        return dataflows
     
-    def filter_by_name(self, df: pd.DataFrame, substring: str) -> pd.DataFrame:
+    @staticmethod
+    def filter_by_name(df: pd.DataFrame, substring: str) -> pd.DataFrame:
         return df[df['Nome IT'].str.contains(substring, case=False, na=False, regex=False)]
 
 class SeriesParser:
@@ -55,6 +134,11 @@ class SeriesParser:
         }
     
     def parse_series(self) -> (str, str, pd.DataFrame):
+        structure_id, ref_id, series_keys = self.parse_series_keys()
+        return structure_id, ref_id, series_keys.to_frame()
+
+    def parse_series_keys(self) -> (str, str, SeriesKeys):
+        """Come `parse_series`, ma con le chiavi in forma nativa (SeriesKeys)."""
         # Estrae lo structureID e il Ref ID
         structure_element = self.root.find(".//message:Structure", self.namespaces)
         structure_id = structure_element.get("structureID") if structure_element is not None else None
@@ -62,19 +146,21 @@ class SeriesParser:
         ref_element = self.root.find(".//common:Structure/Ref", self.namespaces)
         ref_id = ref_element.get("id") if ref_element is not None else None
         
-        # Estrae le chiavi delle serie
-        series_keys = []
-        for series in self.root.findall(".//generic:Series", self.namespaces):
+        # Estrae le chiavi delle serie, codificando i valori di ogni dimensione come interi
+        builder = _ColumnarBuilder()
+        for series in self.root.iterfind(".//generic:Series", self.namespaces):
             series_key = series.find("generic:SeriesKey", self.namespaces)
             if series_key is not None:
                 keys = {value.get("id"): value.get("value") for value in series_key.findall("generic:Value", self.namespaces)}
-                series_keys.append(keys)
-        df_series = pd.DataFrame(series_keys)
-        return structure_id, ref_id, df_series
+                builder.add_series(keys)
+        return structure_id, ref_id, builder.build_series_keys()
 
 class DataSchemeExtractor:
     """
     Classe per il parsing delle dimensioni dal XML.
+
+    Se il messaggio è stato richiesto con `references=children`, contiene anche le codelist
+    referenziate dalla DSD, estraibili dallo stesso albero con `parse_codelists`.
     """
     def __init__(self, xml_text: str):
         self.root = ET.fromstring(xml_text)
@@ -83,6 +169,10 @@ class DataSchemeExtractor:
         }
     
     def parse_dimensions(self) -> pd.DataFrame:
+        return _dimensions_frame(self.dimensions())
+
+    def dimensions(self) -> List[Dimension]:
+        """Dimensioni della DSD come record nativi, nell'ordine del messaggio."""
         dimensions_data = []
         for dimension in self.root.findall(".//structure:Dimension", self.namespaces):
             dim_id = dimension.get("id")
@@ -109,18 +199,21 @@ class DataSchemeExtractor:
             else:
                 codelist_id = "NOT FOUND"
             
-            dimensions_data.append({
-                "Dimension ID": dim_id,
-                "URN": urn,
-                "Position": position,
-                "Concept ID": concept_id,
-                "Codelist ID": codelist_id
-            })
-        return pd.DataFrame(dimensions_data)
+            dimensions_data.append(Dimension(dim_id, urn, position, concept_id, codelist_id))
+        return dimensions_data
+
+    def parse_codelists(self) -> Dict[str, pd.DataFrame]:
+        """Ritorna le codelist incluse nel messaggio, indicizzate per ID, senza riparsare il documento."""
+        return MetadataHelper(self.root).get_codelists()
+
+    def codelists(self) -> Dict[str, List[Code]]:
+        """Come `parse_codelists`, con i codici come record nativi."""
+        return MetadataHelper(self.root).codelists()
 
 class MetadataHelper:
     def __init__(self, xml_text):
-        self.root = ET.fromstring(xml_text)
+        # Accetta anche un albero già analizzato, per condividerlo con DataSchemeExtractor
+        self.root = xml_text if isinstance(xml_text, ET.Element) else ET.fromstring(xml_text)
         self.namespaces = {
             "message": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/message",
             "structure": "http://www.sdmx.org/resources/sdmxml/schemas/v2_1/structure",
@@ -129,17 +222,38 @@ class MetadataHelper:
         }
     
     def get_codes(self):
-        data = []
-        codes = self.root.findall(".//structure:Code", self.namespaces)
-        
-        for code in codes:
-            code_id = code.get("id")
-            name_it = self._get_element_text(code, "common:Name[@xml:lang='it']")
-            name_en = self._get_element_text(code, "common:Name[@xml:lang='en']")
-            
-            data.append({"ID": code_id, "Nome_IT": name_it, "Nome_EN": name_en})
-        
-        return pd.DataFrame(data)
+        return _codes_frame(self.codes())
+
+    def get_codelists(self) -> Dict[str, pd.DataFrame]:
+        """Ritorna tutte le codelist del messaggio in un solo passaggio, indicizzate per ID."""
+        return {codelist_id: _codes_frame(codes) for codelist_id, codes in self.codelists().items()}
+
+    def codes(self) -> List[Code]:
+        """Codici del messaggio come record nativi."""
+        return self._codes_to_records(self.root.findall(".//structure:Code", self.namespaces))
+
+    def codelists(self) -> Dict[str, List[Code]]:
+        """
+        Codelist del messaggio come record nativi, indicizzate per ID.
+        I codici vengono letti come figli diretti di ciascuna Codelist, senza scansioni dell'intero documento.
+        """
+        codelists = {}
+        for codelist in self.root.iterfind(".//structure:Codelist", self.namespaces):
+            codelist_id = codelist.get("id")
+            if codelist_id not in codelists:
+                codes = codelist.findall("structure:Code", self.namespaces)
+                codelists[codelist_id] = self._codes_to_records(codes)
+        return codelists
+
+    def _codes_to_records(self, codes) -> List[Code]:
+        return [
+            Code(
+                code.get("id"),
+                self._get_element_text(code, "common:Name[@xml:lang='it']"),
+                self._get_element_text(code, "common:Name[@xml:lang='en']")
+            )
+            for code in codes
+        ]
     
     def _get_element_text(self, parent, xpath):
         element = parent.find(xpath, self.namespaces)
@@ -151,14 +265,25 @@ class ValuesParser:
     
     """
     Classe per il parsing di un XML SDMX e la creazione di un DataFrame Pandas.
+
+    Il documento viene letto in streaming con `iterparse`: ogni Series viene rimossa dall'albero
+    subito dopo l'elaborazione e le righe vengono emesse a blocchi (`iter_chunks`), così la memoria
+    resta limitata anche su dataflow molto grandi. `parse()` raccoglie tutti i blocchi in un DataFrame.
+
+    I blocchi sono costruiti in forma colonnare: le dimensioni della serie sono Categorical,
+    TIME_PERIOD è Categorical e ObsValue è float64 (NaN se mancante o non numerico).
     """
     
-    def __init__(self, xml_text, namespaces=None):
+    def __init__(self, xml_text, namespaces=None, max_rows=None, max_bytes=None, budget=None):
         """
-        Inizializza il parser con il testo XML e i namespace da utilizzare.
+        Inizializza il parser con il documento XML e i namespace da utilizzare.
         
-        :param xml_text: Stringa contenente il documento XML.
+        :param xml_text: Documento XML come stringa, bytes oppure stream binario (es. la risposta HTTP).
         :param namespaces: Dizionario dei namespace. Se non fornito, vengono usati quelli di default.
+        :param max_rows: Numero massimo di osservazioni ammesse; oltre viene sollevato ValueError.
+        :param max_bytes: Numero massimo di byte letti dallo stream; oltre viene sollevato ValueError.
+        :param budget: ExtractionBudget condiviso con altri parser (es. le sotto-richieste di un'estrazione);
+            se indicato sostituisce max_rows e max_bytes.
         """
         self.xml_text = xml_text
         self.namespaces = namespaces or {
@@ -166,7 +291,18 @@ class ValuesParser:
             'generic': 'http://www.sdmx.org/resources/sdmxml/schemas/v2_1/data/generic',
             'common': 'http://www.sdmx.org/resources/sdmxml/schemas/v2_1/common'
         }
-        self.root = ET.fromstring(self.xml_text)
+        self.budget = budget or ExtractionBudget(max_rows, max_bytes)
+
+    def _open_source(self) -> IO[bytes]:
+        """Ritorna uno stream binario sul documento, limitato a max_bytes se configurato."""
+        source = self.xml_text
+        if isinstance(source, str):
+            source = io.BytesIO(source.encode("utf-8"))
+        elif isinstance(source, bytes):
+            source = io.BytesIO(source)
+        if self.budget.max_bytes is not None:
+            source = _ByteBudgetReader(source, self.budget)
+        return source
 
     def _extract_series_key(self, series):
         """
@@ -183,27 +319,54 @@ class ValuesParser:
             series_key[val.attrib['id']] = val.attrib['value']
         return series_key
 
-    def _extract_obs_data(self, series_key, obs):
+    def iter_chunks(self, chunk_size: Optional[int] = 50000) -> Iterator[pd.DataFrame]:
         """
-        Estrae i dati di un'osservazione e li combina con la SeriesKey.
+        Esegue il parsing in streaming ed emette DataFrame di al più `chunk_size` osservazioni.
+        Con `chunk_size=None` viene emesso un unico blocco finale.
         
-        :param series_key: Dizionario contenente la SeriesKey.
-        :param obs: Elemento XML dell'osservazione.
-        :return: Dizionario con i dati combinati.
+        :return: Iteratore di DataFrame Pandas con le osservazioni.
         """
-        # Inizializza la riga con i dati della SeriesKey
-        row = series_key.copy() if series_key else {}
-        
-        # Estrai la dimensione temporale (ad es. TIME_PERIOD)
-        time_dim = obs.find("generic:ObsDimension", self.namespaces)
-        if time_dim is not None:
-            row[time_dim.attrib['id']] = time_dim.attrib['value']
-        
-        # Estrai il valore osservato
-        obs_value = obs.find("generic:ObsValue", self.namespaces)
-        row['ObsValue'] = obs_value.attrib.get('value') if obs_value is not None else None
-        
-        return row
+        series_tag = f"{{{self.namespaces['generic']}}}Series"
+        dataset_tag = f"{{{self.namespaces['message']}}}DataSet"
+        obs_dim_tag = f"{{{self.namespaces['generic']}}}ObsDimension"
+        obs_value_tag = f"{{{self.namespaces['generic']}}}ObsValue"
+        dataset = None
+        builder = _ColumnarBuilder()
+        n_rows = 0  # osservazioni già emesse nei blocchi precedenti
+        counted = 0  # osservazioni già conteggiate nel budget
+        for event, elem in ET.iterparse(self._open_source(), events=("start", "end")):
+            if event == "start":
+                if elem.tag == dataset_tag:
+                    dataset = elem
+                continue
+            if elem.tag != series_tag:
+                continue
+            series_key = self._extract_series_key(elem)
+            if series_key is not None:  # Salta le series senza SeriesKey
+                series_idx = builder.add_series(series_key)
+                for obs in elem.iterfind("generic:Obs", self.namespaces):
+                    # Estrae dimensione temporale (ad es. TIME_PERIOD) e valore osservato
+                    time_value = obs_value = None
+                    for child in obs:
+                        if child.tag == obs_dim_tag:
+                            builder.time_id = builder.time_id or child.get('id')
+                            time_value = child.get('value')
+                        elif child.tag == obs_value_tag:
+                            obs_value = child.get('value')
+                    builder.add_obs(series_idx, time_value, obs_value)
+            # Libera la Series appena elaborata
+            if dataset is not None and len(dataset) and dataset[0] is elem:
+                dataset.remove(elem)
+            else:
+                elem.clear()
+            self.budget.add_rows(n_rows + len(builder) - counted)
+            counted = n_rows + len(builder)
+            if chunk_size is not None and len(builder) >= chunk_size:
+                n_rows += len(builder)
+                yield builder.build()
+                builder = _ColumnarBuilder()
+        if len(builder) or n_rows == 0:
+            yield builder.build()
 
     def parse(self):
         """
@@ -211,12 +374,228 @@ class ValuesParser:
         
         :return: DataFrame Pandas contenente tutte le osservazioni.
         """
-        rows = []
-        for series in self.root.findall(".//generic:Series", self.namespaces):
-            series_key = self._extract_series_key(series)
-            if series_key is None:
-                continue  # Salta le series senza SeriesKey
-            for obs in series.findall("generic:Obs", self.namespaces):
-                row = self._extract_obs_data(series_key, obs)
-                rows.append(row)
-        return pd.DataFrame(rows)
+        return next(self.iter_chunks(chunk_size=None))
+
+
+class SdmxCsvParser:
+    """
+    Classe per il parsing di messaggi SDMX-CSV (versione 1.0), alternativa veloce a SDMX-ML.
+
+    Le colonne del messaggio sono DATAFLOW, le dimensioni (TIME_PERIOD inclusa), OBS_VALUE e gli
+    attributi. Il risultato ha la stessa struttura di ValuesParser e SeriesParser: dimensioni
+    e TIME_PERIOD come Categorical, ObsValue come float64; gli attributi vengono ignorati.
+    """
+
+    MEDIA_TYPE = "application/vnd.sdmx.data+csv;version=1.0.0"
+    _LEADING_COLUMNS = ("DATAFLOW", "STRUCTURE", "STRUCTURE_ID", "ACTION")
+
+    def __init__(self, csv_text, max_rows=None, max_bytes=None, time_id="TIME_PERIOD", budget=None):
+        """
+        :param csv_text: Messaggio SDMX-CSV come stringa, bytes oppure stream binario.
+        :param max_rows: Numero massimo di osservazioni ammesse; oltre viene sollevato ValueError.
+        :param max_bytes: Numero massimo di byte letti dallo stream; oltre viene sollevato ValueError.
+        :param budget: ExtractionBudget condiviso con altri parser; se indicato sostituisce max_rows e max_bytes.
+        """
+        self.csv_text = csv_text
+        self.budget = budget or ExtractionBudget(max_rows, max_bytes)
+        self.time_id = time_id
+
+    def _open_source(self) -> IO[str]:
+        source = self.csv_text
+        if isinstance(source, str):
+            source = io.BytesIO(source.encode("utf-8"))
+        elif isinstance(source, bytes):
+            source = io.BytesIO(source)
+        if self.budget.max_bytes is not None:
+            source = io.BufferedReader(_ByteBudgetReader(source, self.budget))
+        return io.TextIOWrapper(source, encoding="utf-8-sig", newline="")
+
+    def _dimensions(self, columns: List[str]) -> List[str]:
+        """Dimensioni di serie: le colonne tra quelle iniziali (DATAFLOW) e OBS_VALUE, escluso il tempo."""
+        start = 0
+        while start < len(columns) and columns[start] in self._LEADING_COLUMNS:
+            start += 1
+        end = columns.index("OBS_VALUE") if "OBS_VALUE" in columns else len(columns)
+        return [col for col in columns[start:end] if col != self.time_id]
+
+    def _read(self, chunk_size: Optional[int], series_only: bool = False):
+        stream = self._open_source()
+        columns = next(csv.reader([stream.readline()]), [])
+        dimensions = self._dimensions(columns)
+        usecols = dimensions if series_only else dimensions + [c for c in (self.time_id, "OBS_VALUE") if c in columns]
+        dtypes = {col: "category" for col in dimensions + [self.time_id]}
+        dtypes["OBS_VALUE"] = "float64"
+        # keep_default_na=False: codici come "NA" (Namibia) non devono diventare NaN
+        reader = pd.read_csv(
+            stream, header=None, names=columns, usecols=usecols, dtype=dtypes,
+            keep_default_na=False, na_values={"OBS_VALUE": ["", "NaN"]},
+            chunksize=chunk_size,
+        )
+        return dimensions, reader
+
+    def _finalize(self, df: pd.DataFrame, dimensions: List[str]) -> pd.DataFrame:
+        df = df.rename(columns={"OBS_VALUE": "ObsValue"})
+        ordered = dimensions + [c for c in (self.time_id, "ObsValue") if c in df.columns]
+        return df[ordered]
+
+    def iter_chunks(self, chunk_size: Optional[int] = 50000) -> Iterator[pd.DataFrame]:
+        """Emette DataFrame di al più `chunk_size` osservazioni (un unico blocco con None)."""
+        dimensions, reader = self._read(chunk_size)
+        chunks = reader if chunk_size is not None else [reader]
+        for chunk in chunks:
+            self.budget.add_rows(len(chunk))
+            yield self._finalize(chunk, dimensions)
+
+    def parse(self) -> pd.DataFrame:
+        return next(self.iter_chunks(chunk_size=None))
+
+    def parse_series(self) -> (str, str, pd.DataFrame):
+        """Equivalente di SeriesParser.parse_series: una riga per serie con le sole dimensioni."""
+        dimensions, df = self._read(None, series_only=True)
+        df_series = df.drop_duplicates().reset_index(drop=True)
+        return None, None, df_series
+
+    def parse_series_keys(self) -> (str, str, SeriesKeys):
+        """Come `parse_series`, ma letto con il modulo csv e restituito in forma nativa (SeriesKeys)."""
+        stream = self._open_source()
+        reader = csv.reader(stream)
+        columns = next(reader, [])
+        dimensions = self._dimensions(columns)
+        positions = [columns.index(dim_id) for dim_id in dimensions]
+        builder = _ColumnarBuilder()
+        seen = set()
+        for row in reader:
+            if not row:
+                continue
+            key = tuple(row[i] for i in positions)
+            if key not in seen:
+                seen.add(key)
+                builder.add_series(dict(zip(dimensions, key)))
+        return None, None, builder.build_series_keys()
+
+
+class ExtractionBudget:
+    """
+    Limiti di osservazioni e byte di un'estrazione, condivisi tra i parser delle sue sotto-richieste
+    (anche in thread diversi): il primo parser che supera il totale solleva ValueError.
+    """
+
+    def __init__(self, max_rows: Optional[int] = None, max_bytes: Optional[int] = None) -> None:
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.rows = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def add_rows(self, n: int) -> None:
+        if self.max_rows is None:
+            return
+        with self._lock:
+            self.rows += n
+            exceeded = self.rows > self.max_rows
+        if exceeded:
+            raise ValueError(f"Il dataset richiesto supera il limite di {self.max_rows} osservazioni. Applica più filtri.")
+
+    def add_bytes(self, n: int) -> None:
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            self.bytes += n
+            exceeded = self.bytes > self.max_bytes
+        if exceeded:
+            raise ValueError(f"La risposta supera il limite di {self.max_bytes} byte. Applica più filtri.")
+
+
+class _ByteBudgetReader(io.RawIOBase):
+    """
+    Stream binario che conteggia i byte letti nel budget, che solleva ValueError oltre il limite.
+    È un RawIOBase, quindi può essere avvolto da io.BufferedReader e io.TextIOWrapper.
+    """
+
+    def __init__(self, stream: IO[bytes], budget: ExtractionBudget) -> None:
+        self.stream = stream
+        self.budget = budget
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.stream.read(len(buffer))
+        self.budget.add_bytes(len(data))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class _ColumnarBuilder:
+    """
+    Costruisce un DataFrame in forma colonnare, senza dizionari per riga.
+
+    I valori delle dimensioni vengono codificati come interi una sola volta per serie e
+    diventano colonne Categorical; per ogni osservazione vengono accodati solo l'indice della
+    serie, il codice del periodo e il valore in array tipizzati.
+    """
+
+    def __init__(self) -> None:
+        self.categories: Dict[str, Dict[str, int]] = {}  # dimensione -> {valore: codice}
+        self.series_codes: Dict[str, List[int]] = {}     # dimensione -> codice per serie (-1 se assente)
+        self.n_series = 0
+        self.time_id: Optional[str] = None
+        self.time_categories: Dict[str, int] = {}
+        self.obs_series = array("q")
+        self.obs_time = array("q")
+        self.obs_values = array("d")
+
+    def __len__(self) -> int:
+        return len(self.obs_values)
+
+    def add_series(self, series_key: Dict[str, str]) -> int:
+        """Registra una serie e ritorna il suo indice."""
+        for dim_id in series_key:
+            if dim_id not in self.categories:
+                self.categories[dim_id] = {}
+                self.series_codes[dim_id] = [-1] * self.n_series
+        for dim_id, categories in self.categories.items():
+            value = series_key.get(dim_id)
+            self.series_codes[dim_id].append(-1 if value is None else categories.setdefault(value, len(categories)))
+        self.n_series += 1
+        return self.n_series - 1
+
+    def add_obs(self, series_idx: int, time_value: Optional[str], obs_value: Optional[str]) -> None:
+        self.obs_series.append(series_idx)
+        self.obs_time.append(-1 if time_value is None else self.time_categories.setdefault(time_value, len(self.time_categories)))
+        self.obs_values.append(_to_float(obs_value))
+
+    def build_series_keys(self) -> SeriesKeys:
+        """Chiavi delle serie in forma nativa, senza pandas."""
+        return SeriesKeys(
+            {dim_id: list(categories) for dim_id, categories in self.categories.items()},
+            {dim_id: array("q", codes) for dim_id, codes in self.series_codes.items()},
+            self.n_series
+        )
+
+    def build_series(self) -> pd.DataFrame:
+        """DataFrame con una riga per serie e una colonna Categorical per dimensione."""
+        return self.build_series_keys().to_frame()
+
+    def build(self) -> pd.DataFrame:
+        """DataFrame con una riga per osservazione: dimensioni, periodo e ObsValue."""
+        if not len(self):
+            return pd.DataFrame()
+        obs_series = np.frombuffer(self.obs_series, dtype=np.int64)
+        columns = {}
+        for dim_id, categories in self.categories.items():
+            codes = np.asarray(self.series_codes[dim_id], dtype=np.int64)[obs_series]
+            columns[dim_id] = pd.Categorical.from_codes(codes, categories=list(categories))
+        if self.time_id is not None:
+            columns[self.time_id] = pd.Categorical.from_codes(
+                np.array(self.obs_time, dtype=np.int64), categories=list(self.time_categories)
+            )
+        columns["ObsValue"] = np.array(self.obs_values, dtype=np.float64)
+        return pd.DataFrame(columns)
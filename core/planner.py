@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 22:41:07 2026
+
+@author: andreadesogus
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from core.lazy import LazyModule
+from core.utils import SeriesKeyIndex
+
+pd = LazyModule("pandas")
+
+# Osservazioni stimate oltre le quali una richiesta viene divisa (0 disabilita la divisione)
+SPLIT_MAX_OBS = int(os.environ.get("ISTAT_SPLIT_MAX_OBS", 200_000))
+# Numero indicativo massimo di sotto-richieste per estrazione
+SPLIT_MAX_PARTS = int(os.environ.get("ISTAT_SPLIT_MAX_PARTS", 32))
+# Sotto-richieste scaricate in parallelo per estrazione
+SPLIT_CONCURRENCY = int(os.environ.get("ISTAT_SPLIT_CONCURRENCY", 4))
+# Anni ipotizzati nella stima quando la richiesta non indica startPeriod
+SPLIT_DEFAULT_YEARS = int(os.environ.get("ISTAT_SPLIT_DEFAULT_YEARS", 30))
+# Lunghezza massima della chiave di una sotto-richiesta (i valori in OR allungano l'URL)
+MAX_KEY_LENGTH = 1000
+
+# Osservazioni per anno in base al valore della dimensione FREQ
+PERIODS_PER_YEAR = {"A": 1, "S": 2, "Q": 4, "M": 12, "W": 52, "B": 260, "D": 365, "H": 8760}
+
+
+class QueryPart(NamedTuple):
+    """Sotto-richiesta: chiave SDMX (es. "A.ITC1+ITC2..1") e parametri della query string."""
+    key: str
+    params: Dict[str, str]
+
+
+class QueryPlanner:
+    """
+    Divide un'estrazione troppo grande in più sotto-richieste da scaricare in parallelo.
+
+    La dimensione del risultato viene stimata dall'indice delle chiavi delle serie, senza interrogare
+    il web service: numero di serie che soddisfano la chiave, per frequenza (FREQ), moltiplicato per
+    gli anni della finestra richiesta. Oltre `max_obs`, la richiesta viene divisa sulla dimensione con
+    più valori: i valori vengono raggruppati in ordine con la sintassi SDMX in OR ('+') finché ciascun
+    gruppo resta entro la soglia. Un singolo valore ancora troppo grande viene diviso su un'altra
+    dimensione; se non ci sono altre dimensioni utili e la finestra ha un inizio, si divide per anni.
+
+    La soglia effettiva cresce con il totale stimato, così le sotto-richieste restano circa `max_parts`.
+    """
+
+    def __init__(self, index: SeriesKeyIndex, max_obs: int = SPLIT_MAX_OBS, max_parts: int = SPLIT_MAX_PARTS,
+                 default_years: int = SPLIT_DEFAULT_YEARS) -> None:
+        self.index = index
+        self.max_obs = max_obs
+        self.max_parts = max_parts
+        self.default_years = default_years
+        self._freq = index.bitmaps.get("FREQ")
+
+    def _years(self, params: Dict[str, str]) -> int:
+        start, end = params.get("startPeriod"), params.get("endPeriod")
+        if not start:
+            return self.default_years
+        last = int(end[:4]) if end else time.gmtime().tm_year
+        return max(1, last - int(start[:4]) + 1)
+
+    def estimate(self, bitmap: int, years: int) -> int:
+        """Osservazioni stimate per le serie della bitmap in una finestra di `years` anni."""
+        if self._freq is None:
+            return bitmap.bit_count() * years
+        total = 0
+        for freq, freq_bitmap in self._freq.items():
+            n_series = (bitmap & freq_bitmap).bit_count()
+            if n_series:
+                total += n_series * PERIODS_PER_YEAR.get(freq, 1) * years
+        return total
+
+    def plan(self, key: str, params: Optional[Dict[str, str]] = None) -> List[QueryPart]:
+        """Ritorna le sotto-richieste per la chiave e i parametri indicati (una sola se non serve dividere)."""
+        params = dict(params or {})
+        years = self._years(params)
+        total = self.estimate(self.index.bitmap(key), years)
+        if not self.max_obs or total <= self.max_obs:
+            return [QueryPart(key, params)]
+        target = max(self.max_obs, -(-total // self.max_parts))
+        parts = []
+        for slots, estimate in self._split_dimensions(self.index.split(key), years, target):
+            part_key = ".".join(slots)
+            for window in self._split_time(params, estimate, target):
+                parts.append(QueryPart(part_key, dict(params, **window)))
+        return parts
+
+    def _split_column(self, bitmap: int) -> Optional[str]:
+        """Dimensione con più valori distinti tra le serie della bitmap (None se nessuna ne ha più di uno)."""
+        best, best_count = None, 1
+        for col in self.index.columns:
+            count = sum(1 for value_bitmap in self.index.bitmaps[col].values() if bitmap & value_bitmap)
+            if count > best_count:
+                best, best_count = col, count
+        return best
+
+    def _split_dimensions(self, slots: List[str], years: int, target: int) -> List[Tuple[List[str], int]]:
+        bitmap = self.index.bitmap(".".join(slots))
+        estimate = self.estimate(bitmap, years)
+        if estimate <= target:
+            return [(slots, estimate)]
+        column = self._split_column(bitmap)
+        if column is None:
+            return [(slots, estimate)]
+        position = self.index.columns.index(column)
+        base_length = len(".".join(slots)) - len(slots[position])
+
+        groups: List[Tuple[List[str], int]] = []
+        values: List[str] = []
+        group_estimate = key_length = 0
+        for value, value_bitmap in sorted(self.index.bitmaps[column].items()):
+            value_estimate = self.estimate(bitmap & value_bitmap, years)
+            if not value_estimate:
+                continue
+            too_long = base_length + key_length + len(value) > MAX_KEY_LENGTH
+            if values and (group_estimate + value_estimate > target or too_long):
+                groups.append((values, group_estimate))
+                values, group_estimate, key_length = [], 0, 0
+            values.append(value)
+            group_estimate += value_estimate
+            key_length += len(value) + 1
+        if values:
+            groups.append((values, group_estimate))
+
+        parts = []
+        for values, group_estimate in groups:
+            part = list(slots)
+            part[position] = "+".join(values)
+            if len(values) == 1 and group_estimate > target:
+                parts.extend(self._split_dimensions(part, years, target))
+            else:
+                parts.append((part, group_estimate))
+        return parts
+
+    def _split_time(self, params: Dict[str, str], estimate: int, target: int) -> List[Dict[str, str]]:
+        """Finestre annuali consecutive per una sotto-richiesta ancora oltre la soglia ([{}] se non serve)."""
+        start, end = params.get("startPeriod"), params.get("endPeriod")
+        if estimate <= target or not start:
+            return [{}]
+        first = int(start[:4])
+        last = int(end[:4]) if end else time.gmtime().tm_year
+        n_windows = min(-(-estimate // target), last - first + 1)
+        if n_windows <= 1:
+            return [{}]
+        step = -(-(last - first + 1) // n_windows)
+        windows = []
+        for year in range(first, last + 1, step):
+            window = {"startPeriod": start if year == first else str(year)}
+            if year + step <= last:
+                window["endPeriod"] = str(year + step - 1)
+            elif end:
+                window["endPeriod"] = end
+            windows.append(window)
+        return windows
+
+
+def merge_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Unisce i DataFrame delle sotto-richieste mantenendo le colonne Categorical
+    (pd.concat le convertirebbe in object se le categorie sono diverse).
+    """
+    frames = [df for df in frames if len(df.columns)]
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0]
+    columns = list(frames[0].columns)
+    if any(list(df.columns) != columns for df in frames[1:]):
+        return pd.concat(frames, ignore_index=True)
+    merged = {}
+    for col in columns:
+        values = [df[col] for df in frames]
+        if all(isinstance(v.dtype, pd.CategoricalDtype) for v in values):
+            merged[col] = pd.api.types.union_categoricals(values)
+        else:
+            merged[col] = pd.concat(values, ignore_index=True)
+    return pd.DataFrame(merged)
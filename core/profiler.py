@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 01:02:18 2026
+
+@author: andreadesogus
+"""
+
+import importlib
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+
+from core.cache import default_cache_dir
+
+# Durata oltre la quale il profilo di una richiesta viene salvato; se non impostata il profiler è disattivato
+PROFILE_SLOW_MS = os.environ.get("ISTAT_PROFILE_SLOW_MS")
+# Intervallo di campionamento degli stack in millisecondi
+PROFILE_INTERVAL_MS = float(os.environ.get("ISTAT_PROFILE_INTERVAL_MS", 5))
+# Numero massimo di profili mantenuti su disco (i più vecchi vengono rimossi)
+PROFILE_MAX_FILES = int(os.environ.get("ISTAT_PROFILE_MAX_FILES", 100))
+
+
+class SlowRequestProfiler:
+    """
+    Profiler a campionamento per le richieste lente.
+
+    Un unico thread in background legge periodicamente lo stack delle richieste in corso e conta
+    gli stack osservati. A fine richiesta, se la durata supera la soglia, i conteggi vengono salvati
+    in formato "folded" (una riga per stack, funzioni separate da ';' seguite dal numero di campioni),
+    leggibile da flamegraph.pl o speedscope. Le richieste veloci non producono file e il costo è
+    limitato al campionamento.
+
+    Con worker a thread lo stack di una richiesta è quello del suo thread (`sys._current_frames`).
+    Con gevent le richieste sono greenlet dello stesso thread: si campiona il frame di ciascun
+    greenlet (`gr_frame`), o quello del thread se il greenlet è in esecuzione. Il thread di
+    campionamento è un thread del sistema operativo anche dopo il monkey patching, così continua
+    a campionare mentre un greenlet occupa la CPU.
+    """
+
+    def __init__(self, threshold_ms: float, directory: str, interval_ms: float = PROFILE_INTERVAL_MS,
+                 max_files: int = PROFILE_MAX_FILES) -> None:
+        self.threshold = threshold_ms / 1000
+        self.directory = directory
+        self.interval = interval_ms / 1000
+        self.max_files = max_files
+        # richiesta (ident del thread o greenlet) -> (inizio, conteggio degli stack campionati, ident del thread, greenlet)
+        self._active: Dict[Any, Tuple[float, Counter, int, Any]] = {}
+        # Primitive originali: con gevent quelle di threading e time cederebbero il controllo all'hub
+        self._get_ident = _native("_thread", "get_ident")
+        self._sleep = _native("time", "sleep")
+        self._lock = _native("_thread", "allocate_lock")()
+        # Bloccato mentre non ci sono richieste da campionare: begin lo rilascia per svegliare il thread
+        self._wakeup = _native("_thread", "allocate_lock")()
+        self._wakeup.acquire()
+        self._started = False
+        os.makedirs(directory, exist_ok=True)
+
+    def begin(self) -> None:
+        """Inizia a campionare la richiesta corrente."""
+        task = _current_greenlet()
+        key = task if task is not None else self._get_ident()
+        with self._lock:
+            self._active[key] = (time.perf_counter(), Counter(), self._get_ident(), task)
+            if not self._started:
+                _native("_thread", "start_new_thread")(self._run, ())
+                self._started = True
+            if self._wakeup.locked():
+                self._wakeup.release()
+
+    def end(self, label: str) -> Optional[str]:
+        """Smette di campionare la richiesta corrente; se è stata lenta salva il profilo e ne ritorna il percorso."""
+        task = _current_greenlet()
+        with self._lock:
+            entry = self._active.pop(task if task is not None else self._get_ident(), None)
+        if entry is None:
+            return None
+        started, samples, _, _ = entry
+        elapsed = time.perf_counter() - started
+        if elapsed < self.threshold or not samples:
+            return None
+        return self._write(label, elapsed, samples)
+
+    def _run(self) -> None:
+        own_ident = self._get_ident()
+        while True:
+            with self._lock:
+                idle = not self._active
+            if idle:
+                self._wakeup.acquire()
+                continue
+            self._sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                active = list(self._active.values())
+            for _, samples, ident, task in active:
+                if ident == own_ident or (task is not None and task.dead):
+                    continue
+                # Un greenlet sospeso espone il proprio frame; quello in esecuzione è il frame corrente del thread
+                frame = task.gr_frame if task is not None else None
+                if frame is None:
+                    frame = frames.get(ident)
+                if frame is not None:
+                    samples[_fold(frame)] += 1
+
+    def _write(self, label: str, elapsed: float, samples: Counter) -> Optional[str]:
+        name = re.sub(r"[^A-Za-z0-9]+", "_", label).strip("_") or "request"
+        path = os.path.join(
+            self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{int(elapsed * 1000)}ms.folded"
+        )
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in samples.most_common():
+                    f.write(f"{stack} {count}\n")
+            self._prune()
+        except OSError as e:
+            print(f"Unable to write profile {path}: {e}")
+            return None
+        print(f"Slow request {label} ({elapsed * 1000:.0f} ms): profile written to {path}")
+        return path
+
+    def _prune(self) -> None:
+        files = sorted(
+            (os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith(".folded")),
+            key=os.path.getmtime
+        )
+        for path in files[:max(0, len(files) - self.max_files)]:
+            os.remove(path)
+
+
+def _native(module: str, name: str):
+    """Attributo originale della libreria standard, anche se gevent ha applicato il monkey patching."""
+    monkey = sys.modules.get("gevent.monkey")
+    if monkey is not None:
+        return monkey.get_original(module, name)
+    return getattr(importlib.import_module(module), name)
+
+
+def _current_greenlet():
+    """Greenlet corrente se gevent ha sostituito i thread con greenlet, altrimenti None."""
+    monkey = sys.modules.get("gevent.monkey")
+    if monkey is None or not monkey.is_module_patched("threading"):
+        return None
+    from greenlet import getcurrent
+    return getcurrent()
+
+
+def _fold(frame) -> str:
+    """Stack del frame dalla radice, come "modulo:funzione;modulo:funzione"."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+_profiler: Optional[SlowRequestProfiler] = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> Optional[SlowRequestProfiler]:
+    """
+    Ritorna il profiler delle richieste lente del processo, creandolo al primo utilizzo.
+    Ritorna None se ISTAT_PROFILE_SLOW_MS non è impostata.
+    """
+    global _profiler
+    if not PROFILE_SLOW_MS:
+        return None
+    if _profiler is None:
+        with _profiler_lock:
+            if _profiler is None:
+                cache_dir = default_cache_dir()
+                _profiler = SlowRequestProfiler(
+                    float(PROFILE_SLOW_MS),
+                    os.environ.get("ISTAT_PROFILE_DIR", os.path.join(cache_dir, "profiles")),
+                )
+    return _profiler
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:58:42 2026
+
+@author: andreadesogus
+"""
+
+import heapq
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Peso di ciascun campo del catalogo nel punteggio
+FIELD_WEIGHTS = {
+    "Dataflow ID": 8,
+    "Ref ID": 4,
+    "Nome IT": 3,
+    "Nome EN": 2,
+}
+# Moltiplicatore per tipo di corrispondenza tra termine cercato e token indicizzato
+EXACT, PREFIX, SUBSTRING = 3, 2, 1
+# Bonus per la ricerca esatta di un Dataflow ID
+ID_MATCH_BONUS = 100
+# Ricerche memorizzate per indice (le stesse query si ripetono durante la digitazione)
+RESULT_CACHE_SIZE = 1024
+
+
+def fold(text: Any) -> str:
+    """Minuscolo e senza accenti (es. "Attività" -> "attivita")."""
+    decomposed = unicodedata.normalize("NFKD", str(text))
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text: Any) -> List[str]:
+    return _TOKEN_RE.findall(fold(text))
+
+
+def _trigrams(token: str) -> Set[str]:
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+class CatalogueIndex:
+    """
+    Indice di ricerca sul catalogo dei dataflow, costruito una sola volta per versione del catalogo.
+
+    Indicizza nomi italiani e inglesi, Dataflow ID e Ref ID dopo tokenizzazione e rimozione degli accenti.
+    Ogni termine cercato viene risolto con tre dizionari precostruiti: token esatti, prefissi (per la
+    ricerca durante la digitazione) e trigrammi (per le sottostringhe interne a una parola, es. "occup"
+    in "disoccupazione"). Un dataflow deve contenere tutti i termini; il punteggio somma, per ciascun
+    termine, il peso del campo per il tipo di corrispondenza migliore. A parità di punteggio vale
+    l'ordine del catalogo (per nome).
+
+    Il costo di una ricerca dipende dal numero di dataflow che contengono i termini, non dalla
+    dimensione del catalogo; le ricerche recenti vengono inoltre memorizzate per indice.
+    """
+
+    def __init__(self, records: List[Dict[str, Any]]) -> None:
+        self.records = records
+        self._exact: Dict[str, Dict[int, int]] = {}
+        self._prefix: Dict[str, Dict[int, int]] = {}
+        self._trigrams: Dict[str, Set[str]] = {}
+        self._ids: Dict[str, int] = {}
+        self._results: "OrderedDict[Tuple[str, Optional[int]], List[Dict[str, Any]]]" = OrderedDict()
+        self._results_lock = threading.Lock()
+
+        for doc, record in enumerate(self.records):
+            self._ids.setdefault(fold(record.get("Dataflow ID", "")), doc)
+            for field, weight in FIELD_WEIGHTS.items():
+                for token in set(tokenize(record.get(field) or "")):
+                    self._add(self._exact, token, doc, weight)
+                    for end in range(1, len(token)):
+                        self._add(self._prefix, token[:end], doc, weight)
+
+        for token in self._exact:
+            for trigram in _trigrams(token):
+                self._trigrams.setdefault(trigram, set()).add(token)
+
+    @staticmethod
+    def _add(postings: Dict[str, Dict[int, int]], key: str, doc: int, weight: int) -> None:
+        docs = postings.setdefault(key, {})
+        if weight > docs.get(doc, 0):
+            docs[doc] = weight
+
+    def _term_scores(self, term: str) -> Dict[int, int]:
+        """Punteggio di ciascun dataflow per un singolo termine (corrispondenza migliore tra i campi)."""
+        scores: Dict[int, int] = {}
+
+        def merge(docs: Dict[int, int], factor: int) -> None:
+            for doc, weight in docs.items():
+                if weight * factor > scores.get(doc, 0):
+                    scores[doc] = weight * factor
+
+        merge(self._exact.get(term, {}), EXACT)
+        merge(self._prefix.get(term, {}), PREFIX)
+        if len(term) >= 3:
+            candidates = None
+            for trigram in _trigrams(term):
+                tokens = self._trigrams.get(trigram)
+                if not tokens:
+                    candidates = set()
+                    break
+                candidates = tokens if candidates is None else candidates & tokens
+            for token in candidates or ():
+                if term in token and not token.startswith(term):
+                    merge(self._exact[token], SUBSTRING)
+        return scores
+
+    def search(self, query: Optional[str], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Ritorna i dataflow che contengono tutti i termini di `query`, ordinati per rilevanza.
+        Senza query ritorna il catalogo nell'ordine originale. `limit` tronca i risultati.
+        """
+        terms = list(dict.fromkeys(tokenize(query or "")))
+        if not terms:
+            return self.records[:limit] if limit is not None else list(self.records)
+
+        cache_key = (fold(query).strip(), limit)
+        with self._results_lock:
+            if cache_key in self._results:
+                self._results.move_to_end(cache_key)
+                return list(self._results[cache_key])
+
+        results = self._rank(terms, cache_key[0], limit)
+        with self._results_lock:
+            self._results[cache_key] = results
+            while len(self._results) > RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+        return list(results)
+
+    def _rank(self, terms: List[str], folded_query: str, limit: Optional[int]) -> List[Dict[str, Any]]:
+        scores: Optional[Dict[int, int]] = None
+        # I termini più selettivi per primi: le intersezioni successive restano piccole
+        for term_scores in sorted((self._term_scores(term) for term in terms), key=len):
+            if scores is None:
+                scores = dict(term_scores)
+            else:
+                scores = {doc: score + term_scores[doc] for doc, score in scores.items() if doc in term_scores}
+            if not scores:
+                return []
+
+        id_doc = self._ids.get(folded_query)
+        if id_doc is not None and id_doc in scores:
+            scores[id_doc] += ID_MATCH_BONUS
+
+        key = lambda doc: (-scores[doc], doc)
+        docs = heapq.nsmallest(limit, scores, key=key) if limit is not None else sorted(scores, key=key)
+        return [self.records[doc] for doc in docs]
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:46:19 2026
+
+@author: andreadesogus
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from core import metrics
+from core.aggregation import AggregationError, period_bounds
+from core.cache import default_cache_dir
+from core.lazy import LazyModule
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS queries (
+    query TEXT PRIMARY KEY,
+    dataflow TEXT NOT NULL,
+    columns TEXT NOT NULL,
+    start_period TEXT,
+    end_period TEXT,
+    fetched_at REAL NOT NULL,
+    updated_after TEXT NOT NULL,
+    n_obs INTEGER NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS observations (
+    query TEXT NOT NULL,
+    series_key TEXT NOT NULL,
+    time_period TEXT NOT NULL,
+    period_start TEXT NOT NULL,
+    period_end TEXT NOT NULL,
+    obs_value REAL,
+    PRIMARY KEY (query, series_key, time_period)
+) WITHOUT ROWID;
+"""
+# Versione dello schema (PRAGMA user_version): uno store con una versione precedente viene ricreato
+_SCHEMA_VERSION = 2
+
+# Periodi SDMX accettati per startPeriod/endPeriod (es. "2015", "2015-01", "2015-Q1", "2015-S2", "2015-W05", "2015-01-31")
+PERIOD_RE = re.compile(r"^\d{4}(-(\d{2}|\d{2}-\d{2}|M\d{2}|Q[1-4]|S[12]|W\d{2}))?$")
+
+# Filtro sulla finestra temporale: primo e ultimo giorno dei periodi (date ISO) rendono confrontabili
+# frequenze diverse, così "2015-Q1" include "2015-02" e un'osservazione è inclusa se si sovrappone alla finestra
+_WINDOW_SQL = "query = ? AND (? IS NULL OR period_end >= ?) AND (? IS NULL OR period_start <= ?)"
+
+
+class StorePlan(NamedTuple):
+    """
+    Azione necessaria per servire una richiesta dallo store:
+    - "local": i dati sono presenti e aggiornati
+    - "refresh": i dati sono presenti ma vanno aggiornati con le sole osservazioni nuove o riviste
+    - "fetch": la finestra richiesta non è coperta e va scaricata
+    """
+    mode: str
+    params: Dict[str, str]
+    start_period: Optional[str]
+    end_period: Optional[str]
+
+
+def period_params(start_period: Optional[str], end_period: Optional[str]) -> Dict[str, str]:
+    """Parametri SDMX per la finestra temporale indicata."""
+    params = {}
+    if start_period:
+        params["startPeriod"] = start_period
+    if end_period:
+        params["endPeriod"] = end_period
+    return params
+
+
+def _start(period: str) -> str:
+    """Primo giorno del periodo come data ISO, confrontabile come stringa."""
+    return period_bounds(period)[0].isoformat()
+
+
+def _end(period: str) -> str:
+    """Ultimo giorno del periodo come data ISO, confrontabile come stringa."""
+    return period_bounds(period)[1].isoformat()
+
+
+def _window(start_period: Optional[str], end_period: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    return _start(start_period) if start_period else None, _end(end_period) if end_period else None
+
+
+def _covers(covered_start: Optional[str], covered_end: Optional[str],
+            start_period: Optional[str], end_period: Optional[str]) -> bool:
+    starts_inside = covered_start is None or (start_period is not None and _start(start_period) >= _start(covered_start))
+    ends_inside = covered_end is None or (end_period is not None and _end(end_period) <= _end(covered_end))
+    return starts_inside and ends_inside
+
+
+def _hull(covered_start: Optional[str], covered_end: Optional[str],
+          start_period: Optional[str], end_period: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """Finestra minima che contiene sia quella già coperta sia quella richiesta (None = illimitata)."""
+    start = None if covered_start is None or start_period is None else min(covered_start, start_period, key=_start)
+    end = None if covered_end is None or end_period is None else max(covered_end, end_period, key=_end)
+    return start, end
+
+
+def _observation_bounds(period: str) -> Tuple[str, str]:
+    """Primo e ultimo giorno del periodo di un'osservazione; un formato non riconosciuto viene confrontato così com'è."""
+    try:
+        start, end = period_bounds(period)
+    except AggregationError:
+        return period, period
+    return start.isoformat(), end.isoformat()
+
+
+def select_window(df: pd.DataFrame, start_period: Optional[str], end_period: Optional[str]) -> pd.DataFrame:
+    """Osservazioni del DataFrame nella finestra indicata, con lo stesso criterio di sovrapposizione dello store."""
+    window_start, window_end = _window(start_period, end_period)
+    periods = df["TIME_PERIOD"].astype(str).astype("category")
+    bounds = [_observation_bounds(p) for p in periods.cat.categories]
+    inside = np.array([
+        (window_start is None or end >= window_start) and (window_end is None or start <= window_end)
+        for start, end in bounds
+    ] + [False], dtype=bool)
+    return df[inside[periods.cat.codes.to_numpy()]].reset_index(drop=True)
+
+
+class SeriesStore:
+    """
+    Store locale delle osservazioni scaricate da /api/data, su SQLite in modalità WAL e condiviso tra i worker.
+
+    Le osservazioni sono partizionate per richiesta (URL dei dati con la chiave dei filtri): per ciascuna
+    viene registrata la finestra temporale coperta e l'istante dell'ultimo aggiornamento. Una richiesta
+    dentro la finestra coperta viene servita localmente finché i dati sono più recenti di `ttl`; oltre,
+    dal web service vengono scaricate solo le osservazioni nuove o riviste (`updatedAfter`) e fuse con
+    quelle presenti. La dimensione è limitata con eviction LRU sulle richieste.
+    """
+
+    def __init__(self, path: str, ttl: int = 3600, max_obs: int = 10_000_000) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_obs = max_obs
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+                conn.execute("DROP TABLE IF EXISTS observations")
+                conn.execute("DROP TABLE IF EXISTS queries")
+            for statement in _SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _connect(self) -> sqlite3.Connection:
+        """Connessione del thread corrente; dopo un fork il worker ne apre una propria."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _coverage(self, query: str) -> Optional[Tuple[Any, ...]]:
+        return self._connect().execute(
+            "SELECT start_period, end_period, fetched_at, updated_after, columns FROM queries WHERE query = ?",
+            (query,)
+        ).fetchone()
+
+    def plan(self, query: str, start_period: Optional[str] = None, end_period: Optional[str] = None) -> StorePlan:
+        """Decide se la richiesta può essere servita localmente, va aggiornata o va scaricata."""
+        coverage = self._coverage(query)
+        if coverage is None:
+            return StorePlan("fetch", period_params(start_period, end_period), start_period, end_period)
+        covered_start, covered_end, fetched_at, updated_after, _ = coverage
+        if not _covers(covered_start, covered_end, start_period, end_period):
+            start, end = _hull(covered_start, covered_end, start_period, end_period)
+            return StorePlan("fetch", period_params(start, end), start, end)
+        if time.time() - fetched_at < self.ttl:
+            return StorePlan("local", {}, covered_start, covered_end)
+        params = dict(period_params(covered_start, covered_end), updatedAfter=updated_after)
+        return StorePlan("refresh", params, covered_start, covered_end)
+
+    def last_period(self, query: str) -> Optional[str]:
+        """Periodo più recente presente per la richiesta (per i refresh senza updatedAfter)."""
+        row = self._connect().execute(
+            "SELECT time_period FROM observations WHERE query = ? ORDER BY period_start DESC LIMIT 1", (query,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def write(self, query: str, df: pd.DataFrame, dimensions: List[str]) -> None:
+        """Inserisce o aggiorna (upsert) le osservazioni di un blocco, in un'unica transazione."""
+        if df.empty:
+            return
+        series_keys = df[dimensions[0]].astype(str)
+        for col in dimensions[1:]:
+            series_keys = series_keys.str.cat(df[col].astype(str), sep=".")
+        values = df["ObsValue"].astype("float64")
+        periods = df["TIME_PERIOD"].astype(str).astype("category")
+        # Limiti calcolati una sola volta per periodo distinto
+        bounds = [_observation_bounds(p) for p in periods.cat.categories]
+        codes = periods.cat.codes.to_numpy()
+        rows = zip(
+            [query] * len(df),
+            series_keys.tolist(),
+            periods.tolist(),
+            np.array([b[0] for b in bounds], dtype=object)[codes].tolist(),
+            np.array([b[1] for b in bounds], dtype=object)[codes].tolist(),
+            values.where(values.notna(), None).tolist(),
+        )
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO observations (query, series_key, time_period, period_start, period_end, "
+                "obs_value) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def commit(self, query: str, dataflow: str, dimensions: List[str], start_period: Optional[str],
+               end_period: Optional[str], requested_at: float) -> None:
+        """
+        Registra la finestra coperta e l'istante della richiesta al web service, da usare come
+        `updatedAfter` nel refresh successivo. Applica poi l'eviction se necessario.
+        """
+        updated_after = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(requested_at))
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            n_obs = conn.execute("SELECT COUNT(*) FROM observations WHERE query = ?", (query,)).fetchone()[0]
+            conn.execute(
+                "INSERT OR REPLACE INTO queries (query, dataflow, columns, start_period, end_period, "
+                "fetched_at, updated_after, n_obs, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (query, dataflow, json.dumps(dimensions), start_period, end_period,
+                 time.time(), updated_after, n_obs, time.time())
+            )
+            self._evict(conn, keep=query)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def touch(self, query: str) -> None:
+        """Rinvia il prossimo refresh di un TTL (es. dopo un errore), mantenendo `updatedAfter` invariato."""
+        self._connect().execute("UPDATE queries SET fetched_at = ? WHERE query = ?", (time.time(), query))
+
+    def _evict(self, conn: sqlite3.Connection, keep: str) -> None:
+        """Rimuove le richieste usate meno di recente finché il totale non rientra in max_obs."""
+        total = conn.execute("SELECT COALESCE(SUM(n_obs), 0) FROM queries").fetchone()[0]
+        if total <= self.max_obs:
+            return
+        for query, n_obs in conn.execute(
+            "SELECT query, n_obs FROM queries WHERE query != ? ORDER BY accessed_at", (keep,)
+        ).fetchall():
+            conn.execute("DELETE FROM observations WHERE query = ?", (query,))
+            conn.execute("DELETE FROM queries WHERE query = ?", (query,))
+            total -= n_obs
+            if total <= self.max_obs:
+                break
+
+    def iter_read(self, query: str, start_period: Optional[str] = None, end_period: Optional[str] = None,
+                  chunk_size: Optional[int] = None) -> Iterator[pd.DataFrame]:
+        """
+        Osservazioni della richiesta nella finestra indicata, a blocchi di al più `chunk_size` righe.
+        Con una finestra vuota viene prodotto un unico blocco vuoto con le colonne della richiesta.
+        """
+        coverage = self._coverage(query)
+        if coverage is None:
+            raise KeyError(query)
+        dimensions = json.loads(coverage[4])
+        conn = self._connect()
+        conn.execute("UPDATE queries SET accessed_at = ? WHERE query = ?", (time.time(), query))
+        window_start, window_end = _window(start_period, end_period)
+        cursor = conn.execute(
+            f"SELECT series_key, time_period, obs_value FROM observations WHERE {_WINDOW_SQL} "
+            "ORDER BY series_key, period_start, time_period",
+            (query, window_start, window_start, window_end, window_end)
+        )
+        produced = False
+        while True:
+            rows = cursor.fetchmany(chunk_size) if chunk_size else cursor.fetchall()
+            if not rows and produced:
+                break
+            produced = True
+            yield self._to_frame(rows, dimensions)
+            if not rows or not chunk_size:
+                break
+
+    def read(self, query: str, start_period: Optional[str] = None, end_period: Optional[str] = None) -> pd.DataFrame:
+        """Osservazioni della richiesta nella finestra indicata, con le stesse colonne dei parser dei dati."""
+        return next(self.iter_read(query, start_period, end_period))
+
+    @staticmethod
+    def _to_frame(rows: List[Tuple[str, str, Optional[float]]], dimensions: List[str]) -> pd.DataFrame:
+        series_keys, periods, values = zip(*rows) if rows else ((), (), ())
+        # Le chiavi delle serie sono poche rispetto alle osservazioni: si separano una sola volta per chiave
+        codes, unique_keys = pd.factorize(pd.Series(series_keys, dtype=object))
+        parts = [key.split(".") for key in unique_keys]
+        data = {}
+        for i, col in enumerate(dimensions):
+            column_values = np.array([p[i] if i < len(p) else None for p in parts], dtype=object)
+            data[col] = pd.Categorical(column_values[codes] if len(codes) else [])
+        data["TIME_PERIOD"] = pd.Categorical(periods)
+        data["ObsValue"] = np.array(values, dtype="float64")
+        return pd.DataFrame(data)
+
+    def stats(self) -> Dict[str, Any]:
+        queries, n_obs = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(n_obs), 0) FROM queries").fetchone()
+        return {"queries": queries, "observations": n_obs}
+
+
+_store: Optional[SeriesStore] = None
+_store_lock = threading.Lock()
+
+
+def get_series_store() -> Optional[SeriesStore]:
+    """
+    Ritorna lo store delle osservazioni del processo, creandolo al primo utilizzo.
+    Ritorna None se disabilitato tramite ISTAT_SERIES_STORE_DISABLED.
+    """
+    global _store
+    if os.environ.get("ISTAT_SERIES_STORE_DISABLED"):
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                cache_dir = default_cache_dir()
+                _store = SeriesStore(
+                    os.environ.get("ISTAT_SERIES_STORE_PATH", os.path.join(cache_dir, "series.sqlite3")),
+                    ttl=int(os.environ.get("ISTAT_SERIES_STORE_TTL", 3600)),
+                    max_obs=int(os.environ.get("ISTAT_SERIES_STORE_MAX_OBS", 10_000_000)),
+                )
+    return _store
+
+
+def set_series_store(store: Optional[SeriesStore]) -> None:
+    """Sostituisce lo store di default (es. con un database temporaneo)."""
+    global _store
+    with _store_lock:
+        _store = store
+
+
+def _collect_metrics() -> List[metrics.Sample]:
+    if _store is None:
+        return []
+    stats = _store.stats()
+    return [
+        ("istat_series_store_queries", "gauge", "Estrazioni presenti nello store locale", [({}, stats["queries"])]),
+        ("istat_series_store_observations", "gauge", "Osservazioni nello store locale", [({}, stats["observations"])]),
+    ]
+
+
+metrics.REGISTRY.register_collector(_collect_metrics)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:31:08 2026
+
+@author: andreadesogus
+"""
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from core import metrics
+from core.cache import DEFAULT_TTLS, _ttls_from_env, default_cache_dir, ensure_private
+
+# Versione del formato degli oggetti memorizzati, da includere nelle chiavi: va incrementata quando
+# cambia il tipo degli oggetti (es. liste native al posto di DataFrame), così le voci precedenti vengono ignorate
+KEY_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    resource_type TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+"""
+
+
+class SharedStore:
+    """
+    Cache condivisa tra i worker gunicorn di uno stesso host per gli oggetti già analizzati
+    (catalogo dei dataflow, dimensioni della DSD, codelist, chiavi delle serie e relativo indice).
+
+    Gli oggetti vengono serializzati con pickle in un database SQLite in modalità WAL: le scritture
+    sono transazionali (un lettore vede la voce intera o nessuna voce), più processi possono leggere
+    in parallelo e il riempimento fatto da un worker è subito visibile agli altri. La scadenza segue
+    i TTL per tipo di risorsa della cache su disco; la dimensione totale è limitata con eviction LRU.
+
+    Poiché pickle può eseguire codice, la directory e il database devono appartenere all'utente
+    corrente e non essere scrivibili da altri: altrimenti viene sollevato PermissionError.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 500 * 1024 * 1024,
+                 ttls: Optional[Dict[str, int]] = None) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0, "errors": 0}
+        ensure_private(os.path.dirname(os.path.abspath(path)))
+        ensure_private(path, directory=False)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Connessione del thread corrente; dopo un fork il worker ne apre una propria."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self._counters[name] += amount
+
+    def get(self, key: str, max_age: Optional[float] = None) -> Optional[Any]:
+        """
+        Ritorna l'oggetto salvato sotto `key` se presente e non scaduto, altrimenti None.
+        Con `max_age` vengono ignorate anche le voci salvate da più di `max_age` secondi.
+        """
+        entry = self.get_entry(key, max_age)
+        return entry[0] if entry is not None else None
+
+    def get_entry(self, key: str, max_age: Optional[float] = None) -> Optional[Tuple[Any, float]]:
+        """Come `get`, ma ritorna la coppia (oggetto, istante di salvataggio)."""
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT resource_type, value, stored_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            ttl = self.ttls.get(row[0], 0) if row is not None else 0
+            if max_age is not None:
+                ttl = min(ttl, max_age)
+            if row is None or time.time() - row[2] >= ttl:
+                self._count("misses")
+                return None
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            value = pickle.loads(row[1])
+        except (sqlite3.Error, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+            # Una voce illeggibile (es. scritta da una versione diversa del codice) equivale a un miss
+            print(f"Shared cache read error for {key}: {e}")
+            self._count("errors")
+            return None
+        self._count("hits")
+        return value, row[2]
+
+    def set(self, key: str, resource_type: str, value: Any) -> None:
+        """Salva l'oggetto in un'unica transazione e applica l'eviction se necessario."""
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            if len(data) > self.max_bytes:
+                return
+            now = time.time()
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, resource_type, value, size, stored_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, resource_type, sqlite3.Binary(data), len(data), now, now)
+                )
+                evicted = self._evict(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except (sqlite3.Error, pickle.PicklingError, TypeError) as e:
+            print(f"Shared cache write error for {key}: {e}")
+            self._count("errors")
+            return
+        self._count("sets")
+        if evicted:
+            self._count("evictions", evicted)
+
+    def _evict(self, conn: sqlite3.Connection) -> int:
+        """Rimuove le voci usate meno di recente finché il totale non rientra in max_bytes."""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        evicted = 0
+        if total <= self.max_bytes:
+            return evicted
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall():
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            evicted += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+        return evicted
+
+    def clear(self) -> None:
+        self._connect().execute("DELETE FROM entries")
+
+    def stats(self) -> Dict[str, int]:
+        """Contatori del processo corrente e occupazione complessiva del database."""
+        with self._stats_lock:
+            counters = dict(self._counters)
+        try:
+            entries, size = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        except sqlite3.Error:
+            entries, size = None, None
+        return dict(counters, entries=entries, bytes=size)
+
+
+_store: Optional[SharedStore] = None
+_store_lock = threading.Lock()
+# Impostato se la cache è stata rifiutata per permessi non sicuri: non viene ritentata a ogni richiesta
+_refused = False
+
+
+def get_shared_store() -> Optional[SharedStore]:
+    """
+    Ritorna la cache condivisa del processo, creandola al primo utilizzo.
+    Ritorna None se disabilitata tramite ISTAT_SHARED_CACHE_DISABLED o se la directory o il database
+    non sono privati dell'utente corrente.
+    """
+    global _store, _refused
+    if os.environ.get("ISTAT_SHARED_CACHE_DISABLED") or _refused:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None and not _refused:
+                path = os.environ.get("ISTAT_SHARED_CACHE_PATH", os.path.join(default_cache_dir(), "shared.sqlite3"))
+                try:
+                    _store = SharedStore(
+                        path,
+                        max_bytes=int(os.environ.get("ISTAT_SHARED_CACHE_MAX_MB", 500)) * 1024 * 1024,
+                        ttls=_ttls_from_env(),
+                    )
+                except PermissionError as e:
+                    print(f"Shared cache disabled: {e}")
+                    _refused = True
+    return _store
+
+
+def set_shared_store(store: Optional[SharedStore]) -> None:
+    """Sostituisce la cache condivisa di default (es. con un database temporaneo)."""
+    global _store
+    with _store_lock:
+        _store = store
+
+
+def _collect_metrics() -> List[metrics.Sample]:
+    # Non crea la cache se nessuna richiesta l'ha ancora usata
+    if _store is None:
+        return []
+    stats = _store.stats()
+    events = [({"event": event}, stats[event]) for event in _store._counters]
+    return [
+        ("istat_shared_cache_events_total", "counter", "Letture, scritture, evizioni ed errori della cache condivisa", events),
+        ("istat_shared_cache_entries", "gauge", "Voci nella cache condivisa", [({}, stats["entries"])]),
+        ("istat_shared_cache_bytes", "gauge", "Occupazione della cache condivisa in byte", [({}, stats["bytes"])]),
+    ]
+
+
+metrics.REGISTRY.register_collector(_collect_metrics)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:52:26 2026
+
+@author: andreadesogus
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from core import metrics
+
+
+class _Call:
+    """Esecuzione in corso per una chiave: i chiamanti successivi ne attendono il risultato."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Deduplica le esecuzioni concorrenti della stessa operazione.
+
+    Il primo chiamante per una chiave esegue `func`; chi arriva mentre l'esecuzione è in corso
+    attende e riceve lo stesso risultato (o la stessa eccezione). Usa `threading`: con il worker
+    gevent di gunicorn il modulo è monkey-patched, quindi l'attesa sospende solo il greenlet.
+
+    Contatori:
+    - calls: chiamate totali
+    - hits: chiamate servite senza esecuzione perché il risultato era già disponibile (vedi `record_hit`)
+    - executions: esecuzioni effettive di `func`
+    - coalesced: chiamate che hanno atteso un'esecuzione già in corso
+    - errors: esecuzioni terminate con un'eccezione
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self._counters = {"calls": 0, "hits": 0, "executions": 0, "coalesced": 0, "errors": 0}
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        with self._lock:
+            self._counters["calls"] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                self._counters["coalesced"] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._counters["executions"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self._counters["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def record_hit(self) -> None:
+        """Registra una chiamata soddisfatta da un risultato già disponibile (es. cache)."""
+        with self._lock:
+            self._counters["calls"] += 1
+            self._counters["hits"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters, in_flight=len(self._calls))
+
+
+class AsyncSingleFlight(SingleFlight):
+    """Variante per asyncio: i chiamanti concorrenti attendono lo stesso Future invece di un Event."""
+
+    def __init__(self, name: str) -> None:
+        super().__init__(name)
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        with self._lock:
+            self._counters["calls"] += 1
+            future = self._futures.get(key)
+            if future is not None:
+                self._counters["coalesced"] += 1
+                leader = False
+            else:
+                future = self._futures[key] = asyncio.get_running_loop().create_future()
+                self._counters["executions"] += 1
+                leader = True
+
+        if not leader:
+            # asyncio.shield: la cancellazione di un chiamante in attesa non annulla l'esecuzione condivisa
+            return await asyncio.shield(future)
+
+        try:
+            result = await func()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Evita il warning "exception was never retrieved" quando nessuno era in attesa
+            future.exception()
+            with self._lock:
+                self._counters["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._futures[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters, in_flight=len(self._futures))
+
+
+_groups: Dict[str, SingleFlight] = {}
+_groups_lock = threading.Lock()
+
+
+def get_group(name: str, factory: Callable[[str], SingleFlight] = SingleFlight) -> SingleFlight:
+    """Ritorna il gruppo single-flight con il nome indicato, creandolo al primo utilizzo."""
+    with _groups_lock:
+        if name not in _groups:
+            _groups[name] = factory(name)
+        return _groups[name]
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    """Contatori di tutti i gruppi single-flight del processo."""
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {group.name: group.stats() for group in groups}
+
+
+def _collect_metrics() -> List[metrics.Sample]:
+    groups = stats()
+    events = [
+        ({"group": name, "event": event}, value)
+        for name, counters in groups.items() for event, value in counters.items() if event != "in_flight"
+    ]
+    in_flight = [({"group": name}, counters["in_flight"]) for name, counters in groups.items()]
+    return [
+        ("istat_singleflight_events_total", "counter", "Chiamate, esecuzioni, accorpamenti ed errori per gruppo", events),
+        ("istat_singleflight_in_flight", "gauge", "Esecuzioni in corso per gruppo", in_flight),
+    ]
+
+
+metrics.REGISTRY.register_collector(_collect_metrics)
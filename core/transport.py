@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 09:12:40 2026
+
+@author: andreadesogus
+"""
+
+import os
+import threading
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Radice REST del web service SDMX di ISTAT. Sovrascrivibile (es. per puntare a un server SDMX locale).
+SDMX_REST_URL = os.environ.get("SDMX_REST_URL", "https://sdmx.istat.it/SDMXWS/rest").rstrip("/")
+
+
+class HttpTransport:
+    """
+    Trasporto HTTP condiviso: una Session requests con pool di connessioni keep-alive,
+    negoziazione gzip/deflate, timeout configurabili e retry con backoff esponenziale.
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = float(os.environ.get("SDMX_CONNECT_TIMEOUT", 10)),
+        read_timeout: float = float(os.environ.get("SDMX_READ_TIMEOUT", 100)),
+        retries: int = int(os.environ.get("SDMX_RETRIES", 3)),
+        backoff_factor: float = float(os.environ.get("SDMX_BACKOFF", 0.5)),
+        pool_connections: int = 4,
+        pool_maxsize: int = int(os.environ.get("SDMX_POOL_SIZE", 20)),
+    ) -> None:
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+        })
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url: str, params: Optional[Dict[str, str]] = None,
+            headers: Optional[Dict[str, str]] = None, stream: bool = False) -> requests.Response:
+        """Esegue una GET riutilizzando le connessioni del pool."""
+        return self.session.get(url, params=params, headers=headers, timeout=self.timeout, stream=stream)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_transport: Optional[HttpTransport] = None
+_transport_pid: Optional[int] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> HttpTransport:
+    """
+    Ritorna il trasporto del processo corrente, creandolo al primo utilizzo.
+    Il pool è legato al PID, così ogni worker gunicorn ne ottiene uno proprio dopo il fork.
+    """
+    global _transport, _transport_pid
+    pid = os.getpid()
+    if _transport is None or _transport_pid != pid:
+        with _transport_lock:
+            if _transport is None or _transport_pid != pid:
+                _transport = HttpTransport()
+                _transport_pid = pid
+    return _transport
+
+
+def set_transport(transport: Optional[HttpTransport]) -> None:
+    """Sostituisce il trasporto di default (es. con uno che punta a un server SDMX di test)."""
+    global _transport, _transport_pid
+    with _transport_lock:
+        _transport = transport
+        _transport_pid = os.getpid() if transport is not None else None
@@ -6,6 +6,12 @@ Created on Sat Mar  1 12:35:26 2025
 @author: andreadesogus
 """
 
+from core.lazy import LazyModule
+from core.parsers import SeriesKeys
+
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+
 class StringaFiltroGenerator:
     def __init__(self, tot_filters, applicati):
         self.tot_filters = tot_filters
@@ -39,7 +45,121 @@ class StringaFiltroGenerator:
         print(f"SUBSTRING RETURNED: {''.join(slots)}\nN. FILTERS: {self.tot_filters}\nFILTERS: {self.applicati}")
         return "".join(slots)
 
-import pandas as pd
+
+def _factorize(series, col):
+    """
+    Codici interi (in ordine di valore) e valori distinti della colonna, da un DataFrame
+    o da SeriesKeys; in quest'ultimo caso senza passare da pandas.
+    """
+    if not isinstance(series, SeriesKeys):
+        return pd.factorize(series[col], sort=True)
+    categories = series.values(col)
+    order = sorted(range(len(categories)), key=categories.__getitem__)
+    remap = np.empty(len(categories) + 1, dtype=np.int64)
+    remap[order] = np.arange(len(categories))
+    remap[-1] = -1
+    codes = remap[np.frombuffer(series.codes[col], dtype=np.int64)]
+    return codes, [categories[i] for i in order]
+
+
+class SeriesKeyIndex:
+    """
+    Indice invertito delle chiavi delle serie, costruito una sola volta per dataflow.
+
+    Per ogni dimensione mantiene una mappa valore -> bitmap delle serie che lo contengono
+    (un intero Python in cui il bit i corrisponde alla riga i del DataFrame). La verifica di un
+    pattern diventa così un'intersezione di bitmap, indipendente dal numero di colonne da confrontare.
+    Le chiavi possono essere un DataFrame o, senza pandas, un oggetto SeriesKeys.
+
+    Nel pattern ogni campo può contenere più valori separati da '+', come nella sintassi SDMX (OR).
+    """
+
+    def __init__(self, df, columns=None, delimiter='.'):
+        self.columns = list(columns) if columns is not None else list(df.columns)
+        self.delimiter = delimiter
+        self.n_series = len(df)
+        self.all_series = (1 << self.n_series) - 1
+        self.bitmaps = {}
+        self._values = {}
+        for col in self.columns:
+            codes, uniques = _factorize(df, col)
+            # Il codice -1 (valore mancante) punta al None in coda
+            self._values[col] = np.append(np.asarray(uniques, dtype=object), None)[codes]
+            self.bitmaps[col] = {
+                value: self._to_bitmap(codes == code) for code, value in enumerate(uniques)
+            }
+
+    @staticmethod
+    def _to_bitmap(mask) -> int:
+        return int.from_bytes(np.packbits(mask, bitorder="little").tobytes(), "little")
+
+    def _to_positions(self, bitmap: int):
+        n_bytes = (self.n_series + 7) // 8
+        bits = np.unpackbits(np.frombuffer(bitmap.to_bytes(n_bytes, "little"), dtype=np.uint8), bitorder="little")
+        return np.flatnonzero(bits[:self.n_series])
+
+    def split(self, pattern):
+        """Divide il pattern in un campo per colonna; i campi mancanti sono wildcard."""
+        parts = pattern.split(self.delimiter)
+        if len(parts) < len(self.columns):
+            parts.extend([""] * (len(self.columns) - len(parts)))
+        elif len(parts) > len(self.columns):
+            print(f"COLONNE: {self.columns}")
+            print(f"PATTERN: {pattern}")
+            print(f"N. COLONNE: {len(self.columns)} VS N. PARTS: {len(parts)}")
+            raise ValueError("Il pattern contiene più elementi rispetto alle colonne specificate.")
+        return parts
+
+    def bitmap(self, pattern, exclude=None) -> int:
+        """Bitmap delle serie che soddisfano il pattern (ignorando l'eventuale colonna `exclude`)."""
+        result = self.all_series
+        for col, pat in zip(self.columns, self.split(pattern)):
+            if pat == "" or col == exclude:
+                continue
+            values = self.bitmaps[col]
+            selected = 0
+            for value in pat.split("+"):
+                selected |= values.get(value, 0)
+            result &= selected
+            if not result:
+                break
+        return result
+
+    def match(self, pattern) -> bool:
+        return self.bitmap(pattern) != 0
+
+    def count(self, pattern) -> int:
+        """Numero di serie che soddisfano il pattern."""
+        return self.bitmap(pattern).bit_count()
+
+    def count_many(self, patterns):
+        """Conteggio delle serie per ciascun pattern della lista."""
+        return [self.count(pattern) for pattern in patterns]
+
+    def keys(self, pattern, limit=None):
+        """Chiavi (es. "A.IT.X1.1") delle serie che soddisfano il pattern, al più `limit`."""
+        positions = self._to_positions(self.bitmap(pattern))
+        if limit is not None:
+            positions = positions[:limit]
+        return [
+            self.delimiter.join(str(self._values[col][pos]) for col in self.columns)
+            for pos in positions
+        ]
+
+    def facets(self, pattern):
+        """
+        Per ogni dimensione, il numero di serie per valore applicando i filtri delle altre dimensioni:
+        indica quante serie resterebbero selezionando quel valore.
+        """
+        result = {}
+        for col in self.columns:
+            others = self.bitmap(pattern, exclude=col)
+            result[col] = {
+                value: (others & bitmap).bit_count()
+                for value, bitmap in self.bitmaps[col].items()
+            }
+        return result
+
 
 class PatternMatcher:
     """
@@ -57,10 +177,12 @@ class PatternMatcher:
       - delimiter: (opzionale) il carattere usato per separare i campi nel pattern (default: '.').
     """
     
-    def __init__(self, df, columns=None, delimiter='.'):
+    def __init__(self, df, columns=None, delimiter='.', index=None):
         self.df = df
         self.columns = columns if columns is not None else list(df.columns)
         self.delimiter = delimiter
+        # L'indice può essere precalcolato e condiviso (es. da DataflowContext)
+        self.index = index if index is not None else SeriesKeyIndex(df, self.columns, delimiter)
         
     def match(self, pattern):
         """
@@ -69,7 +191,7 @@ class PatternMatcher:
         Il pattern deve contenere un numero di campi uguale al numero di colonne specificate
         (o al numero di colonne del DataFrame se `columns` non è definito). Se il pattern contiene
         meno campi, quelli mancanti sono considerati wildcard; se ne contiene di più, viene sollevato
-        un errore.
+        un errore. Un campo può contenere più valori alternativi separati da '+'.
 
         Esempi:
           - pattern = "M..EXT_EU..TBV" -> Verifica la prima colonna uguale a "M", la terza a "EXT_EU",
@@ -80,23 +202,16 @@ class PatternMatcher:
         :param pattern: stringa contenente il pattern.
         :return: True se almeno una riga soddisfa il pattern, altrimenti False.
         """
-        parts = pattern.split(self.delimiter)
-        
-        # Se il numero di parti è minore delle colonne, estende con wildcard (stringa vuota)
-        if len(parts) < len(self.columns):
-            parts.extend([""] * (len(self.columns) - len(parts)))
-        # Se il numero di parti è maggiore delle colonne, solleva un errore
-        elif len(parts) > len(self.columns):
-            print(f"COLONNE: {self.columns}")
-            print(f"PATTERN: {pattern}")
-            print(f"N. COLONNE: {len(self.columns)} VS N. PARTS: {len(parts)}")
-            raise ValueError("Il pattern contiene più elementi rispetto alle colonne specificate.")
-        
-        # Inizializzo una maschera con True per tutte le righe
-        mask = pd.Series(True, index=self.df.index)
-        # Applico il confronto per ogni colonna (salto se il campo è vuoto)
-        for col, pat in zip(self.columns, parts):
-            if pat != "":
-                mask &= (self.df[col] == pat)
-        
-        return mask.any()
+        return self.index.match(pattern)
+
+    def count(self, pattern):
+        """Ritorna il numero di righe che soddisfano il pattern."""
+        return self.index.count(pattern)
+
+    def keys(self, pattern, limit=None):
+        """Ritorna le chiavi delle righe che soddisfano il pattern."""
+        return self.index.keys(pattern, limit)
+
+    def match_many(self, patterns):
+        """Ritorna il numero di righe che soddisfano ciascun pattern della lista."""
+        return self.index.count_many(patterns)
@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:32:05 2026
+
+@author: andreadesogus
+"""
+
+
+def post_worker_init(worker):
+    """Pre-carica catalogo e dataflow più usati in background in ogni worker, e li rinnova prima della scadenza."""
+    from services.warmup import start_warmup
+    start_warmup()
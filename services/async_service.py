@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:40:12 2026
+
+@author: andreadesogus
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from core import metrics
+from core.aggregation import Aggregation
+from core.async_downloader import AsyncDownloader
+from core.downloader import DownloadError
+from core.lazy import LazyModule
+from core.parsers import SdmxCsvParser
+from core.planner import SPLIT_CONCURRENCY, merge_frames
+from core.series_store import SeriesStore, StorePlan, get_series_store, period_params
+from core.shared_cache import get_shared_store
+from core.singleflight import AsyncSingleFlight, get_group
+from core.transport import SDMX_REST_URL
+from services.batch_service import BatchDataRetriever, BatchQuery, BatchResult, error_status
+from services.dataflow_context import (
+    DATA_FORMAT,
+    DataflowContext,
+    parse_codelist_data,
+    parse_series_data,
+    parse_structure_data
+)
+from services.dataflow_service import (
+    STORE_CHUNK_ROWS,
+    DataflowRetriever,
+    FiltersRetriever,
+    DataRetriever,
+    aggregate_data,
+    data_parser_for,
+    extraction_budget,
+    parse_data
+)
+
+pd = LazyModule("pandas")
+
+# Allineamenti dello store in corso nell'event loop: richieste concorrenti sugli stessi dati ne attendono uno solo
+_async_store_syncs = get_group("async_series_store", AsyncSingleFlight)
+
+
+class AsyncDataflowRetriever:
+    """Variante asincrona di DataflowRetriever: download non bloccante, parsing in un executor."""
+
+    async def parse_dataflows(self, search_string: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        dfr = DataflowRetriever()
+        index = dfr.cached_index()
+        if index is None:
+            store = get_shared_store()
+            entry = await asyncio.to_thread(store.get_entry, dfr.catalogue_key()) if store is not None else None
+            if entry is None:
+                xml_data = await AsyncDownloader(f"{SDMX_REST_URL}/dataflow/IT1/", resource_type="dataflow").download()
+                records = await asyncio.to_thread(dfr.catalogue_from_xml, xml_data)
+                if store is not None:
+                    await asyncio.to_thread(store.set, dfr.catalogue_key(), "dataflow", records)
+                entry = (records, time.time())
+            index = await asyncio.to_thread(dfr.remember_catalogue, *entry)
+        return dfr.search(index, search_string, limit)
+
+
+class AsyncFiltersRetriever:
+    """
+    Variante asincrona di FiltersRetriever.
+
+    Serie e struttura vengono scaricate in parallelo, e poi le eventuali codelist mancanti.
+    Il risultato viene caricato nello stesso DataflowContext usato dal servizio sincrono, così
+    la logica di FiltersRetriever gira poi in un executor senza ulteriori accessi alla rete.
+    """
+
+    def __init__(self, dataflow_id: str, ref_id: str, context: Optional[DataflowContext] = None) -> None:
+        self.dataflow_id = dataflow_id
+        self.ref_id = ref_id
+        self.context = context or DataflowContext.get(dataflow_id, ref_id)
+
+    async def _load_series(self) -> None:
+        if await asyncio.to_thread(self.context.is_loaded, "series"):
+            return
+        request = self.context.series_request()
+        while True:
+            try:
+                series_data = await AsyncDownloader(**request).download()
+                break
+            except Exception as e:
+                request = self.context.series_fallback(request, e)
+                if request is None:
+                    raise
+        await asyncio.to_thread(self.context.load, "series", lambda: parse_series_data(series_data))
+
+    async def _load_structure(self) -> None:
+        if await asyncio.to_thread(self.context.is_loaded, "structure"):
+            return
+        structure_data = await AsyncDownloader(**self.context.structure_request()).download()
+        await asyncio.to_thread(self.context.load, "structure", lambda: parse_structure_data(structure_data))
+
+    async def _load_codelist(self, codelist_id: str) -> None:
+        codelist_data = await AsyncDownloader(**self.context.codelist_request(codelist_id)).download()
+        await asyncio.to_thread(
+            self.context.load, f"codelist:{codelist_id}",
+            lambda: parse_codelist_data(codelist_data), True
+        )
+
+    async def load(self, with_structure: bool = True) -> None:
+        """Carica nel contesto tutto ciò che serve, sovrapponendo le richieste indipendenti."""
+        if not with_structure:
+            await self._load_series()
+            return
+        await asyncio.gather(self._load_series(), self._load_structure())
+        missing = await asyncio.to_thread(self.context.missing_codelists)
+        await asyncio.gather(*(self._load_codelist(c) for c in missing))
+
+    async def get_filters_dictionary(self) -> Dict[str, List[Dict[str, Any]]]:
+        await self.load()
+        fr = FiltersRetriever(self.dataflow_id, self.ref_id, context=self.context)
+        return await asyncio.to_thread(fr.get_filters_dictionary)
+
+
+class AsyncDataRetriever:
+    """Variante asincrona di DataRetriever."""
+
+    def __init__(self, dataflow_id: str, ref_id: str, filters: Dict[int, str],
+                 context: Optional[DataflowContext] = None) -> None:
+        self.dataflow_id = dataflow_id
+        self.ref_id = ref_id
+        self.filters = filters
+        self.afr = AsyncFiltersRetriever(dataflow_id, ref_id, context=context)
+
+    async def _download_data(self, url_data: str, params: Optional[Dict[str, str]] = None):
+        """Scarica i dati in SDMX-CSV se disponibile, altrimenti in SDMX-ML. Ritorna (corpo, Content-Type)."""
+        if DATA_FORMAT == "csv":
+            downloader = AsyncDownloader(url_data, params=params or None, headers={"Accept": SdmxCsvParser.MEDIA_TYPE})
+            try:
+                return await downloader.download_bytes(), downloader.content_type
+            except Exception as e:
+                if isinstance(e, DownloadError) and e.status_code == 404:
+                    raise
+                print(f"SDMX-CSV not available for {url_data} ({e}). Falling back to SDMX-ML")
+        downloader = AsyncDownloader(url_data, params=params or None)
+        return await downloader.download_bytes(), downloader.content_type
+
+    async def get_data(self, start_period: Optional[str] = None, end_period: Optional[str] = None,
+                       aggregation: Optional[Aggregation] = None) -> pd.DataFrame:
+        """
+        Con lo store locale attivo, l'allineamento (download, upsert e refresh incrementale) segue
+        le stesse regole di DataRetriever: i download restano nell'event loop, mentre parsing,
+        scrittura e lettura di SQLite girano in un thread.
+        L'eventuale aggregazione viene applicata in un thread, dopo il parsing.
+        """
+        await self.afr.load(with_structure=False)
+        data_ret = DataRetriever(self.dataflow_id, self.ref_id, self.filters, context=self.afr.context)
+        if aggregation is not None:
+            aggregation.validate(data_ret.fr.get_filters())
+        url_data = await asyncio.to_thread(data_ret._data_url)
+        store = get_series_store()
+        if store is None:
+            parts = await asyncio.to_thread(data_ret.query_parts, url_data, period_params(start_period, end_period))
+            df = await self._fetch_parts(parts)
+        else:
+            await self._sync_store(data_ret, store, url_data, start_period, end_period)
+            with metrics.stage("store"):
+                df = await asyncio.to_thread(store.read, url_data, start_period, end_period)
+        return await asyncio.to_thread(aggregate_data, df, aggregation)
+
+    async def _run_parts(self, parts: List[Tuple[str, Dict[str, str]]],
+                         func: Callable[[str, Dict[str, str]], Awaitable[Any]]) -> List[Any]:
+        """
+        Esegue `func(url, parametri)` sulle sotto-richieste, al più ISTAT_SPLIT_CONCURRENCY alla volta.
+        Un 404 su una parte (nessun dato in quella parte) dà None; viene rilanciato se riguarda tutte le parti.
+        """
+        semaphore = asyncio.Semaphore(SPLIT_CONCURRENCY)
+
+        async def run(part_url: str, part_params: Dict[str, str]) -> Any:
+            async with semaphore:
+                try:
+                    return await func(part_url, part_params)
+                except DownloadError as e:
+                    if e.status_code != 404 or len(parts) == 1:
+                        raise
+                    return None
+
+        results = await asyncio.gather(*(run(*part) for part in parts))
+        if all(result is None for result in results):
+            raise DownloadError(parts[0][0], 404)
+        return results
+
+    async def _fetch_parts(self, parts: List[Tuple[str, Dict[str, str]]]) -> pd.DataFrame:
+        """
+        Scarica le sotto-richieste e unisce i risultati.
+        Righe e byte di tutte le parti vengono conteggiati in un unico budget.
+        """
+        budget = extraction_budget()
+
+        async def fetch(part_url: str, part_params: Dict[str, str]) -> pd.DataFrame:
+            body, content_type = await self._download_data(part_url, part_params)
+            return await asyncio.to_thread(lambda: parse_data(data_parser_for(body, content_type, budget)))
+
+        frames = [df for df in await self._run_parts(parts, fetch) if df is not None]
+        with metrics.stage("merge"):
+            return await asyncio.to_thread(merge_frames, frames)
+
+    async def _sync_store(self, data_ret: DataRetriever, store: SeriesStore, url_data: str,
+                          start_period: Optional[str], end_period: Optional[str]) -> None:
+        """Variante asincrona di DataRetriever._sync_store: le richieste concorrenti attendono un unico aggiornamento."""
+        plan = await asyncio.to_thread(store.plan, url_data, start_period, end_period)
+        if plan.mode == "local":
+            return
+
+        async def sync() -> None:
+            requested_at = time.time()
+            dimensions = list(data_ret.fr.series_keys.columns)
+            try:
+                await self._download_into_store(store, url_data, plan.params, dimensions, data_ret)
+            except Exception as e:
+                if plan.mode == "fetch":
+                    raise
+                if not await self._refresh_fallback(store, url_data, plan, dimensions, data_ret, e):
+                    # Il prossimo tentativo avverrà dopo un altro TTL, senza perdere le revisioni intermedie
+                    await asyncio.to_thread(store.touch, url_data)
+                    return
+            await asyncio.to_thread(
+                store.commit, url_data, self.dataflow_id, dimensions, plan.start_period, plan.end_period, requested_at
+            )
+
+        await _async_store_syncs.do(url_data, sync)
+
+    async def _refresh_fallback(self, store: SeriesStore, url_data: str, plan: StorePlan, dimensions: List[str],
+                                data_ret: DataRetriever, error: Exception) -> bool:
+        """Gestisce un refresh con `updatedAfter` non riuscito; ritorna True se lo store risulta aggiornato."""
+        if isinstance(error, DownloadError) and error.status_code == 404:
+            # Nessuna osservazione nuova o rivista dall'ultimo aggiornamento
+            return True
+        print(f"updatedAfter not available for {url_data} ({error}). Refreshing from the last period")
+        last_period = await asyncio.to_thread(store.last_period, url_data)
+        params = period_params(last_period or plan.start_period, plan.end_period)
+        try:
+            await self._download_into_store(store, url_data, params, dimensions, data_ret)
+        except Exception as e:
+            print(f"Refresh failed for {url_data} ({e}). Serving local copy")
+            return False
+        return True
+
+    async def _download_into_store(self, store: SeriesStore, url_data: str, params: Dict[str, str],
+                                   dimensions: List[str], data_ret: DataRetriever) -> None:
+        budget = extraction_budget()
+
+        def write(body: bytes, content_type: Optional[str]) -> None:
+            data_parser = data_parser_for(body, content_type, budget)
+            for chunk in metrics.timed_iter(data_parser.iter_chunks(STORE_CHUNK_ROWS), "parse"):
+                with metrics.stage("store"):
+                    store.write(url_data, chunk, dimensions)
+
+        async def download(part_url: str, part_params: Dict[str, str]) -> bool:
+            body, content_type = await self._download_data(part_url, part_params)
+            await asyncio.to_thread(write, body, content_type)
+            return True
+
+        parts = await asyncio.to_thread(data_ret.query_parts, url_data, params)
+        await self._run_parts(parts, download)
+
+
+class AsyncBatchDataRetriever(BatchDataRetriever):
+    """
+    Variante asincrona di BatchDataRetriever: ogni query è un task asyncio, al più `max_workers` attivi.
+    Le chiavi delle serie di ciascun dataflow vengono scaricate da un unico task condiviso dalle query del batch.
+    """
+
+    async def iter_results(self) -> AsyncIterator[BatchResult]:
+        for query in self.queries:
+            if isinstance(query, BatchResult):
+                yield query
+        groups = list(self._unique_queries().values())
+        unique = [self.queries[indices[0]] for indices in groups]
+        semaphore = asyncio.Semaphore(self.max_workers)
+        loads: Dict[Tuple[str, str], asyncio.Future] = {}
+
+        def load_series(query: BatchQuery) -> asyncio.Future:
+            pair = (query.dataflow_id, query.ref_id)
+            if pair not in loads:
+                afr = AsyncFiltersRetriever(*pair, context=self._context(query))
+                loads[pair] = asyncio.ensure_future(afr.load(with_structure=False))
+            return loads[pair]
+
+        async def run(position: int) -> Tuple[int, Optional[pd.DataFrame], int, Optional[str]]:
+            query = unique[position]
+            async with semaphore:
+                try:
+                    await load_series(query)
+                    data_ret = AsyncDataRetriever(query.dataflow_id, query.ref_id, query.filters,
+                                                  context=self._context(query))
+                    df = await data_ret.get_data(query.start_period, query.end_period, query.aggregation)
+                    return position, df, 200, None
+                except Exception as e:
+                    print(f"Batch query {query.dataflow_id} failed: {e}")
+                    return position, None, error_status(e), str(e)
+
+        tasks = [asyncio.ensure_future(run(position)) for position in range(len(unique))]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                position, df, status, error = await next_done
+                for index in groups[position]:
+                    yield BatchResult(index, status, df, error, self.queries[index].id)
+        finally:
+            # Client disconnesso: le query non ancora concluse vengono annullate
+            for task in tasks + list(loads.values()):
+                task.cancel()
+
+    async def results(self) -> List[BatchResult]:
+        return sorted([result async for result in self.iter_results()], key=lambda result: result.index)
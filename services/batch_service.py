@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 11:32:06 2026
+
+@author: andreadesogus
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Dict, Hashable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from core.aggregation import Aggregation, AggregationError, parse_aggregation
+from core.concurrency import bounded_as_completed
+from core.downloader import DownloadError
+from core.lazy import LazyModule
+from core.series_store import PERIOD_RE
+from services.dataflow_context import DataflowContext
+from services.dataflow_service import DataRetriever
+
+pd = LazyModule("pandas")
+
+# Numero massimo di query in una richiesta a /api/data/batch
+BATCH_MAX_QUERIES = int(os.environ.get("ISTAT_BATCH_MAX_QUERIES", 50))
+# Query di un batch eseguite in parallelo (ciascuna può a sua volta dividersi in sotto-richieste)
+BATCH_CONCURRENCY = int(os.environ.get("ISTAT_BATCH_CONCURRENCY", 4))
+
+
+class BatchQuery(NamedTuple):
+    """Una query di /api/data/batch, con gli stessi parametri di /api/data (aggregazione compresa)."""
+    dataflow_id: str
+    ref_id: str
+    filters: Dict[Any, Any]
+    start_period: Optional[str] = None
+    end_period: Optional[str] = None
+    id: Any = None
+    aggregation: Optional[Aggregation] = None
+
+    def key(self) -> Hashable:
+        """Chiave della query senza `id`: query identiche nello stesso batch vengono eseguite una sola volta."""
+        return json.dumps(
+            [self.dataflow_id, self.ref_id, self.filters, self.start_period, self.end_period, self.aggregation],
+            sort_keys=True, default=str
+        )
+
+
+class BatchResult(NamedTuple):
+    """Esito di una query del batch: `data` se riuscita, altrimenti `error` con lo stato HTTP equivalente."""
+    index: int
+    status: int
+    data: Optional[pd.DataFrame] = None
+    error: Optional[str] = None
+    id: Any = None
+
+
+def parse_batch(payload: Any) -> List[Union[BatchQuery, BatchResult]]:
+    """
+    Valida il corpo di /api/data/batch ({"queries": [...]} oppure direttamente la lista delle query).
+
+    Ritorna, nello stesso ordine, una BatchQuery per ciascuna query valida e un BatchResult con
+    stato 400 per quelle non valide, che non impediscono l'esecuzione delle altre.
+    Solleva ValueError se il batch nel suo insieme non è valido.
+    """
+    queries = payload.get("queries") if isinstance(payload, dict) else payload
+    if not isinstance(queries, list) or not queries:
+        raise ValueError("Il parametro queries deve essere una lista non vuota di query")
+    if len(queries) > BATCH_MAX_QUERIES:
+        raise ValueError(f"Il batch supera il limite di {BATCH_MAX_QUERIES} query")
+
+    parsed: List[Union[BatchQuery, BatchResult]] = []
+    for index, query in enumerate(queries):
+        if not isinstance(query, dict):
+            parsed.append(BatchResult(index, 400, error="Invalid input, expected a dictionary"))
+            continue
+        query_id = query.get("id")
+        filters = query.get("filters", {})
+        start_period, end_period = query.get("startPeriod"), query.get("endPeriod")
+        invalid_period = next(
+            (p for p in (start_period, end_period) if p is not None and not PERIOD_RE.match(str(p))), None
+        )
+        try:
+            aggregation, error = parse_aggregation(query), None
+        except AggregationError as e:
+            aggregation, error = None, str(e)
+        if not query.get("dataflow_id") or not query.get("ref_id"):
+            error = "I parametri dataflow_id e ref_id sono obbligatori"
+        elif not isinstance(filters, dict):
+            error = "Invalid input, expected a dictionary"
+        elif invalid_period is not None:
+            error = f"Periodo non valido: {invalid_period}"
+        elif error is None:
+            parsed.append(BatchQuery(
+                query["dataflow_id"], query["ref_id"], filters, start_period, end_period, query_id, aggregation
+            ))
+            continue
+        parsed.append(BatchResult(index, 400, error=error, id=query_id))
+    return parsed
+
+
+def error_status(error: Exception) -> int:
+    """
+    Stato HTTP riportato per una query non riuscita: 400 per un'aggregazione non valida, 404 se il web
+    service non ha dati, 502 per gli altri errori del web service, 500 altrimenti (come /api/data per
+    gli errori di validazione dei filtri).
+    """
+    if isinstance(error, AggregationError):
+        return 400
+    if isinstance(error, DownloadError):
+        return 404 if error.status_code == 404 else 502
+    return 500
+
+
+class BatchDataRetriever:
+    """
+    Esegue le query di /api/data/batch in parallelo, al più `max_workers` alla volta.
+
+    Le query sullo stesso dataflow usano lo stesso DataflowContext, quindi chiavi delle serie e relativo
+    indice vengono caricati una sola volta per batch; le query identiche vengono eseguite una sola volta
+    e il risultato riportato per ciascuna. Il fallimento di una query non interrompe le altre.
+    """
+
+    def __init__(self, queries: List[Union[BatchQuery, BatchResult]], max_workers: int = BATCH_CONCURRENCY) -> None:
+        self.queries = queries
+        self.max_workers = max_workers
+        self._contexts: Dict[Tuple[str, str], DataflowContext] = {}
+
+    def _context(self, query: BatchQuery) -> DataflowContext:
+        pair = (query.dataflow_id, query.ref_id)
+        if pair not in self._contexts:
+            self._contexts[pair] = DataflowContext.get(*pair)
+        return self._contexts[pair]
+
+    def _unique_queries(self) -> Dict[Hashable, List[int]]:
+        """Posizioni delle query valide raggruppate per chiave, nell'ordine di prima occorrenza."""
+        groups: Dict[Hashable, List[int]] = {}
+        for index, query in enumerate(self.queries):
+            if isinstance(query, BatchQuery):
+                groups.setdefault(query.key(), []).append(index)
+        return groups
+
+    def _run(self, query: BatchQuery) -> pd.DataFrame:
+        data_ret = DataRetriever(query.dataflow_id, query.ref_id, query.filters, context=self._context(query))
+        return data_ret.get_data(query.start_period, query.end_period, query.aggregation)
+
+    def iter_results(self) -> Iterator[BatchResult]:
+        """
+        Ritorna gli esiti man mano che le query terminano: prima quelle non valide, poi le altre
+        in ordine di completamento. Ogni BatchResult riporta la posizione della query nel batch.
+        """
+        for query in self.queries:
+            if isinstance(query, BatchResult):
+                yield query
+        groups = list(self._unique_queries().values())
+        unique = [self.queries[indices[0]] for indices in groups]
+        # I contesti vengono creati prima di avviare i thread, uno per coppia (dataflow_id, ref_id)
+        for query in unique:
+            self._context(query)
+        for position, future in bounded_as_completed(self._run, unique, max_workers=self.max_workers):
+            try:
+                df, status, error = future.result(), 200, None
+            except Exception as e:
+                df, status, error = None, error_status(e), str(e)
+                print(f"Batch query {unique[position].dataflow_id} failed: {e}")
+            for index in groups[position]:
+                yield BatchResult(index, status, df, error, self.queries[index].id)
+
+    def results(self) -> List[BatchResult]:
+        """Tutti gli esiti, nell'ordine delle query nel batch."""
+        return sorted(self.iter_results(), key=lambda result: result.index)
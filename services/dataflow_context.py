@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 11:20:05 2026
+
+@author: andreadesogus
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from core import metrics
+from core.concurrency import bounded_map
+from core.downloader import Downloader, DownloadError
+from core.lazy import LazyModule
+from core.parsers import (
+    Code, Dimension, SeriesKeys, SeriesParser, SdmxCsvParser, DataSchemeExtractor, MetadataHelper
+)
+from core.shared_cache import KEY_VERSION, get_shared_store
+from core.singleflight import get_group
+from core.transport import SDMX_REST_URL
+from core.utils import SeriesKeyIndex
+
+pd = LazyModule("pandas")
+
+CONTEXT_LRU_SIZE = int(os.environ.get("ISTAT_CONTEXT_LRU_SIZE", 32))
+CONTEXT_TTL = int(os.environ.get("ISTAT_CONTEXT_TTL", 3600))
+# Frazione della validità oltre la quale un contesto (o una voce della cache condivisa) viene rinnovato in anticipo
+REFRESH_AHEAD = float(os.environ.get("ISTAT_REFRESH_AHEAD", 0.8))
+# "references": DSD e codelist in un unico messaggio (references=children); "separate": una richiesta per codelist
+STRUCTURE_MODE = os.environ.get("ISTAT_STRUCTURE_MODE", "references")
+# "csv": richiede i dati in SDMX-CSV con ripiego su SDMX-ML; "xml": solo SDMX-ML Generic
+DATA_FORMAT = os.environ.get("ISTAT_DATA_FORMAT", "csv")
+# Stati con cui il web service segnala che detail=serieskeysonly non è supportato
+SERIESKEYS_UNSUPPORTED = (400, 501)
+
+# Caricamenti (download + parsing) in corso, condivisi tra i contesti del processo
+_loads = get_group("context_loads")
+
+# Tipo di risorsa (per il TTL della cache condivisa) degli oggetti memorizzati nel contesto
+SHARED_RESOURCE_TYPES = {
+    "series": "serieskeys",
+    "series_index": "serieskeys",
+    "structure": "datastructure",
+    "codelist": "codelist",
+}
+
+
+class DataflowContext:
+    """
+    Contesto condiviso per una coppia (dataflow_id, ref_id).
+
+    Carica in modo pigro e memorizza l'indice delle serie, le dimensioni della DSD e le codelist,
+    così che FiltersRetriever e DataRetriever non scarichino mai due volte la stessa risorsa.
+    Le risorse sono strutture native (SeriesKeys, liste di Dimension e Code): servire i metadati
+    non richiede pandas, che viene caricato solo se serve `df_series`.
+    I contesti più usati vengono mantenuti in una LRU in-process (vedi `DataflowContext.get`).
+
+    Un contesto creato con `refresh=True` (refresh in background) rivalida col server le risorse
+    in cache e ignora le voci della cache condivisa già prossime alla scadenza.
+    """
+
+    def __init__(self, dataflow_id: str, ref_id: str, refresh: bool = False) -> None:
+        self.dataflow_id = dataflow_id
+        self.ref_id = ref_id
+        self.refresh = refresh
+        self.created_at = time.time()
+        self._values: Dict[str, Any] = {}
+
+    @classmethod
+    def get(cls, dataflow_id: str, ref_id: str) -> "DataflowContext":
+        """
+        Ritorna il contesto dalla LRU in-process, creandone uno nuovo se assente.
+        Un contesto scaduto continua a essere servito mentre ne viene caricato uno nuovo in background.
+        """
+        return _contexts.get_or_create(dataflow_id, ref_id)
+
+    def is_expired(self) -> bool:
+        return time.time() - self.created_at >= CONTEXT_TTL
+
+    def is_due(self) -> bool:
+        """Indica se il contesto è prossimo alla scadenza e va rinnovato in anticipo."""
+        return time.time() - self.created_at >= CONTEXT_TTL * REFRESH_AHEAD
+
+    def warm(self) -> "DataflowContext":
+        """Carica subito serie, indice delle serie, struttura e tutte le codelist della DSD."""
+        self.series_index
+        self.codelists(d.codelist_id for d in self.dimensions)
+        self.refresh = False
+        return self
+
+    def series_request(self, csv: bool = DATA_FORMAT == "csv") -> Dict[str, Any]:
+        """Parametri di Downloader per le sole chiavi delle serie (detail=serieskeysonly), in SDMX-CSV se `csv`."""
+        return {
+            "url": f"{SDMX_REST_URL}/data/{self.dataflow_id}",
+            "params": {"detail": "serieskeysonly"},
+            "resource_type": "serieskeys",
+            "headers": {"Accept": SdmxCsvParser.MEDIA_TYPE} if csv else None,
+        }
+
+    def series_fallback(self, request: Dict[str, Any], error: Exception) -> Optional[Dict[str, Any]]:
+        """
+        Richiesta da tentare dopo che `request` per le chiavi delle serie è fallita con `error`, oppure
+        None se l'errore va rilanciato. Un errore della richiesta in SDMX-CSV (es. 406) viene ritentato
+        in SDMX-ML; solo se il web service indica che serieskeysonly non è supportato si scarica il
+        dataset completo. Errori di rete, 404 e altri errori del web service non cambiano richiesta.
+        """
+        if not isinstance(error, DownloadError) or error.status_code == 404:
+            return None
+        if request.get("headers"):
+            print(f"SDMX-CSV series keys not available for {self.dataflow_id} ({error}). Retrying in SDMX-ML")
+            return self.series_request(csv=False)
+        if request.get("params") and error.status_code in SERIESKEYS_UNSUPPORTED:
+            print(f"Series keys not available for {self.dataflow_id} ({error}). Downloading full dataset")
+            return self.full_series_request()
+        return None
+
+    def full_series_request(self) -> Dict[str, Any]:
+        """Parametri di Downloader per il dataset completo, usato se serieskeysonly non è supportato."""
+        return {"url": f"{SDMX_REST_URL}/data/{self.dataflow_id}"}
+
+    def structure_request(self) -> Dict[str, Any]:
+        """
+        Parametri di Downloader per la struttura dei filtri. In modalità "references" il messaggio
+        include anche codelist e concept scheme referenziati (references=children).
+        """
+        return {
+            "url": f"{SDMX_REST_URL}/datastructure/IT1/{self.ref_id}/",
+            "params": {"references": "children"} if STRUCTURE_MODE == "references" else None,
+            "resource_type": "datastructure",
+        }
+
+    def codelist_request(self, codelist_id: str) -> Dict[str, Any]:
+        """Parametri di Downloader per la codelist indicata."""
+        return {"url": f"{SDMX_REST_URL}/codelist/IT1/{codelist_id}", "resource_type": "codelist"}
+
+    def _download_series(self) -> str:
+        """
+        Scarica le sole chiavi delle serie per il dataflow specificato, senza le osservazioni.
+        In caso di errore ripiega secondo `series_fallback`.
+        """
+        request = self.series_request()
+        while True:
+            try:
+                return Downloader(**request, revalidate=self.refresh).download()
+            except Exception as e:
+                request = self.series_fallback(request, e)
+                if request is None:
+                    raise
+
+    def _download_filter_structure(self) -> str:
+        """Scarica la struttura dei filtri per il riferimento specificato."""
+        return Downloader(**self.structure_request(), revalidate=self.refresh).download()
+
+    def _download_codelist(self, codelist_id: str) -> str:
+        """Scarica la codelist per il filtro specificato."""
+        return Downloader(**self.codelist_request(codelist_id), revalidate=self.refresh).download()
+
+    def is_loaded(self, key: str) -> bool:
+        """
+        Indica se la risorsa `key` (es. "series", "structure") è disponibile senza scaricarla:
+        già in memoria oppure caricata da un altro worker nella cache condivisa.
+        """
+        return key in self._values or self._restore(key) is not None
+
+    def load(self, key: str, loader: Callable[[], Any], shared: bool = False) -> Any:
+        """Carica la risorsa `key` con un loader esterno (es. dal servizio asincrono), se non già presente."""
+        return self._memoize(key, loader, shared=shared)
+
+    def _shared_key(self, key: str) -> str:
+        """
+        Chiave nella cache condivisa: include il web service e, per la struttura, la modalità di richiesta.
+        Le codelist sono globali, quindi la loro chiave non dipende dal dataflow.
+        """
+        if key.startswith("codelist:"):
+            return f"v{KEY_VERSION}|{SDMX_REST_URL}|{key}"
+        if key == "structure":
+            key = f"structure:{STRUCTURE_MODE}"
+        return f"v{KEY_VERSION}|{SDMX_REST_URL}|{self.dataflow_id}|{self.ref_id}|{key}"
+
+    def _restore(self, key: str) -> Any:
+        """Legge la risorsa dalla cache condivisa tra i worker e la memorizza nel contesto."""
+        store = get_shared_store()
+        if store is None or key.split(":")[0] not in SHARED_RESOURCE_TYPES:
+            return None
+        max_age = CONTEXT_TTL * REFRESH_AHEAD if self.refresh else None
+        value = store.get(self._shared_key(key), max_age=max_age)
+        if value is not None:
+            self._values.setdefault(key, value)
+        return value
+
+    def _load_shared(self, key: str, loader: Callable[[], Any]) -> Any:
+        """Esegue `loader` solo se la risorsa non è già nella cache condivisa, e poi ve la salva."""
+        if key in self._values:
+            return self._values[key]
+        value = self._restore(key)
+        if value is not None:
+            metrics.count_cache("shared", "hit")
+            return value
+        value = loader()
+        store = get_shared_store()
+        resource_type = SHARED_RESOURCE_TYPES.get(key.split(":")[0])
+        if store is not None and resource_type is not None:
+            store.set(self._shared_key(key), resource_type, value)
+        return value
+
+    def _memoize(self, key: str, loader: Callable[[], Any], shared: bool = False) -> Any:
+        """
+        Calcola `loader()` una sola volta per chiave; chiamanti concorrenti attendono il primo.
+        Con `shared=True` il caricamento è condiviso anche con gli altri contesti (es. codelist comuni).
+        Strutture, codelist e serie passano inoltre per la cache condivisa tra i worker.
+        """
+        if key in self._values:
+            _loads.record_hit()
+            metrics.count_cache("context", "hit")
+            return self._values[key]
+        metrics.count_cache("context", "miss")
+        flight_key = key if shared else (self.dataflow_id, self.ref_id, key)
+        value = _loads.do(flight_key, lambda: self._load_shared(key, loader))
+        return self._values.setdefault(key, value)
+
+    @property
+    def series(self) -> Tuple[Any, Any, SeriesKeys]:
+        """Tupla (structure_id, ref_id, chiavi delle serie) prodotta dal parser, caricata una sola volta."""
+        return self._memoize("series", lambda: parse_series_data(self._download_series()))
+
+    @property
+    def series_keys(self) -> SeriesKeys:
+        return self.series[2]
+
+    @property
+    def df_series(self) -> pd.DataFrame:
+        """Chiavi delle serie come DataFrame di stringhe, costruito solo se richiesto."""
+        return self._memoize("series_frame", self.series_keys.to_frame)
+
+    @property
+    def series_index(self) -> SeriesKeyIndex:
+        """Indice invertito delle chiavi delle serie, costruito una sola volta per contesto."""
+        return self._memoize("series_index", lambda: _build_index(self.series_keys))
+
+    @property
+    def structure(self) -> Tuple[List[Dimension], Dict[str, List[Code]]]:
+        """
+        Coppia (dimensioni, codelist incluse) ricavata dalla DSD con un'unica richiesta.
+        In modalità "separate" le codelist incluse sono vuote e vengono scaricate singolarmente.
+        """
+        return self._memoize("structure", lambda: parse_structure_data(self._download_filter_structure()))
+
+    @property
+    def dimensions(self) -> List[Dimension]:
+        """Dimensioni della DSD così come restituite da DataSchemeExtractor."""
+        return self.structure[0]
+
+    def codelist(self, codelist_id: str) -> List[Code]:
+        """
+        Codici della codelist indicata. Se inclusa nel messaggio della DSD viene letta da lì,
+        altrimenti viene scaricata e analizzata una sola volta per contesto.
+        """
+        embedded = self.structure[1]
+        if codelist_id in embedded:
+            return embedded[codelist_id]
+        return self._memoize(
+            f"codelist:{codelist_id}",
+            lambda: parse_codelist_data(self._download_codelist(codelist_id)),
+            shared=True
+        )
+
+    def missing_codelists(self) -> List[str]:
+        """ID delle codelist della DSD non incluse nel messaggio della struttura e non ancora caricate."""
+        dimensions, embedded = self.structure
+        return [
+            codelist_id for codelist_id in dict.fromkeys(d.codelist_id for d in dimensions)
+            if codelist_id not in embedded and not self.is_loaded(f"codelist:{codelist_id}")
+        ]
+
+    def codelists(self, codelist_ids: Iterable[str]) -> Dict[str, List[Code]]:
+        """
+        Risolve più codelist in parallelo su un pool limitato. Gli ID duplicati vengono
+        scaricati una sola volta e il dizionario ritornato segue l'ordine di prima occorrenza.
+        """
+        unique_ids = list(dict.fromkeys(codelist_ids))
+        embedded = self.structure[1]
+        missing = [codelist_id for codelist_id in unique_ids if codelist_id not in embedded]
+        fetched = dict(zip(missing, bounded_map(self.codelist, missing)))
+        return {codelist_id: embedded.get(codelist_id, fetched.get(codelist_id)) for codelist_id in unique_ids}
+
+
+def parse_series_data(series_data: str) -> Tuple[Any, Any, SeriesKeys]:
+    """Analizza l'indice delle serie; il web service può ignorare la richiesta di CSV, quindi il formato si riconosce dal contenuto."""
+    with metrics.stage("parse"):
+        if series_data.lstrip().startswith("<"):
+            return SeriesParser(series_data).parse_series_keys()
+        return SdmxCsvParser(series_data).parse_series_keys()
+
+
+def parse_structure_data(structure_data: str) -> Tuple[List[Dimension], Dict[str, List[Code]]]:
+    """Ritorna (dimensioni, codelist incluse) da un messaggio di datastructure."""
+    with metrics.stage("parse"):
+        extractor = DataSchemeExtractor(structure_data)
+        return extractor.dimensions(), extractor.codelists()
+
+
+def parse_codelist_data(codelist_data: str) -> List[Code]:
+    """Ritorna i codici di un messaggio di codelist."""
+    with metrics.stage("parse"):
+        return MetadataHelper(codelist_data).codes()
+
+
+def _build_index(series_keys: SeriesKeys) -> SeriesKeyIndex:
+    with metrics.stage("index"):
+        return SeriesKeyIndex(series_keys)
+
+
+class _ContextLRU:
+    """
+    LRU thread-safe dei DataflowContext, indicizzata per (dataflow_id, ref_id).
+
+    Tiene anche il conteggio delle richieste per dataflow (usato dal warm-up per scegliere i più richiesti)
+    e applica lo stale-while-revalidate: un contesto scaduto viene servito mentre uno nuovo viene
+    caricato in un thread separato e poi sostituito.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._items: "OrderedDict[Tuple[str, str], DataflowContext]" = OrderedDict()
+        self._requests: Counter = Counter()
+        self._refreshing: Set[Tuple[str, str]] = set()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, dataflow_id: str, ref_id: str) -> DataflowContext:
+        key = (dataflow_id, ref_id)
+        with self._lock:
+            self._requests[key] += 1
+            context = self._items.get(key)
+            if context is None:
+                context = DataflowContext(dataflow_id, ref_id)
+                self._items[key] = context
+            elif context.is_expired() and key not in self._refreshing:
+                self._refreshing.add(key)
+                threading.Thread(target=self._refresh_in_background, args=key, daemon=True).start()
+            self._items.move_to_end(key)
+            self._trim()
+            return context
+
+    def _refresh_in_background(self, dataflow_id: str, ref_id: str) -> None:
+        try:
+            refresh_context(dataflow_id, ref_id)
+        except Exception as e:
+            print(f"Background refresh failed for {dataflow_id}: {e}. Serving stale context")
+        finally:
+            with self._lock:
+                self._refreshing.discard((dataflow_id, ref_id))
+
+    def peek(self, dataflow_id: str, ref_id: str) -> Optional[DataflowContext]:
+        """Ritorna il contesto senza crearlo né conteggiare la richiesta."""
+        with self._lock:
+            return self._items.get((dataflow_id, ref_id))
+
+    def put(self, context: DataflowContext) -> None:
+        with self._lock:
+            key = (context.dataflow_id, context.ref_id)
+            self._items[key] = context
+            self._items.move_to_end(key)
+            self._trim()
+
+    def most_requested(self, n: int) -> List[Tuple[str, str]]:
+        with self._lock:
+            return [key for key, _ in self._requests.most_common(n)]
+
+    def _trim(self) -> None:
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+_contexts = _ContextLRU(CONTEXT_LRU_SIZE)
+
+
+def refresh_context(dataflow_id: str, ref_id: str) -> DataflowContext:
+    """
+    Carica da zero il contesto di un dataflow (rivalidando le risorse col server) e lo sostituisce
+    nella LRU solo a caricamento completato: nel frattempo le richieste usano il contesto precedente.
+    """
+    context = DataflowContext(dataflow_id, ref_id, refresh=True).warm()
+    _contexts.put(context)
+    return context
+
+
+def needs_refresh(dataflow_id: str, ref_id: str) -> bool:
+    """Indica se il contesto del dataflow manca nella LRU o è prossimo alla scadenza."""
+    context = _contexts.peek(dataflow_id, ref_id)
+    return context is None or context.is_due()
+
+
+def most_requested(n: int) -> List[Tuple[str, str]]:
+    """Le `n` coppie (dataflow_id, ref_id) più richieste nel worker corrente."""
+    return _contexts.most_requested(n)
@@ -6,52 +6,172 @@ Created on Sat Mar  1 12:45:39 2025
 @author: andreadesogus
 """
 
-import pandas as pd
-from typing import Any, Dict, List, Optional, Tuple
-
-from core.downloader import Downloader
-from core.parsers import (
-    DataflowParser,
-    SeriesParser,
-    DataSchemeExtractor,
-    MetadataHelper,
-    ValuesParser
-)
+from __future__ import annotations
+
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from core import metrics
+from core.aggregation import Aggregation, aggregate
+from core.cache import DEFAULT_TTLS, _ttls_from_env
+from core.concurrency import bounded_map
+from core.downloader import Downloader, DownloadError
+from core.lazy import LazyModule
+from core.transport import SDMX_REST_URL
+from core.parsers import DataflowParser, Dimension, ExtractionBudget, SdmxCsvParser, SeriesKeys, ValuesParser
+from core.planner import SPLIT_CONCURRENCY, QueryPlanner, merge_frames
+from core.search import CatalogueIndex
+from core.series_store import SeriesStore, StorePlan, get_series_store, period_params, select_window
+from core.shared_cache import KEY_VERSION, get_shared_store
+from core.singleflight import get_group
 from core.utils import StringaFiltroGenerator
 from core.utils import PatternMatcher
+from services.dataflow_context import DATA_FORMAT, DataflowContext
+
+pd = LazyModule("pandas")
+
+# Budget opzionali per singola estrazione, sommati su tutte le sue sotto-richieste: oltre, il parsing si interrompe con ValueError
+MAX_ROWS = int(os.environ["ISTAT_MAX_ROWS"]) if os.environ.get("ISTAT_MAX_ROWS") else None
+MAX_BYTES = int(os.environ["ISTAT_MAX_BYTES"]) if os.environ.get("ISTAT_MAX_BYTES") else None
+# Osservazioni per blocco nelle risposte in streaming
+STREAM_CHUNK_ROWS = int(os.environ.get("ISTAT_STREAM_CHUNK_ROWS", 5000))
+# Osservazioni per blocco scritte nello store locale durante un download
+STORE_CHUNK_ROWS = 50000
+# Aggiornamenti dello store in corso: richieste concorrenti sugli stessi dati attendono lo stesso download
+_store_syncs = get_group("series_store")
+# Validità del catalogo dei dataflow mantenuto in memoria (stessa della cache su disco)
+CATALOGUE_TTL = dict(DEFAULT_TTLS, **_ttls_from_env())["dataflow"]
+
+def extraction_budget() -> ExtractionBudget:
+    """Budget di ISTAT_MAX_ROWS e ISTAT_MAX_BYTES da condividere tra le sotto-richieste di un'estrazione."""
+    return ExtractionBudget(MAX_ROWS, MAX_BYTES)
+
+
+def data_parser_for(source: Any, content_type: Optional[str],
+                    budget: Optional[ExtractionBudget] = None) -> Union[ValuesParser, SdmxCsvParser]:
+    """Ritorna il parser dei dati adatto al Content-Type della risposta (SDMX-CSV o SDMX-ML)."""
+    budget = budget or extraction_budget()
+    if "csv" in (content_type or ""):
+        return SdmxCsvParser(source, budget=budget)
+    return ValuesParser(source, budget=budget)
+
+
+def parse_data(data_parser: Union[ValuesParser, SdmxCsvParser]) -> pd.DataFrame:
+    """Analizza l'intero messaggio dei dati, registrando durata e righe della fase "parse"."""
+    with metrics.stage("parse"):
+        df = data_parser.parse()
+    metrics.count_rows("parse", len(df))
+    return df
+
+
+def aggregate_data(df: pd.DataFrame, aggregation: Optional[Aggregation]) -> pd.DataFrame:
+    """Applica l'eventuale aggregazione al DataFrame dei dati, registrando la fase "aggregate"."""
+    if aggregation is None:
+        return df
+    with metrics.stage("aggregate"):
+        return aggregate(df, aggregation)
+
 
 class DataflowRetriever:
     """Classe per il recupero e l'analisi dei dataflow da SDMX."""
 
-    def _download_dataflow(self) -> str:
+    def _download_dataflow(self, revalidate: bool = False) -> str:
         """Scarica i dati del dataflow."""
-        downloader = Downloader("https://sdmx.istat.it/SDMXWS/rest/dataflow/IT1/")
+        downloader = Downloader(f"{SDMX_REST_URL}/dataflow/IT1/", resource_type="dataflow", revalidate=revalidate)
         return downloader.download()
 
-    def parse_dataflows(self, search_string: Optional[str] = None) -> List[Dict[str, Any]]:
+    def catalogue_key(self) -> str:
+        """Chiave del catalogo analizzato nella cache condivisa tra i worker."""
+        return f"v{KEY_VERSION}|{SDMX_REST_URL}|dataflows"
+
+    def catalogue(self, max_age: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Catalogo dei dataflow ordinato per nome (vedi `catalogue_index`)."""
+        return self.catalogue_index(max_age).records
+
+    def catalogue_index(self, max_age: Optional[float] = None) -> CatalogueIndex:
+        """
+        Indice di ricerca sul catalogo dei dataflow, mantenuto in memoria nel worker finché valido.
+        Il catalogo viene letto dalla cache condivisa se un altro worker l'ha già analizzato, altrimenti
+        scaricato; l'indice viene ricostruito solo se il contenuto del catalogo è cambiato.
+        Con `max_age` (refresh in background) una copia più vecchia viene ricaricata rivalidandola col server.
+        """
+        index = self.cached_index(max_age)
+        if index is not None:
+            return index
+        store = get_shared_store()
+        entry = store.get_entry(self.catalogue_key(), max_age=max_age) if store is not None else None
+        if entry is None:
+            records = self.catalogue_from_xml(self._download_dataflow(revalidate=max_age is not None))
+            if store is not None:
+                store.set(self.catalogue_key(), "dataflow", records)
+            entry = (records, time.time())
+        return self.remember_catalogue(*entry)
+
+    def cached_index(self, max_age: Optional[float] = None) -> Optional[CatalogueIndex]:
+        """Indice in memoria se il catalogo da cui deriva è più recente di `max_age` (default: TTL del catalogo)."""
+        return _catalogue_memo.get(CATALOGUE_TTL if max_age is None else max_age)
+
+    def remember_catalogue(self, records: List[Dict[str, Any]], loaded_at: float) -> CatalogueIndex:
+        """Memorizza nel worker il catalogo caricato all'istante `loaded_at` e ne ritorna l'indice."""
+        return _catalogue_memo.update(records, loaded_at)
+
+    def catalogue_from_xml(self, xml_data: str) -> List[Dict[str, Any]]:
+        """Dataflow con tutti i campi valorizzati, ordinati per nome italiano."""
+        records = [
+            record for record in DataflowParser(xml_data).dataflow_records()
+            if all(value is not None for value in record.values())
+        ]
+        return sorted(records, key=lambda record: record["Nome IT"])
+
+    def parse_dataflows(self, search_string: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
         """
         Analizza i dataflow e ritorna una lista di dizionari.
 
-        Se search_string è fornita, filtra i dataflow in base al nome.
-        In caso di filtro senza risultati, viene mostrato un messaggio e vengono restituiti tutti i dataflow.
-        """
-        xml_data = self._download_dataflow()
-        dataflow_parser = DataflowParser(xml_data)
-        df_dataflows = (
-            dataflow_parser
-            .parse_dataflows()
-            .sort_values(by="Nome IT")
-            .reset_index(drop=True)
-            .dropna()
-        )
-        if not search_string:
-            return df_dataflows.to_dict(orient="records")
-        else:
-            df_filtered = dataflow_parser.filter_by_name(df_dataflows, search_string)
-            if df_filtered.empty:
-                print("La stringa inserita non ha prodotto risultati. Recupero tutti i dataflow.")
-                return df_dataflows.to_dict(orient="records")
-            return df_filtered.to_dict(orient="records")
+        Se search_string è fornita, cerca i dataflow per nome (IT ed EN), Dataflow ID e Ref ID,
+        ordinandoli per rilevanza. In caso di ricerca senza risultati, viene mostrato un messaggio
+        e vengono restituiti tutti i dataflow. `limit` limita il numero di risultati.
+        """
+        return self.search(self.catalogue_index(), search_string, limit)
+
+    def search(self, index: CatalogueIndex, search_string: Optional[str] = None,
+               limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        results = index.search(search_string, limit)
+        if search_string and not results:
+            print("La stringa inserita non ha prodotto risultati. Recupero tutti i dataflow.")
+            return index.search(None, limit)
+        return results
+
+
+class _CatalogueMemo:
+    """Ultimo catalogo caricato nel worker e relativo indice di ricerca."""
+
+    def __init__(self) -> None:
+        self.index: Optional[CatalogueIndex] = None
+        self.fingerprint: Optional[int] = None
+        self.loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, max_age: float) -> Optional[CatalogueIndex]:
+        if self.index is not None and time.time() - self.loaded_at < max_age:
+            return self.index
+        return None
+
+    def update(self, records: List[Dict[str, Any]], loaded_at: float) -> CatalogueIndex:
+        fingerprint = hash(tuple(tuple(record.values()) for record in records))
+        with self._lock:
+            if fingerprint != self.fingerprint:
+                start_time = time.time()
+                self.index = CatalogueIndex(records)
+                self.fingerprint = fingerprint
+                print(f"Catalogue search index built in {time.time() - start_time:.3f} seconds")
+            self.loaded_at = loaded_at
+            return self.index
+
+
+_catalogue_memo = _CatalogueMemo()
 
 
 class FiltersRetriever:
@@ -59,76 +179,54 @@ class FiltersRetriever:
     Classe per il recupero e la gestione dei filtri basati su un dataflow e una struttura dati.
     """
 
-    def __init__(self, dataflow_id: str, ref_id: str) -> None:
+    def __init__(self, dataflow_id: str, ref_id: str, context: Optional[DataflowContext] = None) -> None:
         self.dataflow_id = dataflow_id
         self.ref_id = ref_id
-        # Recupera e memorizza il dataframe della serie; si assume che parse_series ritorni una tupla
-        _, _, self.df_series = self._parse_series()
+        # Il contesto condiviso memorizza serie, dimensioni e codelist già scaricate per questa coppia
+        self.context = context or DataflowContext.get(dataflow_id, ref_id)
+        _, _, self.series_keys = self._parse_series()
 
-    def _download_series(self) -> str:
-        """Scarica i dati della serie per il dataflow specificato."""
-        downloader = Downloader(f"http://sdmx.istat.it/SDMXWS/rest/data/{self.dataflow_id}")
-        return downloader.download()
-
-    def _download_filter_structure(self) -> str:
-        """Scarica la struttura dei filtri per il riferimento specificato."""
-        downloader = Downloader(f"https://sdmx.istat.it/SDMXWS/rest/datastructure/IT1/{self.ref_id}/")
-        return downloader.download()
-
-    def _download_codelist(self, codelist_id: str) -> str:
-        """Scarica la codelist per il filtro specificato."""
-        downloader = Downloader(f"http://sdmx.istat.it/SDMXWS/rest/codelist/IT1/{codelist_id}")
-        return downloader.download()
-
-    def _parse_series(self) -> Tuple[Any, Any, pd.DataFrame]:
+    def _parse_series(self) -> Tuple[Any, Any, SeriesKeys]:
         """
-        Analizza i dati della serie e ritorna il risultato del parsing.
-        Il risultato atteso è una tupla in cui il terzo elemento è il dataframe.
+        Ritorna il risultato del parsing delle serie, memorizzato nel contesto condiviso.
+        Il risultato atteso è una tupla in cui il terzo elemento sono le chiavi delle serie.
         """
-        xml_data = self._download_series()
-        series_parser = SeriesParser(xml_data)
-        return series_parser.parse_series()
+        return self.context.series
 
-    def get_filters(self) -> pd.Index:
-        """Ritorna le colonne (filtri) presenti nel dataframe della serie."""
-        print(f"DF SERIES COLUMNS: {self.df_series.columns}")
-        return self.df_series.columns
+    @property
+    def df_series(self) -> pd.DataFrame:
+        """Chiavi delle serie come DataFrame (richiede pandas, vedi `DataflowContext.df_series`)."""
+        return self.context.df_series
+
+    def get_filters(self) -> List[str]:
+        """Ritorna le colonne (filtri) presenti nelle chiavi delle serie."""
+        print(f"SERIES COLUMNS: {self.series_keys.columns}")
+        return self.series_keys.columns
 
     def get_valid_filters(self) -> List[str]:
         """
         Ritorna una lista dei filtri (colonne) che contengono più di un valore unico,
         considerati validi.
         """
-        return [col for col in self.df_series if self.df_series[col].nunique() > 1]
+        return [col for col in self.series_keys.columns if len(self.series_keys.values(col)) > 1]
 
-    def _parse_filter_structure(self) -> pd.DataFrame:
+    def _parse_filter_structure(self) -> List[Dimension]:
         """
-        Analizza la struttura dei filtri e ritorna un DataFrame ordinato in base all'ID della dimensione.
+        Analizza la struttura dei filtri e ritorna le dimensioni ordinate come le colonne delle serie;
+        le dimensioni assenti dalle serie vengono in coda.
         """
-        xml_data = self._download_filter_structure()
-        filter_parser = DataSchemeExtractor(xml_data)
-        df_dimensions = filter_parser.parse_dimensions()
         # Imposta l'ordinamento basato sui filtri disponibili
-        df_dimensions['Dimension ID'] = pd.Categorical(
-            df_dimensions['Dimension ID'],
-            categories=list(self.get_filters()),
-            ordered=True
-        )
-        df_dimensions = df_dimensions.sort_values('Dimension ID').reset_index(drop=True)
-        return df_dimensions
-
-    def _get_filtered_dimensions(self) -> pd.DataFrame:
-        """
-        Recupera la struttura dei filtri filtrata per i valid filters.
-        Restituisce un DataFrame contenente le colonne 'Dimension ID' e 'Codelist ID'.
-        """
-        valid_filters = self.get_valid_filters()
-        df_filters = self._parse_filter_structure()
-        #return df_filters.loc[
-        #    df_filters['Dimension ID'].isin(valid_filters),
-        #    ['Dimension ID', 'Codelist ID']
-        #]
-        return df_filters[['Dimension ID', 'Codelist ID']]
+        order = {filter_id: i for i, filter_id in enumerate(self.get_filters())}
+        return sorted(self.context.dimensions, key=lambda d: order.get(d.id, len(order)))
+
+    def _get_filtered_dimensions(self) -> List[Dimension]:
+        """
+        Recupera la struttura dei filtri presenti nelle chiavi delle serie,
+        nell'ordine delle colonne.
+        """
+        #valid_filters = self.get_valid_filters()
+        columns = set(self.get_filters())
+        return [d for d in self._parse_filter_structure() if d.id in columns]
 
     def get_filters_dictionary(self) -> Dict[str, List[Dict[str, Any]]]:
         """
@@ -137,25 +235,62 @@ class FiltersRetriever:
         La chiave del dizionario è una stringa formata dall'indice della riga e dall'ID del filtro,
         mentre il valore è una lista di dizionari con i codici e i nomi corrispondenti.
         """
-        df_filters = self._get_filtered_dimensions()
+        dimensions = self._get_filtered_dimensions()
         filters_dict: Dict[str, List[Dict[str, Any]]] = {}
+        # Le codelist vengono risolte in parallelo, una sola volta anche se condivise tra dimensioni
+        codelists = self.context.codelists(d.codelist_id for d in dimensions)
     
-        for idx, row in df_filters.iterrows():
-            filter_id = row['Dimension ID']
-            codelist_id = row['Codelist ID']
-            unique_values = self.df_series[filter_id].unique()
-    
-            xml_data = self._download_codelist(codelist_id)
-            codelist_parser = MetadataHelper(xml_data)
-            df_codelist = codelist_parser.get_codes()
-            df_codelist = df_codelist[df_codelist['ID'].isin(unique_values)][['ID', "Nome_IT"]]
+        for idx, dimension in enumerate(dimensions):
+            filter_id = dimension.id
+            unique_values = set(self.series_keys.values(filter_id))
     
-            filters_dict[f"{idx} - {filter_id}"] = df_codelist.to_dict(orient="records")
+            filters_dict[f"{idx} - {filter_id}"] = [
+                {"ID": code.id, "Nome_IT": code.name_it}
+                for code in codelists[dimension.codelist_id] if code.id in unique_values
+            ]
     
         # Ordina il dizionario per chiave
         filters_dict = {k: filters_dict[k] for k in sorted(filters_dict)}
         return filters_dict
 
+    def build_pattern(self, filters: Dict[Any, Any]) -> str:
+        """
+        Costruisce il pattern di chiave (es. "A..X1.") da un dizionario posizione -> valore.
+        Il valore può essere una stringa, eventualmente con più codici separati da '+', o una lista di codici.
+        """
+        slots = [""] * len(self.get_filters())
+        for key, value in filters.items():
+            position = int(key)
+            if not 0 <= position < len(slots):
+                raise ValueError(f"Il filtro in posizione {key} non esiste per questo dataflow.")
+            slots[position] = "+".join(value) if isinstance(value, (list, tuple)) else str(value)
+        return ".".join(slots)
+
+    def match_filters(self, filters_list: List[Dict[Any, Any]], keys_limit: Optional[int] = None,
+                      facets: bool = False) -> List[Dict[str, Any]]:
+        """
+        Conta, senza interrogare il web service, le serie che soddisfano ciascuna combinazione di filtri.
+
+        Args:
+            filters_list: Lista di dizionari posizione -> valore (o lista di valori).
+            keys_limit: Se indicato, include fino a `keys_limit` chiavi delle serie corrispondenti.
+            facets: Se True, include per ogni dimensione il conteggio delle serie per valore.
+
+        Returns:
+            Una lista di dizionari con pattern, conteggio ed eventuali chiavi e facet.
+        """
+        index = self.context.series_index
+        results = []
+        for filters in filters_list:
+            pattern = self.build_pattern(filters)
+            result: Dict[str, Any] = {"pattern": pattern, "count": index.count(pattern)}
+            if keys_limit:
+                result["keys"] = index.keys(pattern, keys_limit)
+            if facets:
+                result["facets"] = index.facets(pattern)
+            results.append(result)
+        return results
+
     def generate_filter_url(self, filters: Dict[int, str]) -> str:
         """
         Genera e ritorna una stringa URL basata sui filtri forniti.
@@ -172,40 +307,242 @@ class FiltersRetriever:
     
     
 class DataRetriever:
-    def __init__(self, dataflow_id: str, ref_id: str, filters: Dict[int, str]) -> None:
+    def __init__(self, dataflow_id: str, ref_id: str, filters: Dict[int, str],
+                 context: Optional[DataflowContext] = None) -> None:
         self.dataflow_id = dataflow_id
         self.ref_id = ref_id
         self.filters = filters
-        self.fr = FiltersRetriever(self.dataflow_id, self.ref_id)
+        self.fr = FiltersRetriever(self.dataflow_id, self.ref_id, context=context)
         
     def generate_filter_string(self) -> str:
         return self.fr.generate_filter_url(self.filters)
         
-    def get_data(self) -> pd.DataFrame:
+    def _data_url(self) -> str:
         """
-        Fornisce il dataset finale con i valori osservati con i filtri prescelti.
-
-        Args:
-            filters: Un dizionario dove la chiave è l'indice del filtro e il valore è il filtro selezionato.
-            
-        Returns:
-            Un Pandas Dataframe.
+        Costruisce l'URL dei dati per i filtri prescelti, verificando prima sull'indice
+        delle serie che la combinazione produca almeno un risultato.
         """
-        
         string = self.generate_filter_string()
-        url_data = f"https://sdmx.istat.it/SDMXWS/rest/data/{self.dataflow_id}/{string}"
+        url_data = f"{SDMX_REST_URL}/data/{self.dataflow_id}/{string}"
         print(f"Filtered URL string: {url_data}")
 
-        _, _, df = self.fr._parse_series()
-        matcher = PatternMatcher(df)
+        matcher = PatternMatcher(self.fr.series_keys, index=self.fr.context.series_index)
     
         if not matcher.match(string):
             raise ValueError("La combinazione selezionata non genera risultati. Prova a modificarla o ad allentare i filtri applicati.")  
-        downloader_data = Downloader(url_data)
-        xml_data = downloader_data.download()
+        return url_data
+
+    def get_data(self, start_period: Optional[str] = None, end_period: Optional[str] = None,
+                 aggregation: Optional[Aggregation] = None) -> pd.DataFrame:
+        """
+        Fornisce il dataset finale con i valori osservati con i filtri prescelti.
+
+        Args:
+            start_period: Primo periodo da includere (es. "2015", "2015-01", "2015-Q1"), opzionale.
+            end_period: Ultimo periodo da includere, opzionale.
+            aggregation: Raggruppamento e ricampionamento da applicare alle osservazioni, opzionale.
+                Le dimensioni indicate vengono verificate prima del download.
             
-        data_parser = ValuesParser(xml_data)
-        return data_parser.parse()
-    
-    
-    
+        Returns:
+            Un Pandas Dataframe.
+        """
+        if aggregation is not None:
+            aggregation.validate(self.fr.get_filters())
+        url_data = self._data_url()
+        store = get_series_store()
+        if store is None:
+            parts = self.query_parts(url_data, period_params(start_period, end_period))
+            budget = extraction_budget()
+            frames = [
+                df for df in self._fetch_parts(parts, lambda *part: self._parse_part(*part, budget)) if df is not None
+            ]
+            with metrics.stage("merge"):
+                df = merge_frames(frames)
+        else:
+            self._sync_store(store, url_data, start_period, end_period)
+            with metrics.stage("store"):
+                df = store.read(url_data, start_period, end_period)
+        return aggregate_data(df, aggregation)
+
+    def iter_data(self, chunk_size: int = STREAM_CHUNK_ROWS, start_period: Optional[str] = None,
+                  end_period: Optional[str] = None) -> Iterator[pd.DataFrame]:
+        """
+        Fornisce il dataset a blocchi di al più `chunk_size` osservazioni, man mano che
+        vengono letti dalla risposta del web service (o dallo store locale).
+
+        La validazione dei filtri avviene subito; download e parsing procedono solo quando
+        l'iteratore viene consumato e la connessione viene chiusa alla sua chiusura.
+        """
+        url_data = self._data_url()
+        store = get_series_store()
+
+        def chunks() -> Iterator[pd.DataFrame]:
+            if store is None:
+                yield from self._iter_parts(url_data, period_params(start_period, end_period), chunk_size)
+                return
+            plan = store.plan(url_data, start_period, end_period)
+            if plan.mode != "fetch":
+                # Dati locali, eventualmente aggiornati con le sole osservazioni nuove o riviste
+                self._sync_store(store, url_data, start_period, end_period)
+                yield from metrics.timed_iter(store.iter_read(url_data, start_period, end_period, chunk_size), "store")
+                return
+            yield from self._iter_fetch_into_store(store, url_data, plan, chunk_size, start_period, end_period)
+
+        return chunks()
+
+    def _iter_parts(self, url_data: str, params: Dict[str, str], chunk_size: int) -> Iterator[pd.DataFrame]:
+        """Blocchi delle sotto-richieste, lette una alla volta in streaming per limitare la memoria."""
+        parts = self.query_parts(url_data, params)
+        budget = extraction_budget()
+        missing, produced = None, False
+        for part_url, part_params in parts:
+            try:
+                with self._data_parser(part_url, part_params, budget) as data_parser:
+                    yield from metrics.timed_iter(data_parser.iter_chunks(chunk_size), "parse")
+                produced = True
+            except DownloadError as e:
+                if e.status_code != 404 or len(parts) == 1:
+                    raise
+                missing = e
+        if not produced:
+            raise missing
+
+    def _iter_fetch_into_store(self, store: SeriesStore, url_data: str, plan: StorePlan, chunk_size: int,
+                               start_period: Optional[str], end_period: Optional[str]) -> Iterator[pd.DataFrame]:
+        """
+        Scarica la finestra non coperta scrivendo ogni blocco nello store mentre viene inviato al client,
+        così lo streaming non attende la fine del download. La finestra scaricata può essere più ampia di
+        quella richiesta: al client vanno solo le osservazioni richieste. La copertura viene registrata
+        solo se il download termina; un client disconnesso lascia la finestra da scaricare di nuovo.
+        """
+        requested_at = time.time()
+        dimensions = list(self.fr.series_keys.columns)
+        wider = (plan.start_period, plan.end_period) != (start_period, end_period)
+        for chunk in self._iter_parts(url_data, plan.params, chunk_size):
+            with metrics.stage("store"):
+                store.write(url_data, chunk, dimensions)
+            if wider:
+                chunk = select_window(chunk, start_period, end_period)
+                if chunk.empty:
+                    continue
+            yield chunk
+        store.commit(url_data, self.dataflow_id, dimensions, plan.start_period, plan.end_period, requested_at)
+
+    def _sync_store(self, store: SeriesStore, url_data: str,
+                    start_period: Optional[str], end_period: Optional[str]) -> None:
+        """
+        Allinea lo store locale prima di servire la richiesta: scarica la finestra non ancora coperta,
+        oppure, se i dati sono vecchi, le sole osservazioni nuove o riviste (`updatedAfter`).
+        Se il web service non supporta `updatedAfter` si riscarica dall'ultimo periodo presente.
+        In caso di errore durante un refresh viene servita la copia locale.
+        Le richieste concorrenti sugli stessi dati attendono un unico aggiornamento.
+        """
+        plan = store.plan(url_data, start_period, end_period)
+        if plan.mode == "local":
+            return
+
+        def sync() -> None:
+            requested_at = time.time()
+            dimensions = list(self.fr.series_keys.columns)
+            try:
+                self._download_into_store(store, url_data, plan.params, dimensions)
+            except Exception as e:
+                if plan.mode == "fetch":
+                    raise
+                if not self._refresh_fallback(store, url_data, plan, dimensions, e):
+                    # Il prossimo tentativo avverrà dopo un altro TTL, senza perdere le revisioni intermedie
+                    store.touch(url_data)
+                    return
+            store.commit(url_data, self.dataflow_id, dimensions, plan.start_period, plan.end_period, requested_at)
+
+        _store_syncs.do(url_data, sync)
+
+    def _refresh_fallback(self, store: SeriesStore, url_data: str, plan: StorePlan,
+                          dimensions: List[str], error: Exception) -> bool:
+        """Gestisce un refresh con `updatedAfter` non riuscito; ritorna True se lo store risulta aggiornato."""
+        if isinstance(error, DownloadError) and error.status_code == 404:
+            # Nessuna osservazione nuova o rivista dall'ultimo aggiornamento
+            return True
+        print(f"updatedAfter not available for {url_data} ({error}). Refreshing from the last period")
+        params = period_params(store.last_period(url_data) or plan.start_period, plan.end_period)
+        try:
+            self._download_into_store(store, url_data, params, dimensions)
+        except Exception as e:
+            print(f"Refresh failed for {url_data} ({e}). Serving local copy")
+            return False
+        return True
+
+    def _download_into_store(self, store: SeriesStore, url_data: str, params: Dict[str, str],
+                             dimensions: List[str]) -> None:
+        budget = extraction_budget()
+
+        def download(part_url: str, part_params: Dict[str, str]) -> None:
+            with self._data_parser(part_url, part_params, budget) as data_parser:
+                for chunk in metrics.timed_iter(data_parser.iter_chunks(STORE_CHUNK_ROWS), "parse"):
+                    with metrics.stage("store"):
+                        store.write(url_data, chunk, dimensions)
+
+        self._fetch_parts(self.query_parts(url_data, params), download)
+
+    def query_parts(self, url_data: str, params: Dict[str, str]) -> List[Tuple[str, Dict[str, str]]]:
+        """Sotto-richieste (URL, parametri) in cui dividere l'estrazione se troppo grande, vedi QueryPlanner."""
+        base_url, key = url_data.rsplit("/", 1)
+        parts = QueryPlanner(self.fr.context.series_index).plan(key, params)
+        if len(parts) > 1:
+            print(f"Splitting {url_data} into {len(parts)} sub-requests")
+        return [(f"{base_url}/{part.key}", part.params) for part in parts]
+
+    @staticmethod
+    def _fetch_parts(parts: List[Tuple[str, Dict[str, str]]], func: Callable[[str, Dict[str, str]], Any]) -> List[Any]:
+        """
+        Esegue `func(url, parametri)` su ciascuna sotto-richiesta, al più ISTAT_SPLIT_CONCURRENCY in parallelo.
+        Un 404 su una parte (nessun dato in quella parte) dà None; viene rilanciato se riguarda tutte le parti.
+        """
+        missing = []
+
+        def run(part: Tuple[str, Dict[str, str]]) -> Any:
+            try:
+                return func(*part)
+            except DownloadError as e:
+                if e.status_code != 404 or len(parts) == 1:
+                    raise
+                missing.append(e)
+                return None
+
+        results = bounded_map(run, parts, max_workers=SPLIT_CONCURRENCY)
+        if len(missing) == len(parts):
+            raise missing[0]
+        return results
+
+    def _parse_part(self, part_url: str, part_params: Dict[str, str], budget: ExtractionBudget) -> pd.DataFrame:
+        with self._data_parser(part_url, part_params, budget) as data_parser:
+            return parse_data(data_parser)
+
+    @contextmanager
+    def _data_parser(self, url_data: str, params: Optional[Dict[str, str]] = None,
+                     budget: Optional[ExtractionBudget] = None) -> Iterator[Union[ValuesParser, SdmxCsvParser]]:
+        """
+        Apre lo stream dei dati e ritorna il parser adatto al formato ricevuto, che conteggia righe
+        e byte in `budget` (condiviso tra le sotto-richieste di un'estrazione).
+
+        Con ISTAT_DATA_FORMAT=csv i dati vengono richiesti in SDMX-CSV; se il web service
+        risponde con un errore si ripiega su SDMX-ML, e se restituisce comunque XML
+        lo stesso stream viene letto con ValuesParser. Entrambi producono le stesse colonne.
+        Un 404 (nessun dato per la richiesta) viene rilanciato senza ripiego.
+        """
+        with ExitStack() as stack:
+            data_parser = None
+            if DATA_FORMAT == "csv":
+                downloader = Downloader(url_data, params=params or None, headers={"Accept": SdmxCsvParser.MEDIA_TYPE})
+                try:
+                    stream = stack.enter_context(downloader.stream())
+                except Exception as e:
+                    if isinstance(e, DownloadError) and e.status_code == 404:
+                        raise
+                    print(f"SDMX-CSV not available for {url_data} ({e}). Falling back to SDMX-ML")
+                else:
+                    data_parser = data_parser_for(stream, downloader.content_type, budget)
+            if data_parser is None:
+                stream = stack.enter_context(Downloader(url_data, params=params or None).stream())
+                data_parser = ValuesParser(stream, budget=budget or extraction_budget())
+            yield data_parser
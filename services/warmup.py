@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:14:36 2026
+
+@author: andreadesogus
+"""
+
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.cache import DEFAULT_TTLS, _ttls_from_env
+from services.dataflow_context import REFRESH_AHEAD, most_requested, needs_refresh, refresh_context
+from services.dataflow_service import DataflowRetriever
+
+# Dataflow da tenere sempre caldi, separati da virgola: "DATAFLOW_ID" oppure "DATAFLOW_ID:REF_ID"
+WARMUP_DATAFLOWS = [d.strip() for d in os.environ.get("ISTAT_WARMUP_DATAFLOWS", "").split(",") if d.strip()]
+# Numero di dataflow più richiesti nel worker da tenere caldi in aggiunta a quelli configurati
+WARMUP_TOP = int(os.environ.get("ISTAT_WARMUP_TOP", 5))
+# Intervallo in secondi tra due controlli del refresh
+WARMUP_INTERVAL = int(os.environ.get("ISTAT_WARMUP_INTERVAL", 300))
+# Attesa massima casuale prima del primo giro, per non far partire tutti i worker insieme
+WARMUP_JITTER = int(os.environ.get("ISTAT_WARMUP_JITTER", 10))
+
+
+class WarmupScheduler:
+    """
+    Scheduler in background che pre-carica i metadati più usati all'avvio e li rinnova prima della scadenza.
+
+    A ogni giro aggiorna il catalogo dei dataflow se prossimo alla scadenza, poi ricarica il contesto
+    (struttura, codelist, serie e indice delle serie) dei dataflow configurati e dei più richiesti che
+    non sono in memoria o che sono prossimi alla scadenza. Il nuovo contesto sostituisce il vecchio solo
+    a caricamento completato, quindi le richieste in corso continuano a usare i dati precedenti.
+
+    Il thread è `threading`: con il worker gevent di gunicorn diventa un greenlet.
+    """
+
+    def __init__(self, hot: Optional[List[str]] = None, top: int = WARMUP_TOP,
+                 interval: int = WARMUP_INTERVAL, jitter: int = WARMUP_JITTER) -> None:
+        self.hot = list(WARMUP_DATAFLOWS if hot is None else hot)
+        self.top = top
+        self.interval = interval
+        self.jitter = jitter
+        self.catalogue_ttl = dict(DEFAULT_TTLS, **_ttls_from_env())["dataflow"]
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._status: Dict[str, Any] = {"runs": 0, "refreshed": 0, "errors": 0, "last_run": None, "last_duration": None}
+
+    def hot_dataflows(self, catalogue: List[Dict[str, Any]]) -> List[Tuple[str, str]]:
+        """Coppie (dataflow_id, ref_id) da tenere calde: quelle configurate, poi le più richieste."""
+        ref_ids = {record["Dataflow ID"]: record["Ref ID"] for record in catalogue}
+        hot = []
+        for item in self.hot:
+            dataflow_id, _, ref_id = item.partition(":")
+            ref_id = ref_id or ref_ids.get(dataflow_id)
+            if ref_id is None:
+                print(f"Warm-up: dataflow {dataflow_id} non presente nel catalogo")
+                continue
+            hot.append((dataflow_id, ref_id))
+        hot.extend(most_requested(self.top))
+        return list(dict.fromkeys(hot))
+
+    def _refresh_catalogue(self) -> List[Dict[str, Any]]:
+        """Catalogo dei dataflow, ricaricato se la copia in memoria è prossima alla scadenza."""
+        return DataflowRetriever().catalogue(max_age=self.catalogue_ttl * REFRESH_AHEAD)
+
+    def run_once(self) -> None:
+        """Esegue un giro di warm-up/refresh; gli errori su un dataflow non interrompono gli altri."""
+        start_time = time.time()
+        refreshed = errors = 0
+        try:
+            catalogue = self._refresh_catalogue()
+            for dataflow_id, ref_id in self.hot_dataflows(catalogue):
+                if not needs_refresh(dataflow_id, ref_id):
+                    continue
+                try:
+                    refresh_context(dataflow_id, ref_id)
+                    refreshed += 1
+                except Exception as e:
+                    print(f"Warm-up failed for {dataflow_id}: {e}")
+                    errors += 1
+        except Exception as e:
+            print(f"Warm-up failed for the dataflow catalogue: {e}")
+            errors += 1
+        self._status["runs"] += 1
+        self._status["refreshed"] += refreshed
+        self._status["errors"] += errors
+        self._status["last_run"] = start_time
+        self._status["last_duration"] = time.time() - start_time
+        print(f"Warm-up completed in {self._status['last_duration']:.2f} seconds: {refreshed} dataflow refreshed")
+
+    def _loop(self) -> None:
+        if self._stop.wait(random.uniform(0, self.jitter)):
+            return
+        while True:
+            self.run_once()
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self) -> "WarmupScheduler":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="istat-warmup", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def status(self) -> Dict[str, Any]:
+        return dict(self._status, hot=self.hot, top=self.top, interval=self.interval)
+
+
+_scheduler: Optional[WarmupScheduler] = None
+_scheduler_pid: Optional[int] = None
+_scheduler_lock = threading.Lock()
+
+
+def start_warmup() -> Optional[WarmupScheduler]:
+    """
+    Avvia lo scheduler del processo corrente, una sola volta per worker.
+    Ritorna None se disabilitato tramite ISTAT_WARMUP_DISABLED.
+    """
+    global _scheduler, _scheduler_pid
+    if os.environ.get("ISTAT_WARMUP_DISABLED"):
+        return None
+    with _scheduler_lock:
+        if _scheduler is None or _scheduler_pid != os.getpid():
+            _scheduler = WarmupScheduler().start()
+            _scheduler_pid = os.getpid()
+    return _scheduler
+
+
+def get_scheduler() -> Optional[WarmupScheduler]:
+    return _scheduler if _scheduler_pid == os.getpid() else None